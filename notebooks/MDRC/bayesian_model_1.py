@@ -8,6 +8,7 @@ import arviz as az
 import matplotlib.pyplot as plt
 import pytensor.tensor as pt
 from scipy.special import expit
+from trace_cache import cached_trace, model_graph_id
 
 # ── 1) Data ─────────────────────────────────────────────────────────────────
 time_points = np.array([0, 63, 75, 81, 107, 113, 114, 114, 116, 117])
@@ -54,12 +55,19 @@ with pm.Model() as model:
     
     # Likelihood with device-specific noise
     pm.Normal('y', mu=score_mu, sigma=sigma_nu[device_idx], observed=y_obs)
-    
-    # Sample
-    trace = pm.sample(
-        tune=2000, draws=2000, chains=4,
-        target_accept=0.95, return_inferencedata=True
-    )
+
+# Sample, or reload the cached trace while model, data and settings are unchanged
+sampler = dict(tune=2000, draws=2000, chains=4, target_accept=0.95)
+
+
+def sample_model_1():
+    with model:
+        return pm.sample(**sampler, return_inferencedata=True)
+
+
+trace = cached_trace(model_graph_id('model_1_device_noise', model),
+                     {'time_points': time_points, 'y_obs': y_obs, 'time_idx': time_idx, 'device_idx': device_idx},
+                     sampler, sample_model_1)
 
 
 # ── 3) Sampling diagnostics ──────────────────────────────────────────────────
@@ -650,6 +658,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from scipy.special import expit
 import pytensor.tensor as pt  # Use pytensor instead of pm.math for set_subtensor
+from capability_model import latent_random_walk
 
 # For reproducibility
 np.random.seed(42)
@@ -696,26 +705,9 @@ with pm.Model() as model:
     # Prior for measurement noise
     sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1)
     
-    # Instead of using a direct capability approach with set_subtensor, use a scan approach
-    capabilities = [c_0]  # Start with initial capability
-    
-    # Model capability evolution over time as a manual random walk with drift
-    for t in range(1, T):
-        # Time difference between current and previous point
-        dt = time_points[t] - time_points[t-1]
-        
-        # Expected increment based on drift
-        drift = mu * dt
-        
-        # Process noise scaled by sqrt of time difference
-        noise_scale = sigma_omega * np.sqrt(dt)
-        
-        # Add new capability based on previous one
-        new_capability = capabilities[-1] + drift + pm.Normal(f'process_noise_{t}', 0, noise_scale)
-        capabilities.append(new_capability)
-    
-    # Stack all capabilities into a tensor
-    capability_latent = pm.Deterministic('capability_latent', pt.stack(capabilities))
+    # Capability evolution over time as a non-centered random walk with drift
+    capability_latent = latent_random_walk(time_points, c_0, mu, sigma_omega,
+                                           name='capability_latent', eps_name='process_noise')
     
     # Define the measurement model using logistic function
     # The mean of observed test scores based on capability
@@ -725,7 +717,7 @@ with pm.Model() as model:
     y = pm.Normal('y', mu=score_mean, sigma=sigma_nu, observed=y_obs)
     
     # Sample from the posterior
-    trace = pm.sample(2000, tune=1000, chains=4, cores=1, return_inferencedata=True)
+    trace = pm.sample(2000, tune=1000, chains=4, return_inferencedata=True)
 
 # Examine the results
 summary = az.summary(trace)
@@ -803,7 +795,7 @@ with pm.Model() as forecast_model:
     future_scores = pm.Deterministic('future_scores', pm.math.invlogit(g_forecast * future_capability_latent))
     
     # Sample from the forecast
-    forecast_trace = pm.sample(1000, tune=500, chains=2, cores=1, return_inferencedata=True)
+    forecast_trace = pm.sample(1000, tune=500, chains=2, return_inferencedata=True)
 
 # Extract forecast results
 future_capability_traces = forecast_trace.posterior['future_capability_latent'].values
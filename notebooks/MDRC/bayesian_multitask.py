@@ -6,172 +6,56 @@ import matplotlib.pyplot as plt
 import pytensor.tensor as pt
 from dateutil.relativedelta import relativedelta
 import matplotlib.dates as mdates
+from capability_model import prepare_data_multi
+from trace_cache import sample_model
+from capability_forecast import forecast_bands
 
 # 1) DATA PREP FOR MULTI-TASK --------------------------------
-def prepare_data_multi(df, task_ids, handle_nan='ignore'):
-
-    df2 = df[df['task_id'].isin(task_ids)][['task_id','Publication date','score']].copy()
-    if handle_nan == 'zero':
-        df2['score'] = df2['score'].fillna(0)
-    else:
-        df2 = df2.dropna(subset=['score'])
-    df2['Publication date'] = pd.to_datetime(df2['Publication date'])
-    df2 = df2.sort_values('Publication date')
-
-    # unified time axis (days since first date)
-    unique_dates = sorted(df2['Publication date'].unique())
-    first = unique_dates[0]
-    time_points = np.array([(d-first).days for d in unique_dates])
-    date_to_idx = {d:i for i,d in enumerate(unique_dates)}
-
-    # map each obs to time-index and task-index
-    time_idx = df2['Publication date'].map(date_to_idx).values
-    task_to_idx = {tid:i for i,tid in enumerate(task_ids)}
-    task_idx = df2['task_id'].map(task_to_idx).values
-
-    y_obs = df2['score'].values / 100.0
-    return time_points, y_obs, time_idx, task_idx, unique_dates
+# prepare_data_multi lives in capability_model
 
 # 2) MODEL FIT FOR MULTI-TASK --------------------------------
 def fit_capability_model_multi(time_points, y_obs, time_idx, task_idx,
-                               n_samples=2000, n_tune=1000, random_seed=42):
-    T = len(time_points)
-    K = len(np.unique(task_idx))
-
-    with pm.Model() as model:
-        # Priors
-        c0 = pm.Normal('c0', mu=-2.0, sigma=1.0)
-        mu = pm.Normal('mu', mu=0.02, sigma=0.01)
-        sigma_omega = pm.HalfCauchy('sigma_omega', beta=0.1)
-        g = pm.HalfNormal('g', sigma=1.0, shape=K)
-        sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1, shape=K)
-
-        # Latent random walk
-        caps = [c0]
-        for t in range(1, T):
-            dt = time_points[t] - time_points[t-1]
-            drift = mu * dt
-            eps = pm.Normal(f'eps_{t}', mu=0, sigma=sigma_omega * np.sqrt(dt))
-            caps.append(caps[-1] + drift + eps)
-        c_stack = pm.Deterministic('c', pt.stack(caps))
-
-        # Fitted mean for each observation
-        score_mean = pm.Deterministic(
-            'score_mean',
-            pm.math.invlogit(g[task_idx] * c_stack[time_idx])
-        )
-
-        # Observation
-        pm.Normal('y', mu=score_mean, sigma=sigma_nu[task_idx], observed=y_obs)
-
-        trace = pm.sample(
-            n_samples, tune=n_tune,
-            chains=4, cores=1,
-            random_seed=random_seed,
-            return_inferencedata=True
-        )
-    return trace
+                               n_samples=2000, n_tune=1000, random_seed=42, chains=4, cores=None, cache=True,
+                               method='nuts'):
+    # cores=None lets PyMC sample the chains in parallel (up to 4 if the CPUs allow);
+    # with cache=True an identical earlier fit is reloaded instead of resampled (see trace_cache);
+    # method='advi' / 'fullrank_advi' / 'pathfinder' / 'laplace' gives a fast approximate posterior
+    # with the same variables (see capability_inference), but far from NUTS for this model
+    if method != 'nuts':
+        print(f"Warning: {method} posteriors of the multi-task model are far from NUTS "
+              f"(see benchmark_inference.py), use method='nuts' for results")
+    data = {'time_points': time_points, 'y_obs': y_obs, 'time_idx': time_idx, 'task_idx': task_idx}
+    return sample_model('multi', data, method, cores=cores, cache=cache,
+                        draws=n_samples, tune=n_tune, chains=chains, random_seed=random_seed)
 
 def fit_capability_model_pooled(time_points, y_obs, time_idx,
-                                n_samples=2000, n_tune=1000, random_seed=42):
-    T = len(time_points)
-
-    with pm.Model() as model:
-        # --- PRIORS ---
-        c0           = pm.Normal('c0', mu=-2.0, sigma=1.0)
-        mu           = pm.Normal('mu', mu=0.02, sigma=0.01)
-        sigma_omega  = pm.HalfCauchy('sigma_omega', beta=0.1)
-        # now SHARED across all sensors:
-        g            = pm.HalfNormal('g', sigma=1.0)
-        sigma_nu     = pm.HalfCauchy('sigma_nu', beta=0.1)
-
-        # --- LATENT RANDOM WALK ---
-        caps = [c0]
-        for t in range(1, T):
-            dt   = time_points[t] - time_points[t-1]
-            drift = mu * dt
-            eps   = pm.Normal(f'eps_{t}', mu=0, sigma=sigma_omega * np.sqrt(dt))
-            caps.append(caps[-1] + drift + eps)
-        c_stack = pm.Deterministic('c', pt.stack(caps))
-
-        # --- MEASUREMENT MODEL (shared g & sigma_nu) ---
-        # For each observation we pick out the latent c at its time‐index:
-        c_for_obs   = c_stack[time_idx]
-        score_mean  = pm.Deterministic('score_mean',
-                                       pm.math.invlogit(g * c_for_obs))
-
-        pm.Normal('y', mu=score_mean,
-                        sigma=sigma_nu,
-                        observed=y_obs)
-
-        trace = pm.sample(n_samples, tune=n_tune,
-                          chains=4, cores=1,
-                          random_seed=random_seed,
-                          return_inferencedata=True)
-    return trace
-
-
-def simulate_forecast_from_posterior(trace, time_points, H=100, random_seed=42):
+                                n_samples=2000, n_tune=1000, random_seed=42, chains=4, cores=None, cache=True,
+                                method='nuts'):
+    # approximate methods are far from NUTS for this model too, see fit_capability_model_multi
+    if method != 'nuts':
+        print(f"Warning: {method} posteriors of the pooled model are far from NUTS "
+              f"(see benchmark_inference.py), use method='nuts' for results")
+    data = {'time_points': time_points, 'y_obs': y_obs, 'time_idx': time_idx}
+    return sample_model('pooled', data, method, cores=cores, cache=cache,
+                        draws=n_samples, tune=n_tune, chains=chains, random_seed=random_seed)
+
+
+def simulate_forecast_from_posterior(trace, time_points, H=100, random_seed=42, future_times=None):
     """
     Draw H‐step‐ahead forecasts from your fitted posterior.
+    Every posterior sample is simulated forward at once and reduced to bands chunk by chunk
+    (see capability_forecast.forecast_bands), so the (S, H, K) score cube is never held in memory.
+    Irregular forecast points can be given as future_times (days since the first date).
     Returns:
       future_times,
       (c_mean, c_lo, c_hi),
       (y_mean, y_lo, y_hi)
     """
-    # 1) Flatten chain+draw → sample
-    post = trace.posterior.stack(sample=("chain","draw"))
-    
-    # 2) Extract & transpose so that axis 0 == samples
-    c_arr = post["c"].values            # originally (T, S)
-    c_samples = c_arr.T                 # now (S, T)
-    
-    mu_samples    = post["mu"].values   # (S,)
-    sigma_samples = post["sigma_omega"].values  # (S,)
-    
-    g_arr = post["g"].values            # originally (K, S)
-    g_samples = g_arr.T                 # now (S, K)
-    
-    # 3) Quick sanity print
-    print("shapes:", 
-          "c",       c_samples.shape,
-          "mu",      mu_samples.shape,
-          "sigma",   sigma_samples.shape,
-          "g",       g_samples.shape)
-    
-    S, T = c_samples.shape
-    K    = g_samples.shape[1]
-    
-    np.random.seed(random_seed)
-    c_fore = np.zeros((S, H))
-    y_fore = np.zeros((S, H, K))
-    c_last = c_samples[:, -1]
-    
-    for s in range(S):
-        c = c_last[s]
-        μ = mu_samples[s]
-        σ = sigma_samples[s]
-        g = g_samples[s]   # shape (K,)
-        
-        for h in range(H):
-            c = c + μ + np.random.normal(0, σ)
-            c_fore[s, h]    = c
-            y_fore[s, h, :] = 1/(1 + np.exp(-g*c))
-    
-    # 4) Summarize to mean + 95% CI
-    def summarize(arr):
-        return (arr.mean(axis=0),
-                np.percentile(arr, 2.5, axis=0),
-                np.percentile(arr,97.5, axis=0))
-    
-    c_mean, c_lo, c_hi = summarize(c_fore)
-    y_mean, y_lo, y_hi = summarize(y_fore)
-    
-    # 5) Build future_times axis
-    last_t = time_points[-1]
-    future_times = np.arange(last_t+1, last_t+1+H)
-    
-    return future_times, (c_mean, c_lo, c_hi), (y_mean, y_lo, y_hi)
+    future_times, c_bands, y_bands = forecast_bands(
+        trace, time_points, horizon=H, future_times=future_times, random_seed=random_seed)
+    return (future_times,
+            (c_bands['mean'], c_bands[0.025], c_bands[0.975]),
+            (y_bands['mean'], y_bands[0.025], y_bands[0.975]))
 
 # 4) PLOTTING UTILITIES --------------------------------------
 def plot_raw_data_multi(time_points, y_obs, time_idx, task_idx, task_ids, dates):
@@ -286,113 +170,20 @@ def plot_forecast_simulated(trace, time_points, y_obs, time_idx, task_idx,
     plt.show()
 
 
-def simulate_forecast_from_pooled_posterior(trace, time_points, K, H=100, random_seed=42):
-    """
-    Draw H-step-ahead forecasts from a fitted pooled posterior.
-    Returns:
-      future_times,
-      (c_mean, c_lo, c_hi),
-      (y_mean, y_lo, y_hi)  # y[..., k] for each of the K tasks
-    """
-    # 1) Flatten chain+draw -> sample
-    post = trace.posterior.stack(sample=("chain", "draw"))
-
-    # 2) Extract & transpose so that axis 0 == samples
-    c_arr = post["c"].values            # (T, S)
-    c_samples = c_arr.T                  # (S, T)
-
-    mu_samples    = post["mu"].values   # (S,)
-    sigma_samples = post["sigma_omega"].values  # (S,)
-    g_samples     = post["g"].values    # (S,)
-
-    S, T = c_samples.shape
-
-    np.random.seed(random_seed)
-    c_fore = np.zeros((S, H))
-    y_fore = np.zeros((S, H, K))
-    c_last = c_samples[:, -1]
-
-    # 3) Simulate forward
-    for s in range(S):
-        c = c_last[s]
-        mu = mu_samples[s]
-        sigma = sigma_samples[s]
-        g = g_samples[s]
-        for h in range(H):
-            c = c + mu + np.random.normal(0, sigma)
-            c_fore[s, h] = c
-            y_val = 1 / (1 + np.exp(-g * c))
-            # replicate same forecast for each task
-            y_fore[s, h, :] = y_val
-
-    # 4) Summarize to mean + 95% CI
-    def summarize(arr):
-        return (arr.mean(axis=0),
-                np.percentile(arr, 2.5, axis=0),
-                np.percentile(arr, 97.5, axis=0))
-
-    c_mean, c_lo, c_hi = summarize(c_fore)
-    y_mean, y_lo, y_hi = summarize(y_fore)
-
-    # 5) Build future_times axis
-    future_times = np.arange(time_points[-1] + 1,
-                             time_points[-1] + 1 + H)
-
-    return future_times, (c_mean, c_lo, c_hi), (y_mean, y_lo, y_hi)
-
-def simulate_forecast_from_pooled_posterior(trace, time_points, K, H=100, random_seed=42):
+def simulate_forecast_from_pooled_posterior(trace, time_points, K, H=100, random_seed=42, future_times=None):
     """
     Draw H-step-ahead forecasts from a fitted pooled posterior.
+    Same as simulate_forecast_from_posterior, with the shared score forecast repeated for each task.
     Returns:
       future_times,
       (c_mean, c_lo, c_hi),
       (y_mean, y_lo, y_hi)  # y[..., k] for each of the K tasks
     """
-    # 1) Flatten chain+draw -> sample
-    post = trace.posterior.stack(sample=("chain", "draw"))
-
-    # 2) Extract & transpose so that axis 0 == samples
-    c_arr = post["c"].values            # (T, S)
-    c_samples = c_arr.T                  # (S, T)
-
-    mu_samples    = post["mu"].values   # (S,)
-    sigma_samples = post["sigma_omega"].values  # (S,)
-    g_samples     = post["g"].values    # (S,)
-
-    S, T = c_samples.shape
-
-    np.random.seed(random_seed)
-    c_fore = np.zeros((S, H))
-    y_fore = np.zeros((S, H, K))
-    c_last = c_samples[:, -1]
-
-    # 3) Simulate forward
-    for s in range(S):
-        c = c_last[s]
-        mu = mu_samples[s]
-        sigma = sigma_samples[s]
-        g = g_samples[s]
-        for h in range(H):
-            c = c + mu + np.random.normal(0, sigma)
-            c_fore[s, h] = c
-            y_val = 1 / (1 + np.exp(-g * c))
-            # replicate same forecast for each task
-            y_fore[s, h, :] = y_val
-
-    # 4) Summarize to mean + 95% CI
-    def summarize(arr):
-        return (arr.mean(axis=0),
-                np.percentile(arr, 2.5, axis=0),
-                np.percentile(arr, 97.5, axis=0))
-
-    c_mean, c_lo, c_hi = summarize(c_fore)
-    y_mean, y_lo, y_hi = summarize(y_fore)
-
-    # 5) Build future_times axis
-    future_times = np.arange(time_points[-1] + 1,
-                             time_points[-1] + 1 + H)
-
-    return future_times, (c_mean, c_lo, c_hi), (y_mean, y_lo, y_hi)
+    future_times, c_bands, y_bands = forecast_bands(
+        trace, time_points, horizon=H, future_times=future_times, n_tasks=K, random_seed=random_seed)
+    return (future_times,
+            (c_bands['mean'], c_bands[0.025], c_bands[0.975]),
+            (y_bands['mean'], y_bands[0.025], y_bands[0.975]))
 
 def plot_forecast_simulated_pooled(trace, time_points, y_obs, time_idx,
                                    task_idx, task_ids, dates,
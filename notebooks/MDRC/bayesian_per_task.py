@@ -21,56 +21,12 @@ import arviz as az
 import matplotlib.pyplot as plt
 import pytensor.tensor as pt
 from datetime import datetime
+from capability_model import latent_random_walk, prepare_data
+from trace_cache import sample_model
+from capability_forecast import forecast_from_posterior
 
-def prepare_data(df, task_id, handle_nan='ignore'):
-    """
-    Prepare data for the model from a dataframe.
-    
-    Parameters:
-    -----------
-    df : pandas DataFrame
-        DataFrame containing the data
-    task_id : int
-        ID of the task to analyze
-    handle_nan : str, optional
-        How to handle NaN values: 'ignore' (remove them) or 'zero' (replace with 0)
-        
-    Returns:
-    --------
-    time_points : numpy array
-        Array of time points in days since the first observation
-    y_obs : numpy array
-        Array of observed test scores
-    dates : list
-        List of publication dates
-    """
-    # Filter data for the specific task
-    task_df = df[df['task_id'] == task_id][['Publication date', 'score']].copy()
-    
-    # Handle NaN values
-    if handle_nan == 'zero':
-        task_df['score'] = task_df['score'].fillna(0)
-    elif handle_nan == 'ignore':
-        task_df = task_df.dropna(subset=['score'])
-    
-    # Convert publication dates to datetime
-    task_df['Publication date'] = pd.to_datetime(task_df['Publication date'])
-    
-    # Sort by date
-    task_df = task_df.sort_values('Publication date')
-    
-    # Calculate days since first observation
-    first_date = task_df['Publication date'].min()
-    task_df['days'] = (task_df['Publication date'] - first_date).dt.days
-    
-    # Extract data
-    time_points = task_df['days'].values
-    y_obs = task_df['score'].values / 100.0  # Normalize scores to [0,1]
-    dates = task_df['Publication date'].tolist()
-    
-    return time_points, y_obs, dates
-
-def fit_capability_model(time_points, y_obs, n_samples=2000, n_tune=1000, n_chains=4, random_seed=42):
+def fit_capability_model(time_points, y_obs, n_samples=2000, n_tune=1000, n_chains=4, random_seed=42, cores=None,
+                         cache=True, method='nuts'):
     """
     Fit the Bayesian state space model for technology capability.
     
@@ -88,6 +44,13 @@ def fit_capability_model(time_points, y_obs, n_samples=2000, n_tune=1000, n_chai
         Number of chains
     random_seed : int, optional
         Random seed for reproducibility
+    cores : int, optional
+        Number of chains sampled in parallel (PyMC default: up to 4 if the CPUs allow)
+    cache : bool, optional
+        Reload the trace of an identical earlier fit (same data, model and settings, see trace_cache)
+    method : str, optional
+        'nuts', or a faster approximation for exploratory fits: 'advi', 'fullrank_advi', 'pathfinder'
+        or 'laplace' (see capability_inference); the trace has the same variables either way
         
     Returns:
     --------
@@ -97,62 +60,19 @@ def fit_capability_model(time_points, y_obs, n_samples=2000, n_tune=1000, n_chai
     # Set random seed for reproducibility
     np.random.seed(random_seed)
     
-    T = len(time_points)
-    
-    with pm.Model() as model:
-        # Prior for initial capability (c_0)
-        # We expect initial capability to be negative as test scores may start below 0.5
-        c_0 = pm.Normal('c_0', mu=-2.0, sigma=1.0)
-        
-        # Prior for drift parameter (average rate of technological improvement)
-        mu = pm.Normal('mu', mu=0.02, sigma=0.01)  # Small positive drift
-        
-        # Prior for process noise (uncertainty in capability evolution)
-        sigma_omega = pm.HalfCauchy('sigma_omega', beta=0.1)
-        
-        # Prior for discrimination parameter (test sensitivity)
-        g = pm.HalfNormal('g', sigma=1.0)
-        
-        # Prior for measurement noise
-        sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1)
-        
-        # Initialize capabilities list with initial capability
-        capabilities = [c_0]
-        
-        # Model capability evolution over time as a manual random walk with drift
-        for t in range(1, T):
-            # Time difference between current and previous point
-            dt = time_points[t] - time_points[t-1]
-            
-            # Expected increment based on drift
-            drift = mu * dt
-            
-            # Process noise scaled by sqrt of time difference
-            noise_scale = sigma_omega * np.sqrt(dt)
-            
-            # Add new capability based on previous one
-            new_capability = capabilities[-1] + drift + pm.Normal(f'process_noise_{t}', 0, noise_scale)
-            capabilities.append(new_capability)
-        
-        # Stack all capabilities into a tensor
-        capability_latent = pm.Deterministic('capability_latent', pt.stack(capabilities))
-        
-        # Define the measurement model using logistic function
-        # The mean of observed test scores based on capability
-        score_mean = pm.Deterministic('score_mean', pm.math.invlogit(g * capability_latent))
-        
-        # Observed test scores with measurement noise
-        y = pm.Normal('y', mu=score_mean, sigma=sigma_nu, observed=y_obs)
-        
-        # Sample from the posterior
-        trace = pm.sample(n_samples, tune=n_tune, chains=n_chains, cores=1, random_seed=random_seed, return_inferencedata=True)
+    # Sample from the posterior (or reload an identical earlier fit)
+    trace = sample_model('per_task', {'time_points': time_points, 'y_obs': y_obs}, method, cores=cores, cache=cache,
+                         draws=n_samples, tune=n_tune, chains=n_chains, random_seed=random_seed)
     
     return trace
 
-def forecast_capability(trace, time_points, forecast_horizon=100, random_seed=42):
+def forecast_capability(trace, time_points, forecast_horizon=100, random_seed=42, future_times=None):
     """
     Forecast future capabilities based on the fitted model.
     
+    Draws the forecast directly from the posterior (see capability_forecast.forecast_from_posterior):
+    every posterior sample is simulated forward, so no second model has to be sampled.
+    
     Parameters:
     -----------
     trace : InferenceData
@@ -163,56 +83,19 @@ def forecast_capability(trace, time_points, forecast_horizon=100, random_seed=42
         Number of days to forecast
     random_seed : int, optional
         Random seed for reproducibility
+    future_times : numpy array, optional
+        Irregular forecast time points (days since the first observation) instead of a daily horizon
         
     Returns:
     --------
-    forecast_trace : InferenceData
-        Trace of the forecast model
+    forecast : dict
+        Forecast draws and bands (see capability_forecast.forecast_from_posterior)
     future_times : numpy array
         Array of future time points
     """
-    # Set random seed for reproducibility
-    np.random.seed(random_seed)
-    
-    # Extract capability estimates
-    capability_traces = trace.posterior['capability_latent'].values
-    capability_mean = capability_traces.mean(axis=(0, 1))
-    
-    # Define future time points
-    future_times = np.arange(time_points[-1] + 1, time_points[-1] + 1 + forecast_horizon)
-    future_dt = np.diff(future_times, prepend=time_points[-1])
-    
-    with pm.Model() as forecast_model:
-        # Use posterior means as starting points for parameter priors
-        mu_forecast = pm.Normal('mu_forecast', mu=trace.posterior['mu'].mean().item(),
-                               sigma=0.01)
-        sigma_omega_forecast = pm.HalfCauchy('sigma_omega_forecast',
-                                            beta=trace.posterior['sigma_omega'].mean().item())
-        g_forecast = pm.HalfNormal('g_forecast', sigma=trace.posterior['g'].mean().item())
-        
-        # Start with the last estimated capability
-        c_last = pm.Normal('c_last', mu=capability_mean[-1], sigma=0.1)
-        
-        # Initialize future capabilities list
-        future_capabilities = [c_last]
-        
-        # Model future capability evolution
-        for t in range(1, forecast_horizon):
-            # Time difference is 1 in the future projection
-            new_capability = future_capabilities[-1] + mu_forecast * future_dt[t] + \
-                             pm.Normal(f'future_noise_{t}', 0, sigma_omega_forecast * np.sqrt(future_dt[t]))
-            future_capabilities.append(new_capability)
-        
-        # Stack all future capabilities into a tensor
-        future_capability_latent = pm.Deterministic('future_capability_latent', pt.stack(future_capabilities))
-        
-        # Future test scores
-        future_scores = pm.Deterministic('future_scores', pm.math.invlogit(g_forecast * future_capability_latent))
-        
-        # Sample from the forecast
-        forecast_trace = pm.sample(1000, tune=500, chains=2, cores=1, random_seed=random_seed, return_inferencedata=True)
-    
-    return forecast_trace, future_times
+    forecast = forecast_from_posterior(trace, time_points, horizon=forecast_horizon, future_times=future_times,
+                                       capability_var='capability_latent', random_seed=random_seed)
+    return forecast, forecast['times']
 
 def plot_raw_data(time_points, y_obs, dates=None):
     """
@@ -330,7 +213,7 @@ def plot_model_fit(time_points, y_obs, trace, dates=None):
     plt.tight_layout()
     plt.show()
 
-def plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates=None):
+def plot_forecast(time_points, y_obs, trace, forecast, future_times, dates=None):
     """
     Plot the historical data and forecast.
     
@@ -342,8 +225,8 @@ def plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates
         Array of observed test scores
     trace : InferenceData
         Trace of the fitted model
-    forecast_trace : InferenceData
-        Trace of the forecast model
+    forecast : dict
+        Forecast returned by forecast_capability
     future_times : numpy array
         Array of future time points
     dates : list, optional
@@ -360,16 +243,15 @@ def plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates
     score_lower = np.percentile(trace.posterior['score_mean'].values, 2.5, axis=(0, 1))
     score_upper = np.percentile(trace.posterior['score_mean'].values, 97.5, axis=(0, 1))
     
-    # Extract forecast capability estimates and credible intervals
-    future_capability_traces = forecast_trace.posterior['future_capability_latent'].values
-    future_capability_mean = future_capability_traces.mean(axis=(0, 1))
-    future_capability_lower = np.percentile(future_capability_traces, 2.5, axis=(0, 1))
-    future_capability_upper = np.percentile(future_capability_traces, 97.5, axis=(0, 1))
+    # Forecast capability estimates and credible intervals
+    future_capability_mean = forecast['capability_bands']['mean']
+    future_capability_lower = forecast['capability_bands'][0.025]
+    future_capability_upper = forecast['capability_bands'][0.975]
     
-    # Extract forecast score estimates and credible intervals
-    future_scores_mean = forecast_trace.posterior['future_scores'].mean(dim=('chain', 'draw')).values
-    future_scores_lower = np.percentile(forecast_trace.posterior['future_scores'].values, 2.5, axis=(0, 1))
-    future_scores_upper = np.percentile(forecast_trace.posterior['future_scores'].values, 97.5, axis=(0, 1))
+    # Forecast score estimates and credible intervals
+    future_scores_mean = forecast['score_bands']['mean']
+    future_scores_lower = forecast['score_bands'][0.025]
+    future_scores_upper = forecast['score_bands'][0.975]
     
     # Plot combined history and forecast
     plt.figure(figsize=(14, 6))
@@ -430,28 +312,28 @@ def plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates
     plt.tight_layout()
     plt.show()
 
-def print_forecast_results(forecast_trace, future_times, first_date):
+def print_forecast_results(forecast, future_times, first_date):
     """
     Print key forecast results.
     
     Parameters:
     -----------
-    forecast_trace : InferenceData
-        Trace of the forecast model
+    forecast : dict
+        Forecast returned by forecast_capability
     future_times : numpy array
         Array of future time points
     first_date : datetime
         First date in the dataset (to calculate future dates)
     """
-    # Extract forecast parameters
-    mu_mean = forecast_trace.posterior['mu_forecast'].mean().item()
-    g_mean = forecast_trace.posterior['g_forecast'].mean().item()
-    sigma_omega_mean = forecast_trace.posterior['sigma_omega_forecast'].mean().item()
+    # Posterior means of the parameters driving the forecast
+    mu_mean = forecast['mu'].mean()
+    g_mean = forecast['g'].mean()
+    sigma_omega_mean = forecast['sigma_omega'].mean()
     
-    # Extract future scores
-    future_scores_mean = forecast_trace.posterior['future_scores'].mean(dim=('chain', 'draw')).values
-    future_scores_lower = np.percentile(forecast_trace.posterior['future_scores'].values, 2.5, axis=(0, 1))
-    future_scores_upper = np.percentile(forecast_trace.posterior['future_scores'].values, 97.5, axis=(0, 1))
+    # Future scores
+    future_scores_mean = forecast['score_bands']['mean']
+    future_scores_lower = forecast['score_bands'][0.025]
+    future_scores_upper = forecast['score_bands'][0.975]
     
     # Print key forecast parameters
     print("\nForecast Parameters:")
@@ -526,22 +408,22 @@ def run_analysis(df, task_id, handle_nan='ignore', forecast_horizon=100):
     plot_model_fit(time_points, y_obs, trace, dates)
     
     # Generate forecast
-    forecast_trace, future_times = forecast_capability(trace, time_points, forecast_horizon)
+    forecast, future_times = forecast_capability(trace, time_points, forecast_horizon)
     
     # Plot forecast
-    plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates)
+    plot_forecast(time_points, y_obs, trace, forecast, future_times, dates)
     
     # Print forecast results
-    print_forecast_results(forecast_trace, future_times, dates[0])
+    print_forecast_results(forecast, future_times, dates[0])
     
-    return trace, forecast_trace, time_points, y_obs, future_times, dates
+    return trace, forecast, time_points, y_obs, future_times, dates
 
 # Example of how to use this with your dataframe:
 
 
 
 # Run analysis for a specific task, ignoring NaN values
-trace, forecast_trace, time_points, y_obs, future_times, dates = run_analysis(
+trace, forecast, time_points, y_obs, future_times, dates = run_analysis(
     df, 
     task_id=16246, 
     handle_nan='ignore',  # or 'zero' to replace NaNs with 0
@@ -551,10 +433,10 @@ trace, forecast_trace, time_points, y_obs, future_times, dates = run_analysis(
 
 
 
-forecast_trace, future_times = forecast_capability(trace, time_points, 100)
+forecast, future_times = forecast_capability(trace, time_points, 100)
 
 # Plot forecast
-plot_forecast(time_points, y_obs, trace, forecast_trace, future_times, dates)
+plot_forecast(time_points, y_obs, trace, forecast, future_times, dates)
 
 
 ######
@@ -600,26 +482,9 @@ with pm.Model() as model:
     # Prior for measurement noise
     sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1)
 
-    # Instead of using a direct capability approach with set_subtensor, use a scan approach
-    capabilities = [c_0]  # Start with initial capability
-
-    # Model capability evolution over time as a manual random walk with drift
-    for t in range(1, T):
-        # Time difference between current and previous point
-        dt = time_points[t] - time_points[t-1]
-
-        # Expected increment based on drift
-        drift = mu * dt
-
-        # Process noise scaled by sqrt of time difference
-        noise_scale = sigma_omega * np.sqrt(dt)
-
-        # Add new capability based on previous one
-        new_capability = capabilities[-1] + drift + pm.Normal(f'process_noise_{t}', 0, noise_scale)
-        capabilities.append(new_capability)
-
-    # Stack all capabilities into a tensor
-    capability_latent = pm.Deterministic('capability_latent', pt.stack(capabilities))
+    # Capability evolution over time as a non-centered random walk with drift
+    capability_latent = latent_random_walk(time_points, c_0, mu, sigma_omega,
+                                           name='capability_latent', eps_name='process_noise')
 
     # Define the measurement model using logistic function
     # The mean of observed test scores based on capability
@@ -629,7 +494,7 @@ with pm.Model() as model:
     y = pm.Normal('y', mu=score_mean, sigma=sigma_nu, observed=y_obs)
 
     # Sample from the posterior
-    trace = pm.sample(2000, tune=1000, chains=4, cores=1, return_inferencedata=True)
+    trace = pm.sample(2000, tune=1000, chains=4, return_inferencedata=True)
 
 # Examine the results
 summary = az.summary(trace)
@@ -677,47 +542,18 @@ plt.show()
 # Define how many time points to forecast into the future
 forecast_horizon = 50
 future_times = np.arange(time_points[-1] + 1, time_points[-1] + 1 + forecast_horizon)
-future_dt = np.diff(future_times, prepend=time_points[-1])
 
-with pm.Model() as forecast_model:
-    # Use posterior means as starting points for parameter priors
-    mu_forecast = pm.Normal('mu_forecast', mu=trace.posterior['mu'].mean().item(),
-                           sigma=0.01)
-    sigma_omega_forecast = pm.HalfCauchy('sigma_omega_forecast',
-                                        beta=trace.posterior['sigma_omega'].mean().item())
-    g_forecast = pm.HalfNormal('g_forecast', sigma=trace.posterior['g'].mean().item())
-
-    # Start with the last estimated capability
-    c_last = pm.Normal('c_last', mu=capability_mean[-1], sigma=0.1)
-
-    # Initialize future capabilities list
-    future_capabilities = [c_last]
-
-    # Model future capability evolution
-    for t in range(1, forecast_horizon):
-        # Time difference is 1 in the future projection
-        new_capability = future_capabilities[-1] + mu_forecast * future_dt[t] + \
-                         pm.Normal(f'future_noise_{t}', 0, sigma_omega_forecast * np.sqrt(future_dt[t]))
-        future_capabilities.append(new_capability)
-
-    # Stack all future capabilities into a tensor
-    future_capability_latent = pm.Deterministic('future_capability_latent', pt.stack(future_capabilities))
-
-    # Future test scores
-    future_scores = pm.Deterministic('future_scores', pm.math.invlogit(g_forecast * future_capability_latent))
-
-    # Sample from the forecast
-    forecast_trace = pm.sample(1000, tune=500, chains=2, cores=1, return_inferencedata=True)
+# Simulate every posterior sample forward
+forecast = forecast_from_posterior(trace, time_points, future_times=future_times, capability_var='capability_latent')
 
 # Extract forecast results
-future_capability_traces = forecast_trace.posterior['future_capability_latent'].values
-future_capability_mean = future_capability_traces.mean(axis=(0, 1))
-future_capability_lower = np.percentile(future_capability_traces, 2.5, axis=(0, 1))
-future_capability_upper = np.percentile(future_capability_traces, 97.5, axis=(0, 1))
-
-future_scores_mean = forecast_trace.posterior['future_scores'].mean(dim=('chain', 'draw')).values
-future_scores_lower = np.percentile(forecast_trace.posterior['future_scores'].values, 2.5, axis=(0, 1))
-future_scores_upper = np.percentile(forecast_trace.posterior['future_scores'].values, 97.5, axis=(0, 1))
+future_capability_mean = forecast['capability_bands']['mean']
+future_capability_lower = forecast['capability_bands'][0.025]
+future_capability_upper = forecast['capability_bands'][0.975]
+
+future_scores_mean = forecast['score_bands']['mean']
+future_scores_lower = forecast['score_bands'][0.025]
+future_scores_upper = forecast['score_bands'][0.975]
 
 # Plot combined history and forecast
 plt.figure(figsize=(12, 5))
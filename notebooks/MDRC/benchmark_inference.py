@@ -0,0 +1,108 @@
+import time
+import numpy as np
+import pandas as pd
+from capability_inference import METHODS
+from fit_tasks import SCORES_PATH, batch_data
+from trace_cache import sample_model
+
+OUTPUT_PATH = '../../results/tables/inference_benchmark.csv'
+# scalar parameters and capability path of each spec
+COMPARED_VARS = {
+    'per_task': ['c_0', 'mu', 'sigma_omega', 'g', 'sigma_nu', 'capability_latent'],
+    'multi': ['c0', 'mu', 'sigma_omega', 'g', 'sigma_nu', 'c'],
+    'pooled': ['c0', 'mu', 'sigma_omega', 'g', 'sigma_nu', 'c'],
+}
+
+
+def posterior_agreement(trace, reference, var_names):
+    """
+    Compares an approximate posterior with the reference (NUTS) posterior, per variable.
+
+    Returns:
+    --------
+    rows : list of dict
+        'var', 'max_z' (largest |mean - mean_ref| / sd_ref over the variable's elements)
+        and 'sd_ratio' (median sd / sd_ref)
+    """
+    rows = []
+    for var in var_names:
+        values = trace.posterior[var].values
+        ref = reference.posterior[var].values
+        values = values.reshape(-1, int(np.prod(values.shape[2:])))
+        ref = ref.reshape(-1, int(np.prod(ref.shape[2:])))
+        ref_sd = ref.std(axis=0)
+        rows.append({
+            'var': var,
+            'max_z': float(np.max(np.abs(values.mean(axis=0) - ref.mean(axis=0)) / ref_sd)),
+            'sd_ratio': float(np.median(values.std(axis=0) / ref_sd)),
+        })
+    return rows
+
+
+def benchmark(fits, methods=METHODS, **sampler):
+    """
+    Fits every model with every inference method and compares wall time and posterior with NUTS.
+
+    Parameters:
+    -----------
+    fits : list of tuple
+        (label, spec, data) with data as returned by fit_tasks.batch_data
+    methods : tuple, optional
+        Inference methods, see capability_inference.METHODS ('nuts' is always fitted as the reference)
+    **sampler :
+        draws, tune, chains, random_seed, ... (see capability_inference.run_inference)
+
+    Returns:
+    --------
+    results : pandas DataFrame
+        One row per fit, method and compared variable; a method that failed gets one row with its 'error'
+    """
+    rows = []
+    for label, spec, data in fits:
+        traces, seconds, errors = {}, {}, {}
+        for method in ('nuts',) + tuple(m for m in methods if m != 'nuts'):
+            start = time.perf_counter()
+            try:
+                traces[method] = sample_model(spec, data, method, cache=False, progressbar=False, **sampler)
+            except Exception as e:
+                print(f"{label} / {method} failed: {e}")
+                errors[method] = str(e).splitlines()[0]
+                continue
+            seconds[method] = time.perf_counter() - start
+            print(f"{label} / {method}: {seconds[method]:.1f}s")
+        if 'nuts' not in traces:
+            print(f"{label}: no NUTS reference, skipped")
+            continue
+
+        for method, trace in traces.items():
+            for row in posterior_agreement(trace, traces['nuts'], COMPARED_VARS[spec]):
+                rows.append(dict(fit=label, spec=spec, method=method, seconds=seconds[method],
+                                 speedup=seconds['nuts'] / seconds[method], **row))
+        for method, error in errors.items():
+            rows.append(dict(fit=label, spec=spec, method=method, error=error))
+    results = pd.DataFrame(rows)
+    if 'error' not in results:
+        results['error'] = None
+    return results
+
+
+if __name__ == "__main__":
+    df = pd.read_csv(SCORES_PATH)
+
+    # a few single tasks with the most scores and the largest occupation group, pooled and multi-task
+    task_ids = df.dropna(subset=['score'])['task_id'].value_counts().index[:3].tolist()
+    group = df['occupation_category'].value_counts().index[0]
+    fits = [(f"task {task_id}", 'per_task', batch_data(df, 'per_task', task_id)) for task_id in task_ids]
+    fits.append((f"{group} (pooled)", 'pooled', batch_data(df, 'pooled', group, handle_nan='zero')))
+    fits.append((f"{group} (multi)", 'multi', batch_data(df, 'multi', group)))
+
+    results = benchmark(fits, draws=1000, tune=1000, chains=4, random_seed=42)
+    results.to_csv(OUTPUT_PATH, index=False)
+
+    # one line per fit and method: wall time and worst agreement over the compared variables
+    summary = results.groupby(['fit', 'method'], sort=False).agg(
+        seconds=('seconds', 'first'), speedup=('speedup', 'first'),
+        max_z=('max_z', 'max'), min_sd_ratio=('sd_ratio', 'min'), max_sd_ratio=('sd_ratio', 'max'),
+        error=('error', 'first'))
+    print(summary.round(2).to_string())
+    print(f"Saved to {OUTPUT_PATH}")
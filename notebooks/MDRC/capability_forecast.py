@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+
+DEFAULT_QUANTILES = (0.025, 0.5, 0.975)
+
+
+def posterior_samples(trace, capability_var='c'):
+    """
+    Flattens the posterior draws a forecast needs into arrays with the samples on axis 0.
+
+    Parameters:
+    -----------
+    trace : InferenceData
+        Trace of a fitted capability model
+    capability_var : str, optional
+        Name of the latent capability path ('capability_latent' in bayesian_per_task, 'c' in bayesian_multitask)
+
+    Returns:
+    --------
+    samples : dict
+        'c_last' (S,), 'mu' (S,), 'sigma_omega' (S,) and 'g' (S,) or (S, K)
+    """
+    post = trace.posterior
+    n_chains, n_draws = post.sizes['chain'], post.sizes['draw']
+    S = n_chains * n_draws
+    capability = post[capability_var].values.reshape(S, -1)
+    g = post['g'].values.reshape(S, -1)
+    return {
+        'c_last': capability[:, -1],
+        'mu': post['mu'].values.reshape(S),
+        'sigma_omega': post['sigma_omega'].values.reshape(S),
+        # shared discrimination (chain, draw) or one per task (chain, draw, K)
+        'g': g[:, 0] if post['g'].ndim == 2 else g,
+    }
+
+
+def dates_to_times(dates, first_date):
+    """
+    Converts dates to (fractional) days since first_date, the time axis of the capability models.
+    """
+    delta = pd.to_datetime(pd.Series(dates)) - pd.Timestamp(first_date)
+    return (delta.dt.total_seconds() / 86400.0).to_numpy()
+
+
+def future_time_axis(time_points, horizon=None, future_times=None, future_dates=None, first_date=None):
+    """
+    Forecast time points: the given future_times, future_dates converted with first_date,
+    or one point per day for `horizon` days after the last observation.
+    """
+    if future_dates is not None:
+        if first_date is None:
+            raise ValueError("first_date is needed to convert future_dates to days")
+        future_times = dates_to_times(future_dates, first_date)
+    if future_times is None:
+        future_times = np.arange(time_points[-1] + 1, time_points[-1] + 1 + horizon)
+    future_times = np.asarray(future_times, dtype=float)
+    if np.any(np.diff(future_times) < 0) or future_times[0] < time_points[-1]:
+        raise ValueError("future times must be sorted and not before the last observation")
+    return future_times
+
+
+def simulate_paths(samples, last_time, future_times, random_seed=42):
+    """
+    Simulates the latent random walk forward from every posterior sample at once.
+
+    c[h] = c[h-1] + mu * dt[h] + sigma_omega * sqrt(dt[h]) * eps[h], started at the sample's last
+    in-sample capability, as the cumulative sum of an (S, H) matrix of increments.
+
+    Returns:
+    --------
+    capability : numpy array
+        (S, H) simulated capabilities
+    """
+    rng = np.random.default_rng(random_seed)
+    return _walk_chunk(samples, samples['c_last'], np.diff(future_times, prepend=last_time), rng)
+
+
+def _walk_chunk(samples, c_start, dt, rng):
+    # noise is drawn time-major, so simulating the horizon in chunks gives the same paths as in one go
+    noise = rng.standard_normal((len(dt), len(c_start))).T
+    increments = samples['mu'][:, None] * dt + samples['sigma_omega'][:, None] * np.sqrt(dt) * noise
+    return c_start[:, None] + np.cumsum(increments, axis=1)
+
+
+def summarize_draws(draws, quantiles=DEFAULT_QUANTILES):
+    """
+    Mean and quantile bands over the samples (axis 0) of forecast draws.
+
+    Returns:
+    --------
+    bands : dict
+        'mean' and one entry per quantile, each of shape draws.shape[1:]
+    """
+    bands = {'mean': draws.mean(axis=0)}
+    for q, values in zip(quantiles, np.quantile(draws, quantiles, axis=0)):
+        bands[q] = values
+    return bands
+
+
+def forecast_from_posterior(trace, time_points, horizon=100, future_times=None, future_dates=None,
+                            first_date=None, capability_var='c', quantiles=DEFAULT_QUANTILES,
+                            random_seed=42):
+    """
+    Posterior-predictive forecast of capability and test scores, without refitting or resampling.
+
+    Every posterior sample (c_last, mu, sigma_omega, g) is propagated forward, so the forecast bands
+    include the parameter uncertainty. Forecast times may be irregular.
+
+    Parameters:
+    -----------
+    trace : InferenceData
+        Trace of the fitted model
+    time_points : numpy array
+        Time points used for fitting (days since first_date)
+    horizon : int, optional
+        Number of daily steps to forecast if neither future_times nor future_dates are given
+    future_times : array, optional
+        Forecast time points in days since the first observation
+    future_dates : list, optional
+        Forecast dates (converted with first_date)
+    first_date : datetime, optional
+        Date of time point 0
+    capability_var : str, optional
+        Name of the latent capability path in the trace
+    quantiles : tuple, optional
+        Quantiles of the forecast bands
+    random_seed : int, optional
+        Random seed for reproducibility
+
+    Returns:
+    --------
+    forecast : dict
+        'times' (H,), 'capability' (S, H), 'scores' (S, H) or (S, H, K) for task-specific g,
+        the parameter samples, and 'capability_bands' / 'score_bands' (see summarize_draws)
+    """
+    samples = posterior_samples(trace, capability_var)
+    times = future_time_axis(time_points, horizon, future_times, future_dates, first_date)
+    capability = simulate_paths(samples, time_points[-1], times, random_seed)
+    g = samples['g']
+    scores = expit(g[:, None] * capability) if g.ndim == 1 else expit(g[:, None, :] * capability[:, :, None])
+    return dict(samples, times=times, capability=capability, scores=scores,
+                capability_bands=summarize_draws(capability, quantiles),
+                score_bands=summarize_draws(scores, quantiles))
+
+
+def forecast_bands(trace, time_points, horizon=100, future_times=None, future_dates=None, first_date=None,
+                   capability_var='c', n_tasks=None, quantiles=DEFAULT_QUANTILES, random_seed=42,
+                   max_cells=20_000_000):
+    """
+    Forecast bands of capability and per-task test scores without keeping all forecast draws.
+
+    The horizon is simulated in chunks, continuing the random walk from the end of the previous chunk,
+    and every chunk is reduced to its mean and quantiles before the next one is drawn, so at most
+    `max_cells` scores (samples x steps x tasks) are held at once. The bands are exact (the same as
+    summarize_draws on the output of forecast_from_posterior with the same seed).
+
+    Parameters:
+    -----------
+    trace, time_points, horizon, future_times, future_dates, first_date, capability_var, quantiles, random_seed :
+        See forecast_from_posterior
+    n_tasks : int, optional
+        Number of tasks K of a model with a shared g (the score forecast is the same for all of them)
+    max_cells : int, optional
+        Memory budget of one chunk in array cells
+
+    Returns:
+    --------
+    times : numpy array
+        (H,) forecast time points
+    capability_bands : dict
+        'mean' and one (H,) array per quantile
+    score_bands : dict
+        'mean' and one (H, K) array per quantile
+    """
+    samples = posterior_samples(trace, capability_var)
+    times = future_time_axis(time_points, horizon, future_times, future_dates, first_date)
+    dt = np.diff(times, prepend=time_points[-1])
+    g = samples['g']
+    S = len(g)
+    K = g.shape[1] if g.ndim == 2 else 1
+    step = max(1, int(max_cells // (S * K)))
+
+    rng = np.random.default_rng(random_seed)
+    c = samples['c_last']
+    capability_chunks, score_chunks = [], []
+    for start in range(0, len(dt), step):
+        paths = _walk_chunk(samples, c, dt[start:start + step], rng)
+        c = paths[:, -1]
+        scores = expit(g[:, None] * paths) if g.ndim == 1 else expit(g[:, None, :] * paths[:, :, None])
+        capability_chunks.append(summarize_draws(paths, quantiles))
+        score_chunks.append(summarize_draws(scores, quantiles))
+
+    capability_bands = {key: np.concatenate([b[key] for b in capability_chunks]) for key in capability_chunks[0]}
+    score_bands = {key: np.concatenate([b[key] for b in score_chunks]) for key in score_chunks[0]}
+    if g.ndim == 1:
+        # shared g: the same score forecast for every task
+        score_bands = {key: np.repeat(values[:, None], n_tasks or 1, axis=1) for key, values in score_bands.items()}
+    return times, capability_bands, score_bands
@@ -0,0 +1,142 @@
+import os
+import numpy as np
+import pymc as pm
+import pytensor
+import pytensor.tensor as pt
+from pytensor.graph.replace import vectorize_graph
+from scipy import linalg, optimize
+import arviz as az
+
+# 'nuts' is exact (up to MCMC error); the others are approximations for quick exploratory fits
+METHODS = ('nuts', 'advi', 'fullrank_advi', 'pathfinder', 'laplace')
+
+
+def _with_deterministics(trace, model):
+    # approximations may only return the free variables; add capability path, score_mean, ...
+    missing = [d.name for d in model.deterministics if d.name not in trace.posterior]
+    if missing:
+        trace.posterior = pm.compute_deterministics(trace.posterior, var_names=missing, model=model,
+                                                    merge_dataset=True, progressbar=False)
+    return trace
+
+
+def _laplace(model, n_samples, random_seed):
+    """
+    Gaussian approximation around the mode of the posterior density on the unconstrained (transformed) space.
+
+    Mode and Hessian are both taken of the log density including the Jacobian of the transforms, the
+    density the Gaussian approximates (pm.find_MAP leaves the Jacobian out).
+    """
+    value_vars = model.value_vars
+    start = model.initial_point(random_seed=random_seed)
+    shapes = {v.name: np.shape(start[v.name]) for v in value_vars}
+
+    def unravel(x):
+        # flat vector -> point, variables raveled in value_vars order
+        point, offset = {}, 0
+        for v in value_vars:
+            size = int(np.prod(shapes[v.name]))
+            point[v.name] = x[offset:offset + size].reshape(shapes[v.name])
+            offset += size
+        return point
+
+    logp = model.compile_logp(jacobian=True)
+    dlogp = model.compile_dlogp(jacobian=True)
+    x0 = np.concatenate([np.ravel(start[v.name]) for v in value_vars]).astype(float)
+    result = optimize.minimize(lambda x: -logp(unravel(x)), x0, jac=lambda x: -dlogp(unravel(x)),
+                               method='L-BFGS-B')
+    if not result.success:
+        print(f"Laplace: mode search stopped early ({result.message})")
+    mean = result.x
+    point = unravel(mean)
+
+    # negated Hessian of the same log density = precision matrix, by central differences of the gradient
+    # (2 gradient calls per dimension, far cheaper than compiling the symbolic Hessian)
+    steps = np.cbrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(mean))
+    precision = np.empty((len(mean), len(mean)))
+    for i, step in enumerate(steps):
+        shift = np.zeros(len(mean))
+        shift[i] = step
+        precision[:, i] = (dlogp(unravel(mean - shift)) - dlogp(unravel(mean + shift))) / (2 * step)
+    try:
+        chol = np.linalg.cholesky((precision + precision.T) / 2)
+    except np.linalg.LinAlgError:
+        raise ValueError("Laplace: the precision matrix at the mode is not positive definite, "
+                         "the posterior is not approximately Gaussian there; use 'advi' or 'nuts'")
+    # x = mean + L^-T z has covariance (L L^T)^-1
+    rng = np.random.default_rng(random_seed)
+    z = rng.standard_normal((len(mean), n_samples))
+    flat = (mean[:, None] + linalg.solve_triangular(chol.T, z, lower=False)).T
+
+    # back to the constrained free variables, all draws in one call of the graph vectorized over a
+    # leading draw dimension; _with_deterministics adds the rest
+    names = {rv.name for rv in model.free_RVs}
+    outputs = [v for v in model.unobserved_value_vars if v.name in names]
+    batched = [pt.tensor(v.name, shape=(None,) + v.type.shape, dtype=v.dtype) for v in value_vars]
+    fn = pytensor.function(batched, vectorize_graph(outputs, replace=dict(zip(value_vars, batched))),
+                           on_unused_input='ignore')
+    offsets = np.cumsum([0] + [int(np.prod(shapes[v.name])) for v in value_vars])
+    values = fn(*[flat[:, start:end].reshape((n_samples,) + shapes[v.name]).astype(v.dtype)
+                  for v, start, end in zip(value_vars, offsets[:-1], offsets[1:])])
+    return az.from_dict(posterior={v.name: value[None] for v, value in zip(outputs, values)})
+
+
+def run_inference(model, method='nuts', draws=1000, tune=1000, chains=4, cores=None, random_seed=42,
+                  n_iter=30000, progressbar=True, **kwargs):
+    """
+    Fits a model with the selected inference backend.
+
+    Parameters:
+    -----------
+    model : pm.Model
+        Model to fit (e.g. from capability_model.MODELS)
+    method : str, optional
+        'nuts' (pm.sample), 'advi' / 'fullrank_advi' (pm.fit), 'pathfinder' (needs pymc_extras)
+        or 'laplace' (Gaussian around the posterior mode)
+    draws, tune, chains, cores : int, optional
+        NUTS settings; the approximations return draws * chains posterior draws in one chain, cores
+        also sets the parallel paths of pathfinder
+    random_seed : int, optional
+        Random seed for reproducibility
+    n_iter : int, optional
+        Optimization steps of ADVI
+    **kwargs :
+        Passed on to the backend (e.g. target_accept for NUTS)
+
+    Returns:
+    --------
+    trace : InferenceData
+        Posterior with the same variables (including deterministics) whatever the method, so plotting
+        and forecasting work unchanged
+
+    Notes:
+    ------
+    The approximations are only close to NUTS for the per-task model (see benchmark_inference.py);
+    on the multi-task and pooled models they are far off, fit those with NUTS.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown inference method {method!r}, expected one of {METHODS}")
+    if cores is None:
+        # pm.sample's and pymc_extras' own guess is half the CPUs, i.e. 0 on a single CPU machine
+        cores = max(1, min(chains, os.cpu_count() or 1))
+    if method == 'nuts':
+        with model:
+            return pm.sample(draws, tune=tune, chains=chains, cores=cores, random_seed=random_seed,
+                             progressbar=progressbar, return_inferencedata=True, **kwargs)
+
+    n_samples = draws * chains
+    if method in ('advi', 'fullrank_advi'):
+        with model:
+            approx = pm.fit(n=n_iter, method=method, random_seed=random_seed, progressbar=progressbar, **kwargs)
+        trace = approx.sample(n_samples, random_seed=random_seed, return_inferencedata=True)
+    elif method == 'pathfinder':
+        try:
+            import pymc_extras as pmx
+        except ImportError:
+            raise ImportError("method='pathfinder' needs pymc_extras (pip install pymc-extras)")
+        with model:
+            trace = pmx.fit(method='pathfinder', num_draws=n_samples, random_seed=random_seed, cores=cores,
+                            progressbar=progressbar, **kwargs)
+    else:
+        trace = _laplace(model, n_samples, random_seed)
+    return _with_deterministics(trace, model)
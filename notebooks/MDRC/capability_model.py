@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+import pymc as pm
+import pytensor.tensor as pt
+
+
+def latent_random_walk(time_points, c0, mu, sigma_omega, name='c', eps_name='eps'):
+    """
+    Latent capability path as a non-centered random walk with drift on irregular time points.
+
+    c[0] = c0 and c[t] = c[t-1] + mu * dt[t] + sigma_omega * sqrt(dt[t]) * eps[t], with one
+    vector-valued standard normal innovation `eps` and a single cumulative sum, so the size of the
+    graph does not grow with the number of time points. Must be called inside a pm.Model context.
+
+    Parameters:
+    -----------
+    time_points : numpy array
+        Sorted time points in days (repeated time points get identical states)
+    c0, mu, sigma_omega : tensor
+        Initial capability, drift per day and process noise per sqrt(day)
+    name : str, optional
+        Name of the Deterministic holding the path
+    eps_name : str, optional
+        Name of the innovation RV (length T-1)
+
+    Returns:
+    --------
+    capability : tensor
+        Deterministic of length T
+    """
+    dt = np.diff(np.asarray(time_points, dtype=float))
+    if len(dt) == 0:
+        return pm.Deterministic(name, pt.stack([c0]))
+    eps = pm.Normal(eps_name, mu=0.0, sigma=1.0, shape=len(dt))
+    increments = mu * dt + sigma_omega * np.sqrt(dt) * eps
+    return pm.Deterministic(name, pt.cumsum(pt.concatenate([[c0], increments])))
+
+
+def prepare_data(df, task_id, handle_nan='ignore'):
+    """
+    Prepare data for the model from a dataframe.
+    
+    Parameters:
+    -----------
+    df : pandas DataFrame
+        DataFrame containing the data
+    task_id : int
+        ID of the task to analyze
+    handle_nan : str, optional
+        How to handle NaN values: 'ignore' (remove them) or 'zero' (replace with 0)
+        
+    Returns:
+    --------
+    time_points : numpy array
+        Array of time points in days since the first observation
+    y_obs : numpy array
+        Array of observed test scores
+    dates : list
+        List of publication dates
+    """
+    # Filter data for the specific task
+    task_df = df[df['task_id'] == task_id][['Publication date', 'score']].copy()
+    
+    # Handle NaN values
+    if handle_nan == 'zero':
+        task_df['score'] = task_df['score'].fillna(0)
+    elif handle_nan == 'ignore':
+        task_df = task_df.dropna(subset=['score'])
+    
+    # Convert publication dates to datetime
+    task_df['Publication date'] = pd.to_datetime(task_df['Publication date'])
+    
+    # Sort by date
+    task_df = task_df.sort_values('Publication date')
+    
+    # Calculate days since first observation
+    first_date = task_df['Publication date'].min()
+    task_df['days'] = (task_df['Publication date'] - first_date).dt.days
+    
+    # Extract data
+    time_points = task_df['days'].values
+    y_obs = task_df['score'].values / 100.0  # Normalize scores to [0,1]
+    dates = task_df['Publication date'].tolist()
+    
+    return time_points, y_obs, dates
+
+
+def prepare_data_multi(df, task_ids, handle_nan='ignore'):
+    """
+    Prepare the data of several tasks on one shared time axis (days since the first publication date).
+
+    Returns:
+    --------
+    time_points, y_obs, time_idx, task_idx, unique_dates
+    """
+    df2 = df[df['task_id'].isin(task_ids)][['task_id','Publication date','score']].copy()
+    if handle_nan == 'zero':
+        df2['score'] = df2['score'].fillna(0)
+    else:
+        df2 = df2.dropna(subset=['score'])
+    df2['Publication date'] = pd.to_datetime(df2['Publication date'])
+    df2 = df2.sort_values('Publication date')
+
+    # unified time axis (days since first date)
+    unique_dates = sorted(df2['Publication date'].unique())
+    first = unique_dates[0]
+    time_points = np.array([(d-first).days for d in unique_dates])
+    date_to_idx = {d:i for i,d in enumerate(unique_dates)}
+
+    # map each obs to time-index and task-index
+    time_idx = df2['Publication date'].map(date_to_idx).values
+    task_to_idx = {tid:i for i,tid in enumerate(task_ids)}
+    task_idx = df2['task_id'].map(task_to_idx).values
+
+    y_obs = df2['score'].values / 100.0
+    return time_points, y_obs, time_idx, task_idx, unique_dates
+
+
+def build_per_task_model(time_points, y_obs):
+    """
+    State space model of one task: latent capability random walk and logistic test scores.
+
+    Returns:
+    --------
+    model : pm.Model
+        Model with 'capability_latent' (one state per observation) and 'score_mean'
+    """
+    with pm.Model() as model:
+        # Prior for initial capability (c_0)
+        # We expect initial capability to be negative as test scores may start below 0.5
+        c_0 = pm.Normal('c_0', mu=-2.0, sigma=1.0)
+        
+        # Prior for drift parameter (average rate of technological improvement)
+        mu = pm.Normal('mu', mu=0.02, sigma=0.01)  # Small positive drift
+        
+        # Prior for process noise (uncertainty in capability evolution)
+        sigma_omega = pm.HalfCauchy('sigma_omega', beta=0.1)
+        
+        # Prior for discrimination parameter (test sensitivity)
+        g = pm.HalfNormal('g', sigma=1.0)
+        
+        # Prior for measurement noise
+        sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1)
+        
+        # Capability evolution over time as a non-centered random walk with drift
+        capability_latent = latent_random_walk(time_points, c_0, mu, sigma_omega,
+                                               name='capability_latent', eps_name='process_noise')
+        
+        # Define the measurement model using logistic function
+        # The mean of observed test scores based on capability
+        score_mean = pm.Deterministic('score_mean', pm.math.invlogit(g * capability_latent))
+        
+        # Observed test scores with measurement noise
+        pm.Normal('y', mu=score_mean, sigma=sigma_nu, observed=y_obs)
+    return model
+
+
+def build_multi_model(time_points, y_obs, time_idx, task_idx):
+    """
+    Shared capability path with task-specific discrimination g and measurement noise sigma_nu.
+    """
+    K = len(np.unique(task_idx))
+
+    with pm.Model() as model:
+        # Priors
+        c0 = pm.Normal('c0', mu=-2.0, sigma=1.0)
+        mu = pm.Normal('mu', mu=0.02, sigma=0.01)
+        sigma_omega = pm.HalfCauchy('sigma_omega', beta=0.1)
+        g = pm.HalfNormal('g', sigma=1.0, shape=K)
+        sigma_nu = pm.HalfCauchy('sigma_nu', beta=0.1, shape=K)
+
+        # Latent random walk
+        c_stack = latent_random_walk(time_points, c0, mu, sigma_omega, name='c')
+
+        # Fitted mean for each observation
+        score_mean = pm.Deterministic(
+            'score_mean',
+            pm.math.invlogit(g[task_idx] * c_stack[time_idx])
+        )
+
+        # Observation
+        pm.Normal('y', mu=score_mean, sigma=sigma_nu[task_idx], observed=y_obs)
+    return model
+
+
+def build_pooled_model(time_points, y_obs, time_idx):
+    """
+    Shared capability path, discrimination and measurement noise for all tasks.
+    """
+    with pm.Model() as model:
+        # --- PRIORS ---
+        c0           = pm.Normal('c0', mu=-2.0, sigma=1.0)
+        mu           = pm.Normal('mu', mu=0.02, sigma=0.01)
+        sigma_omega  = pm.HalfCauchy('sigma_omega', beta=0.1)
+        # now SHARED across all sensors:
+        g            = pm.HalfNormal('g', sigma=1.0)
+        sigma_nu     = pm.HalfCauchy('sigma_nu', beta=0.1)
+
+        # --- LATENT RANDOM WALK ---
+        c_stack = latent_random_walk(time_points, c0, mu, sigma_omega, name='c')
+
+        # --- MEASUREMENT MODEL (shared g & sigma_nu) ---
+        # For each observation we pick out the latent c at its time‐index:
+        c_for_obs   = c_stack[time_idx]
+        score_mean  = pm.Deterministic('score_mean',
+                                       pm.math.invlogit(g * c_for_obs))
+
+        pm.Normal('y', mu=score_mean,
+                        sigma=sigma_nu,
+                        observed=y_obs)
+    return model
+
+
+# model spec name -> builder; the builder's keyword arguments are the prepared data arrays
+MODELS = {
+    'per_task': build_per_task_model,
+    'multi': build_multi_model,
+    'pooled': build_pooled_model,
+}
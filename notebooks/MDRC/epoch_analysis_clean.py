@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import ast
 import pandas as pd
@@ -132,9 +133,22 @@ def load_exam_data():
     
     return all_exams
 
-def load_exam_results():
+def load_exam_results(warehouse_path=None):
     """
     Load and process all exam results
+
+    Parameters:
+    -----------
+    warehouse_path : str, optional
+        Parquet results warehouse (see scripts/exam_approach/results_warehouse.py), read instead of
+        parsing the full result CSVs
+
+    Returns:
+    --------
+    exams : DataFrame
+        One row per valid exam. Read from the CSVs it has all their columns; read from the warehouse
+        only task_id, occupation, task_description, occupation_category and the score_<candidate>
+        columns, which are all the analyses below use (no exam texts, answers or grading columns)
     """
     occupations = [
         'Business and Financial Operations Occupations',
@@ -143,6 +157,14 @@ def load_exam_results():
     ]
     
     occupations_file_names = [occ.lower().replace(' ', '_') for occ in occupations]
+
+    if warehouse_path is not None:
+        exam_approach = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../scripts/exam_approach'))
+        if exam_approach not in sys.path:
+            sys.path.append(exam_approach)
+        from results_warehouse import load_score_table
+        return load_score_table(warehouse_path, author_model='claude-3-7-sonnet-20250219',
+                                occupation_groups=occupations_file_names, valid_only=True)
     
     exam_list = pd.DataFrame()
     for occ in occupations_file_names:
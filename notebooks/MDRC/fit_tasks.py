@@ -0,0 +1,145 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import arviz as az
+from capability_model import prepare_data, prepare_data_multi
+from trace_cache import CACHE_DIR, model_trace_path, sample_model
+
+SCORES_PATH = '../../results/tables/df_model_test_scores.csv'
+SAMPLER_DEFAULTS = {'draws': 2000, 'tune': 1000, 'chains': 4, 'random_seed': 42}
+
+
+def batch_data(df, spec, key, group_column='occupation_category', handle_nan='ignore'):
+    """
+    Prepared model inputs of one fit: a task_id for 'per_task', a value of group_column for 'multi' / 'pooled'.
+
+    Only tasks with scores are part of a group, so task_idx numbers the tasks of the model without gaps.
+
+    Returns:
+    --------
+    data : dict
+        Keyword arguments of the spec's model builder (see capability_model.MODELS)
+    """
+    if spec == 'per_task':
+        time_points, y_obs, _ = prepare_data(df, key, handle_nan)
+        return {'time_points': time_points, 'y_obs': y_obs}
+    rows = df[df[group_column] == key]
+    if handle_nan != 'zero':
+        rows = rows.dropna(subset=['score'])
+    task_ids = rows['task_id'].unique().tolist()
+    if not task_ids:
+        data = {'time_points': np.array([]), 'y_obs': np.array([]), 'time_idx': np.array([], dtype=int)}
+        if spec == 'multi':
+            data['task_idx'] = np.array([], dtype=int)
+        return data
+    time_points, y_obs, time_idx, task_idx, _ = prepare_data_multi(df, task_ids, handle_nan)
+    data = {'time_points': time_points, 'y_obs': y_obs, 'time_idx': time_idx}
+    if spec == 'multi':
+        data['task_idx'] = task_idx
+    return data
+
+
+def fit_one(spec, data, sampler, cores, trace_dir):
+    """
+    Fits one model into the trace cache in `trace_dir` (see trace_cache.sample_model). Runs in a worker process.
+
+    Returns:
+    --------
+    seconds : float
+        Sampling time
+    """
+    start = time.perf_counter()
+    sample_model(spec, data, cores=cores, cache=True, cache_dir=trace_dir, progressbar=False, **sampler)
+    return time.perf_counter() - start
+
+
+def fit_batch(df, keys=None, spec='per_task', groups=None, group_column='occupation_category', handle_nan='ignore',
+              workers=None, trace_dir=CACHE_DIR, **sampler):
+    """
+    Fits one capability model per task (or per group of tasks) across a process pool.
+
+    Traces are stored in the trace cache, named by a digest of model spec, data and sampler settings
+    (see trace_cache), so a rerun only fits keys whose data, model code or settings changed, and
+    sample_model calls elsewhere with the same arguments load these traces. The CPUs left per worker
+    sample its chains in parallel.
+
+    Parameters:
+    -----------
+    df : pandas DataFrame
+        Score table (see SCORES_PATH)
+    keys : list, optional
+        task_ids for spec 'per_task', values of group_column for 'multi' / 'pooled'; defaults to all
+    spec : str, optional
+        Model spec, a key of capability_model.MODELS
+    groups : list, optional
+        Restrict the keys to these values of group_column (e.g. the tasks of some occupation groups)
+    group_column : str, optional
+        Column grouping the tasks of one multi-task fit
+    handle_nan : str, optional
+        'ignore' or 'zero', see prepare_data
+    workers : int, optional
+        Parallel fits, defaults to CPUs // chains
+    trace_dir : str, optional
+        Trace cache folder, one subfolder per spec
+    **sampler :
+        draws, tune, chains, random_seed (see SAMPLER_DEFAULTS), and method for an approximate
+        posterior (see capability_inference.METHODS)
+
+    Returns:
+    --------
+    paths : dict
+        key -> path of its trace (NetCDF, see load_traces)
+    """
+    sampler = dict(SAMPLER_DEFAULTS, **sampler)
+    if keys is None:
+        rows = df if groups is None else df[df[group_column].isin(groups)]
+        keys = rows['task_id' if spec == 'per_task' else group_column].dropna().unique().tolist()
+    cpus = os.cpu_count() or 1
+    workers = workers or max(1, cpus // sampler['chains'])
+    cores = max(1, min(sampler['chains'], cpus // workers))
+
+    paths, pending = {}, {}
+    for key in keys:
+        data = batch_data(df, spec, key, group_column, handle_nan)
+        if len(data['y_obs']) == 0:
+            print(f"{key}: no scores, skipped")
+            continue
+        path = model_trace_path(spec, data, cache_dir=trace_dir, **sampler)
+        paths[key] = path
+        if not os.path.exists(path):
+            pending[key] = data
+    print(f"{len(pending)} of {len(paths)} fits to run ({len(paths) - len(pending)} unchanged), "
+          f"{workers} workers x {cores} cores")
+
+    start = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fit_one, spec, data, sampler, cores, trace_dir): key for key, data in pending.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                seconds = future.result()
+                print(f"[{done}/{len(futures)}] {key} fitted in {seconds:.1f}s "
+                      f"({time.perf_counter() - start:.0f}s elapsed)")
+            except Exception as e:
+                print(f"[{done}/{len(futures)}] {key} failed: {e}")
+                failed.append(key)
+    for key in failed:
+        del paths[key]
+    return paths
+
+
+def load_traces(paths):
+    """
+    Loads the traces returned by fit_batch: key -> InferenceData.
+    """
+    return {key: az.from_netcdf(path) for key, path in paths.items()}
+
+
+if __name__ == "__main__":
+    df = pd.read_csv(SCORES_PATH)
+    paths = fit_batch(df, spec='per_task', draws=1000, tune=1000)
+    # paths = fit_batch(df, spec='pooled', handle_nan='zero', draws=1000, tune=1000)
+    print(f"{len(paths)} traces in {CACHE_DIR}")
@@ -1,9 +1,13 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 path_test_data = '../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/'
 path_epoch = '../../data/external/epoch_ai/'
+# set to the parquet results warehouse (scripts/exam_approach/results_warehouse.py) to read the scores from it
+warehouse_path = None
 
 
 files_score = {
@@ -11,22 +15,33 @@ files_score = {
     "computer_and_mathematical": "scores_only_computer_and_mathematical_occupations.csv",
     "management": "scores_only_management_occupations.csv"
 }
-# Initialize an empty list to store DataFrames
-df_exams = []
-# Loop through the dictionary to process each file
-for category, file_name in files_score.items():
-    df = pd.read_csv(path_test_data + file_name)
-    # Remove the 'Unnamed: 0' column
-    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-    # Add the 'occupation_category' column
-    df['occupation_category'] = category
-    # Fill since the begingin NA with 0
-    # df = df.fillna(0)
-    # Append the processed DataFrame to the list
-    df_exams.append(df)
-
-# Concatenate all DataFrames into one
-all_exams = pd.concat(df_exams, ignore_index=True)
+if warehouse_path is not None:
+    exam_approach = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../scripts/exam_approach'))
+    if exam_approach not in sys.path:
+        sys.path.append(exam_approach)
+    from results_warehouse import load_score_table
+    # all exams, as in the scores_only CSVs, with the categories named as in files_score
+    all_exams = load_score_table(warehouse_path, valid_only=False,
+                                 occupation_groups=[category + '_occupations' for category in files_score])
+    all_exams['occupation_category'] = all_exams['occupation_category'].str.replace('_occupations', '')
+else:
+    # Initialize an empty list to store DataFrames
+    df_exams = []
+    # Loop through the dictionary to process each file
+    for category, file_name in files_score.items():
+        df = pd.read_csv(path_test_data + file_name)
+        # Remove the 'Unnamed: 0' column
+        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+        # Add the 'occupation_category' column
+        df['occupation_category'] = category
+        # Fill since the begingin NA with 0
+        # df = df.fillna(0)
+        # Append the processed DataFrame to the list
+        df_exams.append(df)
+
+    # Concatenate all DataFrames into one
+    all_exams = pd.concat(df_exams, ignore_index=True)
+
 all_exams.head()
 # all_exams = all_exams.fillna(0)
 
@@ -1,3 +1,5 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -5,6 +7,8 @@ import matplotlib.pyplot as plt
 path_test_data = '../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/'
 
 path_epoch = '../../data/external/epoch_ai/'
+# set to the parquet results warehouse (scripts/exam_approach/results_warehouse.py) to read the scores from it
+warehouse_path = None
 
 files_score = {
     "business_and_financial_operations": "scores_only_business_and_financial_operations_occupations.csv",
@@ -18,58 +22,68 @@ file_full_exams = {
     "management": 'test_answers_management_occupations.csv'
 }
 
-df_test = pd.read_csv(path_test_data + file_full_exams['business_and_financial_operations'])
-df_test.columns
-df_test[['task_id', 'task_description', 'exam', 'instructions']].iloc[2]
-
-# Initialize an empty list to store DataFrames
-df_exams = []
-# Loop through the dictionary to process each file
-for category, file_name in files_score.items():
-    df = pd.read_csv(path_test_data + file_name)
-    # Remove the 'Unnamed: 0' column
-    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-    # Add the 'occupation_category' column
-    df['occupation_category'] = category
-    # Fill since the begingin NA with 0
-    # df = df.fillna(0)
-    # Now read the exam to get exam length
-    df_full = pd.read_csv(path_test_data + file_full_exams[category])
-    df_full['exam_length'] = df_full['exam'].apply(lambda x: len(x) if isinstance(x, str) else 0)
-    dict_task_examlength = dict(zip(df_full['task_id'], df_full['exam_length']))
-    df['exam_length'] = df['task_id'].map(dict_task_examlength)
-     # Append the processed DataFrame to the list
-    df_exams.append(df)
-
-
-df_exams[0].head()
-
-# Concatenate all DataFrames into one
-all_exams = pd.concat(df_exams, ignore_index=True)
-all_exams.head()
-# all_exams = all_exams.fillna(0)
-
-
-occupations =['Business and Financial Operations Occupations',
-'Computer and Mathematical Occupations',
-'Management Occupations']
-
-occupations_file_names = [occ.lower().replace(' ', '_') for occ in occupations]
-
-exam_list = pd.DataFrame()
-for occ in occupations_file_names:
-    results = pd.read_csv(f'../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/test_results_{occ}.csv',index_col=0)
-    results = results.loc[:, ~results.columns.str.startswith('Unnamed')]
-    results['occupation_group'] = occ
-    exam_list = pd.concat([exam_list, results], axis=0, ignore_index=True)
-
-# mark exams with empty entry, nan entry or key grade scores over 100 as invalid
-exam_list.loc[exam_list['exam']=='','exam'] = 'Exam not valid'
-exam_list['exam'] = exam_list['exam'].fillna('Exam not valid')
-exam_list.loc[exam_list['key_grade']>100,'exam'] = 'Exam not valid'
-exam_list.loc[exam_list['check_overall_makes_sense']==False, 'exam'] = 'Exam not valid'
-
-exams = exam_list[exam_list['exam'] !='Exam not valid']
+if warehouse_path is not None:
+    exam_approach = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../scripts/exam_approach'))
+    if exam_approach not in sys.path:
+        sys.path.append(exam_approach)
+    from results_warehouse import load_score_table
+    # the valid exams with the columns used below, without reading the exam texts and answers
+    exams = load_score_table(warehouse_path, valid_only=True,
+                             occupation_groups=[category + '_occupations' for category in files_score])
+    exams = exams.rename(columns={'occupation_category': 'occupation_group'})
+else:
+    df_test = pd.read_csv(path_test_data + file_full_exams['business_and_financial_operations'])
+    df_test.columns
+    df_test[['task_id', 'task_description', 'exam', 'instructions']].iloc[2]
+
+    # Initialize an empty list to store DataFrames
+    df_exams = []
+    # Loop through the dictionary to process each file
+    for category, file_name in files_score.items():
+        df = pd.read_csv(path_test_data + file_name)
+        # Remove the 'Unnamed: 0' column
+        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+        # Add the 'occupation_category' column
+        df['occupation_category'] = category
+        # Fill since the begingin NA with 0
+        # df = df.fillna(0)
+        # Now read the exam to get exam length
+        df_full = pd.read_csv(path_test_data + file_full_exams[category])
+        df_full['exam_length'] = df_full['exam'].apply(lambda x: len(x) if isinstance(x, str) else 0)
+        dict_task_examlength = dict(zip(df_full['task_id'], df_full['exam_length']))
+        df['exam_length'] = df['task_id'].map(dict_task_examlength)
+         # Append the processed DataFrame to the list
+        df_exams.append(df)
+
+
+    df_exams[0].head()
+
+    # Concatenate all DataFrames into one
+    all_exams = pd.concat(df_exams, ignore_index=True)
+    all_exams.head()
+    # all_exams = all_exams.fillna(0)
+
+
+    occupations =['Business and Financial Operations Occupations',
+    'Computer and Mathematical Occupations',
+    'Management Occupations']
+
+    occupations_file_names = [occ.lower().replace(' ', '_') for occ in occupations]
+
+    exam_list = pd.DataFrame()
+    for occ in occupations_file_names:
+        results = pd.read_csv(f'../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/test_results_{occ}.csv',index_col=0)
+        results = results.loc[:, ~results.columns.str.startswith('Unnamed')]
+        results['occupation_group'] = occ
+        exam_list = pd.concat([exam_list, results], axis=0, ignore_index=True)
+
+    # mark exams with empty entry, nan entry or key grade scores over 100 as invalid
+    exam_list.loc[exam_list['exam']=='','exam'] = 'Exam not valid'
+    exam_list['exam'] = exam_list['exam'].fillna('Exam not valid')
+    exam_list.loc[exam_list['key_grade']>100,'exam'] = 'Exam not valid'
+    exam_list.loc[exam_list['check_overall_makes_sense']==False, 'exam'] = 'Exam not valid'
+
+    exams = exam_list[exam_list['exam'] !='Exam not valid']
 
 exams[['task_id', 'score_chatgpt4o','score_chatgpt35']][exams['task_id'] ==  21522]
 
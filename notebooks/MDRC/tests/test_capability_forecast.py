@@ -0,0 +1,40 @@
+import arviz as az
+import numpy as np
+import pytest
+
+from capability_forecast import forecast_bands, forecast_from_posterior, summarize_draws
+
+
+def make_trace(n_tasks=None, chains=2, draws=50, seed=0):
+    rng = np.random.default_rng(seed)
+    g_shape = (chains, draws) if n_tasks is None else (chains, draws, n_tasks)
+    return az.from_dict(posterior={
+        'c': rng.normal(size=(chains, draws, 5)).cumsum(axis=2),
+        'mu': rng.normal(0.01, 0.005, size=(chains, draws)),
+        'sigma_omega': rng.uniform(0.05, 0.1, size=(chains, draws)),
+        'g': rng.uniform(0.5, 2.0, size=g_shape),
+    })
+
+
+@pytest.mark.parametrize('n_tasks', [None, 3])
+def test_chunked_bands_equal_unchunked(n_tasks):
+    trace = make_trace(n_tasks)
+    time_points = np.array([0.0, 10.0, 30.0, 45.0, 60.0])
+    future_times = [61.0, 65.0, 70.0, 90.0, 91.5, 120.0, 200.0]
+
+    times, capability, scores = forecast_bands(trace, time_points, future_times=future_times, n_tasks=3)
+    # 100 samples x 3 tasks per step: one step per chunk
+    chunked = forecast_bands(trace, time_points, future_times=future_times, n_tasks=3, max_cells=300)
+
+    np.testing.assert_array_equal(chunked[0], times)
+    for bands, expected in ((chunked[1], capability), (chunked[2], scores)):
+        assert bands.keys() == expected.keys()
+        for key in expected:
+            np.testing.assert_allclose(bands[key], expected[key])
+    assert scores['mean'].shape == (len(future_times), 3)
+
+    # and both equal the bands of the full forecast draws
+    forecast = forecast_from_posterior(trace, time_points, future_times=future_times)
+    full = summarize_draws(forecast['capability'])
+    for key in full:
+        np.testing.assert_allclose(capability[key], full[key])
@@ -0,0 +1,22 @@
+import trace_cache
+from trace_cache import model_spec_id
+
+
+def build_model_v1(time_points, y_obs):
+    return 'v1'
+
+
+def build_model_v2(time_points, y_obs):
+    return 'v2'
+
+
+def test_spec_id_changes_with_the_spec_source(monkeypatch):
+    monkeypatch.setitem(trace_cache.MODELS, 'per_task', build_model_v1)
+    before = model_spec_id('per_task')
+
+    assert model_spec_id('per_task') == before
+    assert before.startswith('per_task-')
+
+    monkeypatch.setitem(trace_cache.MODELS, 'per_task', build_model_v2)
+
+    assert model_spec_id('per_task') != before
@@ -0,0 +1,146 @@
+import os
+import json
+import inspect
+import hashlib
+import numpy as np
+import arviz as az
+import pytensor
+from capability_model import MODELS, latent_random_walk
+from capability_inference import run_inference
+
+CACHE_DIR = '../../results/traces/cache'
+
+
+def data_hash(data):
+    """
+    Hash of the prepared data arrays (names, dtypes, shapes and values).
+    """
+    h = hashlib.sha256()
+    for name in sorted(data):
+        arr = np.ascontiguousarray(data[name])
+        h.update(f"{name}:{arr.dtype}:{arr.shape}".encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def model_spec_id(spec):
+    """
+    Identifier of a model spec of capability_model.MODELS that changes whenever its code does.
+    """
+    source = inspect.getsource(MODELS[spec]) + inspect.getsource(latent_random_walk)
+    return f"{spec}-{hashlib.sha256(source.encode()).hexdigest()[:8]}"
+
+
+def model_graph_id(name, model):
+    """
+    Identifier of a model defined inline (e.g. in an analysis script) that changes whenever its
+    log density or deterministics do.
+    """
+    # deterministics in terms of the value variables, the random variables print their RNG's address
+    graph = pytensor.dprint([model.logp()] + model.replace_rvs_by_values(model.deterministics), file='str')
+    return f"{name}-{hashlib.sha256(graph.encode()).hexdigest()[:8]}"
+
+
+def fit_digest(spec_id, data, sampler):
+    """
+    Identifies a fit: model spec identifier, data and sampler settings.
+    """
+    h = hashlib.sha256()
+    h.update(spec_id.encode())
+    h.update(data_hash(data).encode())
+    h.update(json.dumps(sampler, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def cache_path(spec_id, data, sampler, cache_dir=CACHE_DIR):
+    """
+    Path of the cached trace of a fit (see cached_trace).
+    """
+    return os.path.join(cache_dir, spec_id.split('-')[0], fit_digest(spec_id, data, sampler) + '.nc')
+
+
+def cached_trace(spec_id, data, sampler, sample_fn, cache_dir=CACHE_DIR, refresh=False):
+    """
+    Returns the cached trace of a fit, or runs `sample_fn()` and caches its InferenceData.
+
+    Parameters:
+    -----------
+    spec_id : str
+        Model identifier; use model_spec_id for the models of capability_model and model_graph_id
+        for models defined inline
+    data : dict
+        Prepared data arrays the model is built from (time_points, y_obs, time_idx, task_idx, ...)
+    sampler : dict
+        Sampler settings that change the result (draws, tune, chains, random_seed, ...)
+    sample_fn : callable
+        Fits the model and returns its InferenceData; only called on a cache miss
+    cache_dir : str, optional
+        Folder of the cached traces
+    refresh : bool, optional
+        Refit even if a cached trace exists
+
+    Returns:
+    --------
+    trace : InferenceData
+    """
+    path = cache_path(spec_id, data, sampler, cache_dir)
+    if os.path.exists(path) and not refresh:
+        print(f"Loading cached trace {path}")
+        return az.from_netcdf(path)
+    trace = sample_fn()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    trace.to_netcdf(tmp)
+    os.replace(tmp, path)
+    return trace
+
+
+def sample_settings(method, sampler):
+    """
+    Sampler settings of sample_model that are part of the cache key.
+    """
+    settings = {k: v for k, v in sampler.items() if k != 'progressbar'}
+    if method != 'nuts':
+        # keeps the keys of existing NUTS traces valid
+        settings['method'] = method
+    return settings
+
+
+def model_trace_path(spec, data, method='nuts', cache_dir=CACHE_DIR, **sampler):
+    """
+    Path of the cached trace sample_model reads or writes for these arguments.
+    """
+    return cache_path(model_spec_id(spec), data, sample_settings(method, sampler), cache_dir)
+
+
+def sample_model(spec, data, method='nuts', cores=None, cache=True, cache_dir=CACHE_DIR, **sampler):
+    """
+    Builds a model of capability_model.MODELS from prepared data and fits it (NUTS by default),
+    reusing the cached trace if neither the data, the model nor the sampler settings changed.
+
+    Parameters:
+    -----------
+    spec : str
+        Model spec, a key of capability_model.MODELS
+    data : dict
+        Keyword arguments of the model builder
+    method : str, optional
+        Inference method, see capability_inference.METHODS (part of the cache key)
+    cores : int, optional
+        Chains sampled in parallel (not part of the cache key, it does not change the draws)
+    cache : bool, optional
+        Use the trace cache
+    cache_dir : str, optional
+        Folder of the cached traces
+    **sampler :
+        Keyword arguments of capability_inference.run_inference (draws, tune, chains, random_seed, n_iter, ...)
+
+    Returns:
+    --------
+    trace : InferenceData
+    """
+    def sample_fn():
+        return run_inference(MODELS[spec](**data), method, cores=cores, **sampler)
+    if not cache:
+        return sample_fn()
+    return cached_trace(model_spec_id(spec), data, sample_settings(method, sampler), sample_fn, cache_dir)
@@ -0,0 +1,210 @@
+import re
+import json
+import pandas as pd
+
+# fenced code blocks: ```json ... ``` (or ``` ... ```)
+FENCE_RE = re.compile(r'```[ \t]*(json|javascript|js)?[^\n`]*\n?(.*?)```', re.DOTALL | re.IGNORECASE)
+# characters that matter when looking for objects outside code fences
+SCAN_RE = re.compile(r'[{}"\\]')
+# a number with thousands separators used as a value, e.g. "revenue": 1,250,000
+THOUSANDS_RE = re.compile(r'-?\d{1,3}(?:,\d{3})+(?:\.\d+)?(?=\s*[,}\]\n])')
+
+REPAIRS = ('comments', 'trailing_commas', 'single_quotes', 'thousands_separators', 'escaped_whitespace')
+
+
+def _bare_objects(text, fences):
+    # top-level {...} objects in the prose, skipping the fenced blocks
+    objects = []
+    depth, start, in_string, escaped = 0, None, False, False
+    fence = 0
+    for m in SCAN_RE.finditer(text):
+        i, ch = m.start(), m.group()
+        while fence < len(fences) and i >= fences[fence][1]:
+            fence += 1
+        if fence < len(fences) and fences[fence][0] <= i:
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = depth > 0
+        elif ch == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                objects.append(text[start:i + 1])
+    return sorted(objects, key=len, reverse=True)
+
+
+def find_candidates(text):
+    """
+    Yields the snippets of an answer that may hold the JSON submission, best first.
+
+    Order: fenced ```json blocks, other fenced blocks, top-level {...} objects outside fences
+    (longest first) and finally the whole answer. Later candidates are only searched for when
+    the earlier ones are used up.
+    """
+    seen = set()
+    json_fences, other_fences, spans = [], [], []
+    for m in FENCE_RE.finditer(text):
+        (json_fences if m.group(1) else other_fences).append(m.group(2).strip())
+        spans.append(m.span())
+    for group in (json_fences, other_fences, lambda: _bare_objects(text, spans), [text.strip()]):
+        for candidate in (group() if callable(group) else group):
+            if candidate and candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+
+
+def _last_token(out):
+    k = len(out) - 1
+    while k >= 0 and not out[k].strip():
+        k -= 1
+    return out[k].rstrip()[-1] if k >= 0 else ''
+
+
+def repair_json(text):
+    """
+    Rewrites almost-JSON into JSON in one pass over the text.
+
+    Handles // and /* */ comments, trailing commas, single-quoted strings, thousands separators in
+    numbers and literal escape sequences (\\n, \\t) between tokens.
+
+    Returns:
+        tuple: (repaired text, list of the repairs that changed something)
+    """
+    out = []
+    fired = set()
+    i, n = 0, len(text)
+    if n > 1 and text[0] == text[-1] == "'" and text[1:].lstrip().startswith(('{', '[')):
+        # the whole object wrapped in quotes
+        text, n = text[1:-1], n - 2
+        fired.add('single_quotes')
+    while i < n:
+        ch = text[i]
+        if ch == '"' or ch == "'":
+            # copy a string literal, converting single quotes to double quotes
+            quote = ch
+            j = i + 1
+            buf = []
+            while j < n and text[j] != quote:
+                if text[j] == '\\' and j + 1 < n:
+                    if text[j + 1] == "'":
+                        buf.append("'")
+                    else:
+                        buf.append(text[j:j + 2])
+                    j += 2
+                    continue
+                if quote == "'" and text[j] == '"':
+                    buf.append('\\"')
+                elif text[j] == '\n':
+                    buf.append('\\n')
+                else:
+                    buf.append(text[j])
+                j += 1
+            if quote == "'":
+                fired.add('single_quotes')
+            out.append('"' + ''.join(buf) + '"')
+            i = j + 1
+        elif ch == '/' and text.startswith('//', i):
+            j = text.find('\n', i)
+            i = n if j == -1 else j
+            fired.add('comments')
+        elif ch == '/' and text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            i = n if j == -1 else j + 2
+            fired.add('comments')
+        elif ch == '#' and _last_token(out) in ('', ',', '{', '['):
+            j = text.find('\n', i)
+            i = n if j == -1 else j
+            fired.add('comments')
+        elif ch == ',':
+            j = i + 1
+            while j < n and text[j] in ' \t\r\n':
+                j += 1
+            if j < n and text[j] in '}]':
+                fired.add('trailing_commas')
+            else:
+                out.append(ch)
+            i += 1
+        elif ch == '\\' and i + 1 < n and text[i + 1] in 'ntr':
+            out.append(' ')
+            i += 2
+            fired.add('escaped_whitespace')
+        elif ch == '-' or ch.isdigit():
+            m = THOUSANDS_RE.match(text, i)
+            if m and _last_token(out) == ':':
+                out.append(m.group().replace(',', ''))
+                i = m.end()
+                fired.add('thousands_separators')
+            else:
+                out.append(ch)
+                i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return ''.join(out), [r for r in REPAIRS if r in fired]
+
+
+def extract_answer(text):
+    """
+    Extracts the JSON submission from a candidate's answer.
+
+    Args:
+        text (str): The answer of the candidate model.
+
+    Returns:
+        tuple: (parsed JSON or None, repair) where repair is 'none' if the JSON parsed as is,
+               a '+'-joined list of the repairs that were needed, or None if nothing could be parsed.
+    """
+    if not isinstance(text, str):
+        return None, None
+    for candidate in find_candidates(text):
+        try:
+            return json.loads(candidate), 'none'
+        except ValueError:
+            pass
+        repaired, fired = repair_json(candidate)
+        try:
+            return json.loads(repaired), '+'.join(fired) or 'none'
+        except ValueError:
+            continue
+    return None, None
+
+
+def extract_all(df, columns):
+    """
+    Extracts the submissions of several answer columns at once.
+
+    Args:
+        df (pd.DataFrame): Answers, one row per exam.
+        columns (list): Answer columns (e.g. test_answers_<candidate>); missing columns give no answers.
+
+    Returns:
+        tuple: (answers, repairs), two DataFrames with df's index and the given columns holding the parsed
+               JSON (None where extraction failed) and the repair that was applied.
+
+    Notes:
+        - All columns are flattened into one series and identical answers are only parsed once.
+    """
+    present = [c for c in columns if c in df.columns]
+    texts = df[present].stack()
+    texts = texts[texts.map(lambda t: isinstance(t, str))]
+    if texts.empty:
+        empty = pd.DataFrame(None, index=df.index, columns=columns, dtype=object)
+        return empty, empty.copy()
+    parsed = {text: extract_answer(text) for text in texts.unique()}
+    answers = texts.map(lambda t: parsed[t][0]).unstack()
+    repairs = texts.map(lambda t: parsed[t][1]).unstack()
+    answers = answers.reindex(index=df.index, columns=columns).astype(object)
+    repairs = repairs.reindex(index=df.index, columns=columns).astype(object)
+    answers = answers.where(answers.notna(), None)
+    repairs = repairs.where(repairs.notna(), None)
+    return answers, repairs
@@ -0,0 +1,142 @@
+import os
+import json
+import stat
+import hashlib
+import shutil
+import tempfile
+
+BLOB_DIR = '.blobs'
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_digest(path):
+    """
+    SHA-256 hex digest of a file's content.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def blob_path(store_root, digest):
+    """
+    Location of a blob inside the store (`<store_root>/.blobs/ab/cdef...`).
+    """
+    return os.path.join(store_root, BLOB_DIR, digest[:2], digest[2:])
+
+
+def put_file(store_root, path):
+    """
+    Adds a file to the content-addressed store.
+
+    Args:
+        store_root (str): Root folder of the store.
+        path (str): File to add.
+
+    Returns:
+        str: Digest of the file. Content that is already stored is not written again.
+    """
+    digest = file_digest(path)
+    target = blob_path(store_root, digest)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # write to a temporary file first so concurrent writers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+        os.close(fd)
+        shutil.copyfile(path, tmp)
+        # blobs are shared through hardlinks, so they must never be modified in place
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp, target)
+    return digest
+
+
+def write_manifest(folder, files):
+    """
+    Writes the manifest of a submission folder, mapping file names to blob digests.
+    """
+    with open(os.path.join(folder, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(files, f, indent=4, sort_keys=True)
+
+
+def read_manifest(folder):
+    """
+    Reads the manifest of a submission folder, or returns {} if it has none.
+    """
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _link(src, dst, mode):
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # e.g. different file system, fall back to a symlink
+            mode = 'symlink'
+    if mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def materialize(store_root, folder, files, mode='hardlink'):
+    """
+    Makes the files of a manifest available under their names in a real directory.
+
+    Args:
+        store_root (str): Root folder of the store.
+        folder (str): Target directory.
+        files (dict): File name -> blob digest.
+        mode (str): 'hardlink' (default), 'symlink' or 'copy'; links fall back to copies where unsupported.
+
+    Returns:
+        int: Number of files that had to be (re)linked; files already pointing at the right blob are left alone.
+    """
+    os.makedirs(folder, exist_ok=True)
+    changed = 0
+    for name, digest in files.items():
+        src = blob_path(store_root, digest)
+        dst = os.path.join(folder, name)
+        if os.path.lexists(dst):
+            try:
+                if os.path.samefile(src, dst):
+                    continue
+            except OSError:
+                pass
+            os.remove(dst)
+        _link(src, dst, mode)
+        changed += 1
+    return changed
+
+
+def share_files(store_root, source_folder, names, target_folders, mode='hardlink'):
+    """
+    Stores files of a task folder once and links them into each target (submission) folder.
+
+    Args:
+        store_root (str): Root folder of the store.
+        source_folder (str): Folder holding the original files (e.g. the task folder).
+        names (list): File names to share (e.g. answer_key.json, task_evaluation.py).
+        target_folders (list): Folders that need the files.
+        mode (str): See materialize.
+
+    Returns:
+        dict: File name -> digest of the shared files.
+    """
+    files = {name: put_file(store_root, os.path.join(source_folder, name)) for name in names}
+    for folder in target_folders:
+        materialize(store_root, folder, files, mode=mode)
+        manifest = read_manifest(folder)
+        if any(manifest.get(name) != digest for name, digest in files.items()):
+            manifest.update(files)
+            write_manifest(folder, manifest)
+    return files
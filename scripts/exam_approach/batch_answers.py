@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import pandas as pd
+from query_agents import get_client, get_provider, default_temperature, claude_max_tokens, take_tests
+from take_test import system_prompt_template, CANDIDATE_MODELS
+
+# Providers with a batch API; other candidates fall back to concurrent regular queries
+BATCH_PROVIDERS = ('openai', 'anthropic')
+POLL_INTERVAL = 60
+
+
+def unanswered(df, column, exam_column='exam'):
+    """
+    Valid exams without an answer in the `test_answers_<column>` column.
+    """
+    valid = df[exam_column] != 'Exam not valid'
+    answer_column = 'test_answers_' + column
+    if answer_column not in df.columns:
+        return df[valid]
+    answers = df[answer_column]
+    return df[valid & (answers.isna() | (answers.astype(str).str.strip() == ''))]
+
+
+def build_batch_requests(df, model, exam_column='exam'):
+    """
+    Collects the exams a candidate model has to answer.
+
+    Args:
+        df (pd.DataFrame): Exams with `occupation` and `exam_column` columns, e.g. `unanswered(df, column)`.
+        model (str): The candidate model.
+        exam_column (str): Column holding the exam text.
+
+    Returns:
+        list: (custom_id, system_prompt, user_prompt) tuples, custom_id encodes the DataFrame index.
+    """
+    requests = []
+    for idx, row in df.iterrows():
+        if row[exam_column] == 'Exam not valid':
+            continue
+        system_prompt = system_prompt_template.format(occupation=row['occupation'])
+        requests.append((f'row-{idx}', system_prompt, row[exam_column]))
+    return requests
+
+
+def write_openai_batch_file(requests, model, path):
+    """
+    Writes the requests in the OpenAI batch JSONL format (one /v1/chat/completions call per line).
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, system_prompt, user_prompt in requests:
+            line = {
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model,
+                    'messages': [
+                        {'role': 'developer', 'content': system_prompt},
+                        {'role': 'user', 'content': user_prompt},
+                    ],
+                    'temperature': default_temperature(model),
+                },
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+    return path
+
+
+def anthropic_batch_requests(requests, model):
+    """
+    Converts the requests into the Anthropic Message Batches format.
+    """
+    return [
+        {
+            'custom_id': custom_id,
+            'params': {
+                'model': model,
+                'system': system_prompt,
+                'messages': [{'role': 'user', 'content': user_prompt}],
+                'max_tokens': claude_max_tokens(model),
+                'temperature': default_temperature(model),
+            },
+        }
+        for custom_id, system_prompt, user_prompt in requests
+    ]
+
+
+def submit_batch(requests, model, batch_dir):
+    """
+    Submits the requests as one batch job to the provider of `model`.
+
+    Args:
+        requests (list): (custom_id, system_prompt, user_prompt) tuples.
+        model (str): The candidate model.
+        batch_dir (str): Folder where the batch input file is kept.
+
+    Returns:
+        dict: Batch record with `provider`, `model` and `batch_id`.
+    """
+    provider = get_provider(model)
+    client = get_client(provider)
+    os.makedirs(batch_dir, exist_ok=True)
+    if provider == 'openai':
+        path = write_openai_batch_file(requests, model, os.path.join(batch_dir, f'batch_input_{model}.jsonl'))
+        with open(path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+        )
+    elif provider == 'anthropic':
+        batch_requests = anthropic_batch_requests(requests, model)
+        with open(os.path.join(batch_dir, f'batch_input_{model}.jsonl'), 'w', encoding='utf-8') as f:
+            for request in batch_requests:
+                f.write(json.dumps(request, ensure_ascii=False) + '\n')
+        batch = client.messages.batches.create(requests=batch_requests)
+    else:
+        raise ValueError(f"No batch API for provider {provider}")
+    print(f"Submitted batch {batch.id} with {len(requests)} exams for {model}")
+    return {'provider': provider, 'model': model, 'batch_id': batch.id}
+
+
+def batch_finished(record):
+    """
+    Checks the status of a submitted batch and stores it in `record['status']`.
+
+    Returns:
+        bool: True once the provider has stopped processing the batch.
+    """
+    client = get_client(record['provider'])
+    if record['provider'] == 'openai':
+        record['status'] = client.batches.retrieve(record['batch_id']).status
+        finished = record['status'] in ('completed', 'failed', 'expired', 'cancelled')
+    else:
+        record['status'] = client.messages.batches.retrieve(record['batch_id']).processing_status
+        finished = record['status'] == 'ended'
+    print(f"Batch {record['batch_id']} ({record['model']}): {record['status']}")
+    return finished
+
+
+def fetch_batch_results(record):
+    """
+    Downloads the answers of a finished batch.
+
+    Returns:
+        dict: custom_id -> answer text for every request that succeeded.
+    """
+    client = get_client(record['provider'])
+    answers = {}
+    if record['provider'] == 'openai':
+        batch = client.batches.retrieve(record['batch_id'])
+        if not batch.output_file_id:
+            return answers
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            if response.get('status_code') == 200:
+                answers[result['custom_id']] = response['body']['choices'][0]['message']['content']
+    else:
+        for entry in client.messages.batches.results(record['batch_id']):
+            if entry.result.type == 'succeeded':
+                answers[entry.custom_id] = entry.result.message.content[0].text
+    return answers
+
+
+def write_answers(df, answers, column):
+    """
+    Writes batch answers back into the `test_answers_<column>` column of df (in place).
+    """
+    answer_column = 'test_answers_' + column
+    if answer_column not in df.columns:
+        df[answer_column] = ''
+    # a column read back without any answer is float (all NaN)
+    df[answer_column] = df[answer_column].astype(object)
+    for custom_id, text in answers.items():
+        df.at[int(custom_id.removeprefix('row-')), answer_column] = text
+    return df
+
+
+def answer_exams_batch(answers_file, candidates=None, batch_dir=None, poll_interval=POLL_INTERVAL):
+    """
+    Lets candidate models answer all exams of an occupation group through the providers' batch APIs.
+
+    Args:
+        answers_file (str): Path to `test_answers_{occ}.csv`, updated in place.
+        candidates (dict, optional): Column suffix -> model, defaults to CANDIDATE_MODELS.
+        batch_dir (str, optional): Where batch input files and the batch record are kept.
+        poll_interval (int): Seconds between status checks.
+
+    Process:
+        1. Submits one batch per candidate served by a batch-capable provider with the exams that have no
+           answer yet; running batches are stored in `batches.json` so an interrupted run resumes polling
+           instead of resubmitting.
+        2. Candidates of other providers answer their unanswered exams with concurrent regular queries.
+        3. Polls until every batch has finished, writes the answers into the answer columns and removes the
+           batch from `batches.json`.
+
+    Notes:
+        - Requests that did not succeed (errored requests, failed, expired or cancelled batches) stay
+          unanswered and are resubmitted by the next run; candidates with every exam answered are skipped.
+    """
+    candidates = candidates or CANDIDATE_MODELS
+    batch_dir = batch_dir or os.path.join(os.path.dirname(answers_file), 'batches')
+    os.makedirs(batch_dir, exist_ok=True)
+    record_file = os.path.join(batch_dir, 'batches.json')
+    df = pd.read_csv(answers_file)
+
+    records = {}
+    if os.path.isfile(record_file):
+        with open(record_file) as f:
+            records = json.load(f)
+
+    def save_records():
+        with open(record_file, 'w') as f:
+            json.dump(records, f, indent=4)
+
+    for column, model in candidates.items():
+        if column in records:
+            continue
+        todo = unanswered(df, column)
+        if todo.empty:
+            print(f"All exams answered by {model}")
+            continue
+        if get_provider(model) in BATCH_PROVIDERS:
+            requests = build_batch_requests(todo, model)
+            records[column] = submit_batch(requests, model, batch_dir)
+            save_records()
+        else:
+            print(f"No batch API for {model}, querying directly")
+            answers = take_tests(todo, system_prompt_template, model)
+            write_answers(df, {f'row-{idx}': answer for idx, answer in zip(todo.index, answers)
+                               if answer is not None}, column)
+            df.to_csv(answers_file, index=False)
+
+    pending = [column for column in records if column in candidates]
+    while pending:
+        for column in list(pending):
+            record = records[column]
+            if batch_finished(record):
+                answers = fetch_batch_results(record)
+                print(f"Got {len(answers)} answers for {record['model']}")
+                write_answers(df, answers, column)
+                df.to_csv(answers_file, index=False)
+                # finished batches are never polled again, whatever their outcome
+                del records[column]
+                save_records()
+                pending.remove(column)
+                missing = len(unanswered(df, column))
+                if missing:
+                    print(f"Batch {record['batch_id']} ({record['status']}) left {missing} exams of "
+                          f"{record['model']} unanswered, rerun to resubmit them")
+        if pending:
+            time.sleep(poll_interval)
+    return df
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        answers_file = sys.argv[1]
+    else:
+        answers_file = '../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/test_answers_computer_and_mathematical_occupations.csv'
+    answer_exams_batch(answers_file)
@@ -10,8 +10,9 @@ import regex as re
 import sys
 import ast
 import json
-import subprocess
+import sqlite3
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from typing import Annotated
 from langchain_anthropic import ChatAnthropic
@@ -22,15 +23,25 @@ from langgraph.graph.message import add_messages
 from langchain.schema import SystemMessage, HumanMessage
 from langgraph.graph import START
 from langgraph.graph import END
+from langgraph.checkpoint.sqlite import SqliteSaver
 from IPython.display import Image, display
 
 
 dotenv_path = find_dotenv()
 load_dotenv(dotenv_path)
 from query_agents import *
+from grading_spec import SPEC_NAME, extract_spec, validate_spec, evaluate_spec
+from grading_runner import check_answer_key
+from script_preflight import preflight_script
 # load openai api key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+# 'spec' asks the author model for a declarative grading spec (see grading_spec) before falling back to a script
+GRADING_FORMAT = os.getenv("GRADING_FORMAT", "script")
+# seconds the answer key check may run the grading script
+KEY_CHECK_TIMEOUT = 60
+# grading scripts failing the pre-flight checks are regenerated at most this many times before they are run anyway
+MAX_PREFLIGHT_RETRIES = 3
 
 
 # Initialize Claude Sonnet
@@ -132,6 +143,45 @@ def extract_and_save_json(json_text: str, folder: str, filename: str = "answer_k
 
 
 
+def cacheable_system_prompt(state) -> list:
+    """
+    The exam system prompt as a single prompt part marked for provider prompt caching.
+    """
+    return [prompt_part(state["system_prompt"], cache=True)]
+
+
+def cacheable_prompt(prompt: str):
+    """
+    Splits a node prompt into prompt parts so the provider can cache the shared context prefix.
+
+    Each context section (overview, instructions, materials, ...) becomes its own part and the last one is
+    marked as cacheable; the node specific assignment follows uncached. The indentation the templates put
+    before a section is normalized (the first section starts the prompt, every other one its own line), so
+    a section has the same text in every node. Because later nodes repeat the sections of earlier nodes in
+    the same order, their prefixes hit the cache written by earlier nodes: instructions, materials,
+    submission, evaluation and grading share the overview, and each of them also shares the sections of the
+    nodes before it.
+    """
+    match = re.search(r'\s*#+ Your assignment', prompt)
+    if not match:
+        return prompt
+    context, assignment = prompt[:match.start()], prompt[match.start():]
+    sections = [section.strip() for section in re.split(r'(?=\n\s*Here (?:is|are) )', context) if section.strip()]
+    if not sections:
+        return prompt
+    parts = [prompt_part(section if i == 0 else '\n' + section) for i, section in enumerate(sections)]
+    parts[-1]['cache'] = True
+    parts.append(prompt_part(assignment))
+    return parts
+
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    """
+    Reducer for dict fields written by nodes running in parallel (e.g. metadata of the validation checks).
+    """
+    return {**(left or {}), **(right or {})}
+
+
 class ExamState(TypedDict):
     occupation: str
     task_id: str
@@ -155,6 +205,10 @@ class ExamState(TypedDict):
     submission: str
     evaluation: str
     grading: str
+    grading_spec: str
+    # problems found by the pre-flight checks of the last grading script, fed back to node_grading
+    grading_feedback: str
+    preflight_count: int
     answer_key:str
 
     errors: list
@@ -168,7 +222,7 @@ class ExamState(TypedDict):
     answer_key_count: int
     check_overall_makes_sense: bool
     explanation_overall_makes_sense:str
-    metadata: dict
+    metadata: Annotated[dict, merge_dicts]
     
 
 def node_system_prompt(state: ExamState) -> ExamState:
@@ -209,14 +263,14 @@ def node_overview(state: ExamState) -> ExamState:
     # HumanMessage(content=prompt_overview)
     # ]
     #print(state['exam_author_model'])
-    content, metadata = query_agent(state["system_prompt"], prompt_overview, state["exam_author_model"])
+    content, metadata = query_agent(cacheable_system_prompt(state), prompt_overview, state["exam_author_model"])
     #rint(response)
     state["overview"] = content
     state['metadata']['overview'] = metadata
     return state
 
 def node_instructions(state: ExamState) -> ExamState:
-    prompt_template_instructions ='''Here is brief explanation of the exam's purpose and structure intended for the evaluator: <examoverview> {answer_overview} </examoverview>
+    prompt_template_instructions ='''Here is brief explanation of the exam's purpose and structure intended for the evaluator: <examoverview> {answer_overview}</examoverview>
 
     ### Your assignment:
 
@@ -238,7 +292,7 @@ def node_instructions(state: ExamState) -> ExamState:
     # HumanMessage(content=prompt)
     # ]
 
-    content, metadata = query_agent(state["system_prompt"], prompt, state["exam_author_model"])
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"])
     state["instructions"] = content
     state['metadata']['instructions'] = metadata
     return state
@@ -278,7 +332,9 @@ def node_materials(state: ExamState) -> ExamState:
     # SystemMessage(content=state["system_prompt"]),
     # HumanMessage(content=prompt)
     # ]
-    content, metadata = query_agent(state["system_prompt"], prompt, state["exam_author_model"])
+    # a retry after "Not extracted" sends the same prompt, so it must not get the cached response back
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"],
+                                    use_cache=state["failed_candidate_materials"] == 0)
 
     state['metadata']['materials'] = metadata
     state["materials_all"] = content
@@ -316,7 +372,7 @@ def node_submission(state: ExamState) -> ExamState:
     #     SystemMessage(content=state["system_prompt"]),
     #     HumanMessage(content=prompt)
     # ]
-    content, metadata = query_agent(state["system_prompt"], prompt, state["exam_author_model"])
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"])
     state["submission"] = content
     state['metadata']['submission'] = metadata
 
@@ -348,15 +404,69 @@ def node_evaluation(state: ExamState) -> ExamState:
     #     SystemMessage(content=state["system_prompt"]),
     #     HumanMessage(content=prompt)
     # ]
-    content, metadata = query_agent(state["system_prompt"], prompt, state["exam_author_model"])
+    # after a failed answer key check the prompt is unchanged, so bypass the response cache
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"],
+                                    use_cache=state["answer_key_count"] == 0)
     state['evaluation']= content
     state["answer_key_count"] += 1
+    # the grading script for this answer key gets its own pre-flight retries
+    state["preflight_count"] = 0
+    state["grading_feedback"] = ""
     state['metadata']['evaluation'] = metadata
 
     return state
 
+def request_grading_spec(state: ExamState):
+    """
+    Asks the author model for a declarative grading spec (see grading_spec) for the answer key in state["evaluation"].
+
+    Returns:
+        tuple: (spec as JSON text or "" if no usable spec was returned, raw response, metadata)
+    """
+    match = re.search(r'```json(.*?)```', state["evaluation"], re.DOTALL)
+    try:
+        answer_key = json.loads(match.group(1).strip())
+    except (AttributeError, ValueError):
+        return "", "", {}
+    prompt_template_spec = """
+    Here is brief explanation of the exam's purpose and structure intended for the evaluator: <examoverview> {answer_overview}</examoverview>
+    Here are the submission requirements for the candidate: <submission_requirements> {answer_submission} </submission_requirements>
+    Here is the information given to the evaluator: <evaluation_information> {answer_evaluation} </evaluation_information>
+
+    ## Your assignment
+    Based on the given information, create a grading specification in JSON format that scores a candidate submission against the answer key automatically.
+    The specification has a list `items`. Each item scores one field of the answer key:
+    - `path`: dot separated path to the field in the answer key, `*` stands for every key or list position at that level (e.g. "forecast.headcount.*")
+    - `type`: "numeric" (compare numbers), "exact" (case-insensitive text or value match), "set" (list where order does not matter) or "list" (list where order matters)
+    - `points`: points of the field (of each field a `*` path expands to)
+    - for numeric items optionally `tiers`: list of [maximum percentage difference, share of points], e.g. [[2, 1.0], [5, 0.75], [10, 0.5], [20, 0.25]], or `tolerance_abs` for an absolute tolerance
+    Optionally add `passing_score` (percentage of points needed to pass).
+    Return only the specification in a ```json``` block.
+    """
+    prompt = prompt_template_spec.format(
+        answer_overview=state["overview"],
+        answer_submission=state["submission"],
+        answer_evaluation=state["evaluation"]
+    )
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"])
+    spec = extract_spec(content)
+    problems = validate_spec(spec, answer_key) if spec is not None else ["no grading spec found in the response"]
+    if problems:
+        print("grading spec not usable, falling back to a grading script:", problems[:3])
+        return "", content, metadata
+    return json.dumps(spec, indent=4), content, metadata
+
+
 def node_grading(state: ExamState) -> ExamState:
     print('starting node grading')
+    if GRADING_FORMAT == "spec":
+        spec, content, metadata = request_grading_spec(state)
+        state['metadata']['grading_spec'] = metadata
+        if spec:
+            state["grading_spec"] = spec
+            state["grading"] = content
+            return state
+    state["grading_spec"] = ""
     # Note, I modified the prompt so that files are passed as argument
     prompt_template_grading ="""
     Here is brief explanation of the exam's purpose and structure intended for the evaluator: <examoverview> {answer_overview}</examoverview>
@@ -385,20 +495,51 @@ def node_grading(state: ExamState) -> ExamState:
         answer_submission=state["submission"],
         answer_evaluation=state["evaluation"]
     )
+    if state.get("grading_feedback"):
+        prompt += f"""
+    A previous version of the script was rejected before it was run, because of these problems:
+    <problems> {state["grading_feedback"]} </problems>
+    Write a new script that fixes all of them.
+    """
     # messages = [
     #     SystemMessage(content=state["system_prompt"]),
     #     HumanMessage(content=prompt)
     # ]
-    content, metadata = query_agent(state["system_prompt"], prompt, state["exam_author_model"])
+    # a regeneration after failed pre-flight checks may repeat an earlier prompt, so bypass the response cache
+    content, metadata = query_agent(cacheable_system_prompt(state), cacheable_prompt(prompt), state["exam_author_model"],
+                                    use_cache=not state.get("grading_feedback"))
     state["grading"] = content
     state['metadata']['grading'] = metadata
 
     return state
 
 
+def node_preflight_grading(state: ExamState) -> ExamState:
+    """
+    Static checks of the generated grading script (see script_preflight) before it is saved and run.
+    Problems are kept in state["grading_feedback"] for the next node_grading prompt.
+    """
+    if state.get("grading_spec"):
+        state["grading_feedback"] = ""
+        return state
+    match = re.search(r'```python(.*?)```', state["grading"] or "", re.DOTALL)
+    if match:
+        problems = preflight_script(match.group(1).strip())
+    else:
+        problems = ["The response does not contain a ```python ... ``` code block with the script."]
+    state["grading_feedback"] = "\n".join("- " + p for p in problems)
+    state["metadata"]["preflight"] = problems
+    if problems:
+        state["preflight_count"] += 1
+        print(f"Grading script for task {state['task_id']} failed the pre-flight checks: {problems}")
+        state["errors"].append(f"Pre-flight of grading script failed: {problems}")
+    return state
+
+
 def node_save_eval_and_answer(state: ExamState) -> ExamState:
     """
-    1) Saves the Python grading script from state["grading"] into `task_evaluation.py`
+    1) Saves the grading spec from state["grading_spec"] into `grading_spec.json`, or if there is none,
+       the Python grading script from state["grading"] into `task_evaluation.py`
     2) Saves the answer key JSON from state["evaluation"] into `answer_key.json`
     """
     ('starting node save eval and answer')
@@ -407,12 +548,21 @@ def node_save_eval_and_answer(state: ExamState) -> ExamState:
     folder = task_id.replace(".", "_")
     
     try:
-        # 1. Save the Python grading script
-        script = extract_and_save_python_script(
-            script_text=state["grading"], 
-            folder= path + folder, 
-            filename="task_evaluation.py"
-        )
+        # 1. Save the grading spec if there is one, otherwise the Python grading script
+        spec_path = os.path.join(path + folder, SPEC_NAME)
+        if state.get("grading_spec"):
+            os.makedirs(path + folder, exist_ok=True)
+            with open(spec_path, "w", encoding="utf-8") as f:
+                f.write(state["grading_spec"])
+        else:
+            if os.path.exists(spec_path):
+                # a spec of an earlier attempt would take precedence over the new script
+                os.remove(spec_path)
+            script = extract_and_save_python_script(
+                script_text=state["grading"], 
+                folder= path + folder, 
+                filename="task_evaluation.py"
+            )
         # 2. Save the answer key
         key = extract_and_save_json(
             json_text=state["evaluation"], 
@@ -429,7 +579,7 @@ def node_save_eval_and_answer(state: ExamState) -> ExamState:
 
 
 
-def node_check_materials_fake_image(state: ExamState) -> ExamState:
+def node_check_materials_fake_image(state: ExamState) -> dict:
     # NOTE - TODO, maybe we want to add space for reasoning?
     prompt_check_fake_image = """
     You are a system verifying if the provided instructions and/or materials falsely claim to include an image, but it is only a description. 
@@ -445,15 +595,13 @@ def node_check_materials_fake_image(state: ExamState) -> ExamState:
     # ]
     content, metadata = query_agent(prompt_check_fake_image, state['instructions'] + state["materials_all"], state["exam_author_model"])
 
-    state['metadata']['check_materials'] = metadata
+    # runs in parallel with the other validation checks, so only return the fields this check sets
+    return {
+        "check_real_materials": content != "Y",
+        "metadata": {"check_materials": metadata},
+    }
 
-    if content == "Y":
-        state["check_real_materials"] = False
-    else:
-        state["check_real_materials"] = True
-    return state
-
-def node_check_materials_fake_website(state: ExamState) -> ExamState:
+def node_check_materials_fake_website(state: ExamState) -> dict:
     prompt_check_fake_website = """
     You are a system verifying whether the instructions and/or materials provided reference a publicly available website or news source that appears to be fabricated. 
     It is acceptable if the materials reference an internal document, company guidelines, accounting statements or well known public documents. 
@@ -468,89 +616,77 @@ def node_check_materials_fake_website(state: ExamState) -> ExamState:
     #     HumanMessage(content= state["instructions"] + state["materials_all"])
     # ]
     content, metadata = query_agent(prompt_check_fake_website, state["instructions"] + state["materials_all"], state["exam_author_model"])
-    state['metadata']['check_website'] = metadata
 
-    if content == "Y":
-        state["check_no_internet"] = False
-    else:
-        state["check_no_internet"] = True
-    return state
+    # runs in parallel with the other validation checks, so only return the fields this check sets
+    return {
+        "check_no_internet": content != "Y",
+        "metadata": {"check_website": metadata},
+    }
+
+
+def node_join_checks(state: ExamState) -> dict:
+    """
+    Waits for all validation checks; routing on their flags happens in route_after_checks.
+    """
+    return {}
+
+
+# Independent validation checks run in parallel after node_materials.
+# node name -> (node function, state flag the check sets; True means the check passed)
+VALIDATION_CHECKS = {
+    "node_check_images": (node_check_materials_fake_image, "check_real_materials"),
+    "node_check_websites": (node_check_materials_fake_website, "check_no_internet"),
+}
 
 
 def node_check_answer_key(state: ExamState) -> ExamState:
+    """
+    Grades the answer key with the grading script (or grading spec) of the task, it should get full marks.
+
+    Sets state["key_grade"] to the rounded overall score (nan if grading failed) and appends grading errors
+    to state["errors"]. Script runs go through grading_runner.check_answer_key, which runs them in a shared
+    worker pool with a timeout and reuses the outcome when an identical script / key pair comes back
+    through the evaluation -> grading loop.
+    """
     errors =[]
     task_id = state["task_id"]
     subfolder = task_id.replace(".", "_")
     path =  "../../data/exam_approach/test_results/" + state["exam_author_model"] + "/" + subfolder + "/"
     # Passes answer_key isntead of test_submission to later check answer key gets full marks
-    # subprocess.run(["ls", "-l", path])
-    try:
-        result = subprocess.run(
-            ["python", "task_evaluation.py", "answer_key.json", "answer_key.json"],
-            cwd=path,
-            check=True,  # Raise an exception if the command fails
-            stderr=subprocess.PIPE,  # Capture stderr
-            stdout=subprocess.PIPE   # Capture stdout (if needed)
-            )
-        print("Script executed successfully.")
-
-        # If the script runs successfully, append None to errors list (no errors)
-        errors.append(None)
-            # Now get answer key grade
+    if state.get("grading_spec"):
         try:
-            # Load the JSON file
-            with open(path + 'test_results.json', 'r') as f:
-                data = json.load(f)
-            
-            # Extract the overall_score
-            overall_score = data.get("overall_score", None)
-            state["key_grade"] = np.round(overall_score)
-            return state
-
-        except FileNotFoundError:
-            print(path)
-            print(f"Error: The file '{path}' was not found.")
-            errors.append('no overall score found')
-            state["errors"].append(errors)
-            state["key_grade"] = np.nan
-            return state
-        except json.JSONDecodeError:
-            print(f"Error: The file '{path}' is not a valid JSON file.")
-            errors.append('not json file')
-            state["errors"].append(errors)
-            state["key_grade"] = np.nan
-            return state
+            with open(path + 'answer_key.json', 'r') as f:
+                key = json.load(f)
+            result = evaluate_spec(json.loads(state["grading_spec"]), key, [key])[0]
+            state["key_grade"] = float(np.round(result['overall_score']))
         except Exception as e:
-            print(f"An unexpected error occurred: {str(e)}")
+            errors.append(f"Error: grading spec failed: {e}")
             state["errors"].append(errors)
-            errors.append(str(e))
             state["key_grade"] = np.nan
-            return state
-    
-    except subprocess.CalledProcessError as e:
-        # Capture and store the error output in the errors list
-        print(f"Error: Script failed with return code {e.returncode}")
-        print(f"Error Output:\n{e.stderr.decode('utf-8')}")
-        errors.append(e.stderr.decode('utf-8'))  # Append the error message to the errors list
+        return state
+
+    outcome = check_answer_key(path, timeout=KEY_CHECK_TIMEOUT)
+    state['metadata']['check_answer_key'] = {'cached': outcome.get('cached', False), 'error': outcome['error']}
+    if outcome['error'] is not None:
+        print(f"Error: answer key check failed for task {task_id}")
+        errors.append(outcome['error'])
         state["errors"].append(errors)
         state["key_grade"] = np.nan
         return state
-    except FileNotFoundError:
-        error_message = "Error: The script or directory was not found. Check the path."
-        print(error_message)
-        print(path)
-        errors.append(error_message)  # Append the error message to the errors list
+    if outcome['overall_score'] is None:
+        errors.append('no overall score found')
         state["errors"].append(errors)
         state["key_grade"] = np.nan
         return state
-    except Exception as e:
-        # Capture and store any unexpected error
-        error_message = f"An unexpected error occurred: {str(e)}"
-        print(error_message)
-        errors.append(error_message)  # Append the error message to the errors list   
+    try:
+        # plain float so the state can be serialised by the checkpointer
+        state["key_grade"] = float(np.round(outcome['overall_score']))
+    except (TypeError, ValueError) as e:
+        errors.append(str(e))
         state["errors"].append(errors)
         state["key_grade"] = np.nan
-        return state
+    print("Script executed successfully." + (" (cached)" if outcome.get('cached') else ""))
+    return state
 
 
 
@@ -653,22 +789,16 @@ def route_after_materials_candiate(state: ExamState) -> str:
     elif state["materials_candidate"] == "Not extracted":
         return "node_materials"
     else:
-        return "node_check_images"
+        # fan out to all validation checks at once
+        return list(VALIDATION_CHECKS)
 
 
-def route_after_image_check(state: ExamState) -> str:
+def route_after_checks(state: ExamState) -> str:
 
-    if state["check_real_materials"] == False:
-        return "node_end"
+    if all(state[flag] for _, flag in VALIDATION_CHECKS.values()):
+        return "node_submission"
     else:
-        return "node_check_websites"
-
-def route_after_internet_check(state: ExamState) -> str:
-
-    if state["check_no_internet"] == False:
         return "node_end"
-    else:
-        return "node_submission"
 
 
 # # Add a dummy node that does nothing but moves to node_evaluation
@@ -676,6 +806,14 @@ def route_after_internet_check(state: ExamState) -> str:
 #     return state
 
 
+def route_after_preflight(state: ExamState) -> str:
+    if state["grading_feedback"] and state["preflight_count"] <= MAX_PREFLIGHT_RETRIES:
+        # regenerate without running a script that cannot work
+        return "node_grading"
+    else:
+        return "node_save_eval_and_answer"
+
+
 # Update route
 def route_after_key_check(state: ExamState) -> str:
     if state["key_grade"] >= state["key_grade_threshold"]:
@@ -686,37 +824,14 @@ def route_after_key_check(state: ExamState) -> str:
         return "node_evaluation"
 
 
-if __name__ == "__main__":
-    occ = 'computer_and_mathematical_occupations'
-    print(occ)
-    #file_answers = "../../data/exam_approach/test_results/{}/test_results_business_and_financial_operations_occupations_CORE_automatable.csv".format(model)
-    tasks_file = f'/Users/htr365/Documents/PhD/21_automatisation/gpt_eval/data/exam_approach/material_lists/claude-3-7-sonnet-20250219/task_list_{occ}_CORE.csv'
-    df_tasks = pd.read_csv(tasks_file)
-    df_tasks  = df_tasks.loc[:, ~df_tasks .columns.str.contains('^Unnamed')]
-    print('overall data shape',df_tasks.shape)
-
-    #already_done = pd.read_csv('/Users/htr365/Documents/PhD/21_automatisation/gpt_eval/data/exam_approach/test_results/claude-3-7-sonnet-20250219/scores_61.csv')
-    # remove according to exclusion list
-    exclusion_list = pd.read_csv(f'../../data/exam_approach/exclusion_lists/{occ}_only_data_text_CORE.csv',index_col=0).rename(columns={'0':'task_id'})
-    df_tasks = df_tasks[~df_tasks['task_id'].isin(exclusion_list['task_id'])]
-    print('data after filtering for tools/materials', df_tasks.shape)
-   # df_tasks = df_tasks[~df_tasks['task_id'].isin(already_done['task_id'])]
-   # print('data after filtering for already existing exams', df_tasks.shape)
-    #model = 'claude-3-7-sonnet-20250219'
-    model = 'gemini-2.5-pro-preview-03-25'
-    print(model)
-    #df_tasks = df_tasks[df_tasks['task_id']==12882]
-    df_tasks = df_tasks[['occupation', 'task_description', 'task_id', 'required_tools_standard', 'required_materials_standard']]
-    seed = 42
-
-    # Assume df is your DataFrame
-    df_tasks = df_tasks.sample(n=10, random_state=seed)
-    print(df_tasks.shape)
-    #print(df_tasks)
-    # Initialize an empty list to store result states
-    result_states = []
-
+def build_exam_graph(checkpointer=None):
+    """
+    Builds and compiles the LangGraph pipeline that generates and validates one exam.
 
+    Args:
+        checkpointer (optional): LangGraph checkpointer (see open_checkpointer) persisting ExamState after
+            every node, so an interrupted task resumes from its last completed node.
+    """
     graph_builder = StateGraph(ExamState)
 
     # Add nodes to the graph
@@ -724,11 +839,13 @@ if __name__ == "__main__":
     graph_builder.add_node("node_overview", node_overview)
     graph_builder.add_node("node_instructions", node_instructions)
     graph_builder.add_node("node_materials", node_materials)
-    graph_builder.add_node("node_check_images", node_check_materials_fake_image)
-    graph_builder.add_node("node_check_websites", node_check_materials_fake_website)
+    for name, (check, _) in VALIDATION_CHECKS.items():
+        graph_builder.add_node(name, check)
+    graph_builder.add_node("node_join_checks", node_join_checks)
     graph_builder.add_node("node_submission", node_submission)
     graph_builder.add_node("node_evaluation", node_evaluation)
     graph_builder.add_node("node_grading", node_grading)
+    graph_builder.add_node("node_preflight_grading", node_preflight_grading)
     graph_builder.add_node("node_save_eval_and_answer", node_save_eval_and_answer)
     graph_builder.add_node("node_check_answer_key", node_check_answer_key)
     graph_builder.add_node("node_overall_makes_sense", node_overall_makes_sense)
@@ -744,22 +861,204 @@ if __name__ == "__main__":
     # add conditional edges in case materials for candidate where not extracted
     graph_builder.add_conditional_edges("node_materials", route_after_materials_candiate)
     ### Add conditional edges if materials_fake_website or materials_fake_image then end the process
-    graph_builder.add_conditional_edges("node_check_images", route_after_image_check)
-    graph_builder.add_conditional_edges("node_check_websites", route_after_internet_check)
+    # validation checks run in parallel and are joined before routing on their flags
+    graph_builder.add_edge(list(VALIDATION_CHECKS), "node_join_checks")
+    graph_builder.add_conditional_edges("node_join_checks", route_after_checks)
     # If it passes will continue to generatl submissions and grading
     graph_builder.add_edge("node_submission", 'node_evaluation')
     # graph_builder.add_edge("node_pause_before_evaluation", "node_evaluation")
 
     graph_builder.add_edge("node_evaluation", 'node_grading')
     # Now check the answer key and how much it scores
-    graph_builder.add_edge("node_grading", 'node_save_eval_and_answer')
+    graph_builder.add_edge("node_grading", "node_preflight_grading")
+    graph_builder.add_conditional_edges("node_preflight_grading", route_after_preflight)
     graph_builder.add_edge("node_save_eval_and_answer", "node_check_answer_key")
     # graph_builder.add_edge("node_check_answer_key", "node_overall_makes_sense")
     graph_builder.add_conditional_edges("node_check_answer_key", route_after_key_check)
     graph_builder.add_edge("node_overall_makes_sense", "node_end")
     graph_builder.add_edge("node_end", END)
     print('compiling graph')
-    graph = graph_builder.compile()
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+def make_init_state(row, model) -> ExamState:
+    """
+    Initial ExamState for a task row with columns occupation, task_description, task_id,
+    required_tools_standard and required_materials_standard.
+    """
+    return {
+        "occupation": row["occupation"],
+        "task_id": str(row["task_id"]),  # Convert task_id to a string
+        "task_description": row["task_description"],
+        "exam_author_model": model,
+
+        # Map your row fields to the typed dict fields
+        "tools": safe_eval(row["required_tools_standard"]),
+        "materials": safe_eval(row["required_materials_standard"]),
+
+        # Provide defaults or placeholders for the rest
+        "exam": {},
+        "system_prompt": "",
+        "overview": "",
+        "instructions": "",
+        "materials_all": "",
+        "materials_candidate": "",
+        "submission": "",
+        "evaluation": "",
+        "grading": "",
+        "grading_spec": "",
+        "grading_feedback": "",
+        "preflight_count": 0,
+        "answer_key": "",
+
+        "errors": [],
+        "check_real_materials": True,
+        "check_no_internet": True,
+        "failed_candidate_materials": 0,
+        "key_grade_threshold": 99.0,
+        "key_grade": 0.0,
+        "answer_key_count": 0,
+        "check_overall_makes_sense": True,
+        "explanation_overall_makes_sense": "",
+        "metadata": {}
+    }
+
+
+def open_checkpointer(path):
+    """
+    Opens (or creates) a SQLite checkpoint file shared by all worker threads.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def invoke_exam_graph(graph, init_state):
+    """
+    Runs the exam graph for one task, resuming from the last checkpoint if the graph has a checkpointer.
+
+    Returns:
+        ExamState: The final state of the task.
+    """
+    if graph.checkpointer is None:
+        return graph.invoke(init_state)
+
+    config = {"configurable": {"thread_id": f"{init_state['exam_author_model']}:{init_state['task_id']}"}}
+    snapshot = graph.get_state(config)
+    if snapshot.values and snapshot.next:
+        print(f"resuming task {init_state['task_id']} at {', '.join(snapshot.next)}")
+        return graph.invoke(None, config)
+    if snapshot.values:
+        # graph already ran to the end
+        return snapshot.values
+    return graph.invoke(init_state, config)
+
+
+def is_complete_state(state) -> bool:
+    """
+    A state is complete once node_end has compiled the exam (or marked it as not valid).
+    """
+    return isinstance(state.get("exam"), str)
+
+
+def load_exam_states(store_path):
+    """
+    Reads all states appended to a JSONL exam store.
+
+    Returns:
+        dict: task_id -> last stored state of that task.
+    """
+    states = {}
+    if not os.path.isfile(store_path):
+        return states
+    with open(store_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                state = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of an interrupted run
+                continue
+            states[str(state["task_id"])] = state
+    return states
+
+
+def run_exam_graphs(df_tasks, graph, model, store_path, workers=4):
+    """
+    Runs the exam graph for many tasks concurrently and appends every finished state to a JSONL store.
+
+    Args:
+        df_tasks (pd.DataFrame): Tasks to generate exams for (see make_init_state for the columns).
+        graph: The compiled exam graph, optionally with a checkpointer to resume half-finished tasks.
+        model (str): The exam author model.
+        store_path (str): JSONL file the states are appended to.
+        workers (int): Number of task graphs running at the same time.
+
+    Returns:
+        list: Complete (or failed) state of every task in df_tasks, in df_tasks order.
+
+    Notes:
+        - Tasks that already have a complete state in the store are skipped, so an interrupted run
+          can simply be restarted.
+        - Failed tasks are stored with their error and retried on the next run.
+    """
+    stored = load_exam_states(store_path)
+    pending = [row for _, row in df_tasks.iterrows()
+               if not is_complete_state(stored.get(str(row["task_id"]), {}))]
+    print(f"{len(df_tasks) - len(pending)} tasks already done, generating {len(pending)} exams with {workers} workers")
+
+    os.makedirs(os.path.dirname(store_path) or ".", exist_ok=True)
+    with open(store_path, "a", encoding="utf-8") as store, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(invoke_exam_graph, graph, make_init_state(row, model)): row for row in pending}
+        for n, future in enumerate(as_completed(futures), start=1):
+            row = futures[future]
+            try:
+                result_state = future.result()
+            except Exception as e:
+                # Handle any errors during graph invocation
+                print(f"Error processing task_id {row['task_id']}: {e}")
+                result_state = {
+                    "occupation": row["occupation"],
+                    "task_id": str(row["task_id"]),
+                    "task_description": row["task_description"],
+                    "exam_author_model": model,
+                    "errors": [str(e)]
+                }
+            store.write(json.dumps(result_state, ensure_ascii=False, default=str) + "\n")
+            store.flush()
+            stored[str(row["task_id"])] = result_state
+            print(f"finished task {row['task_id']} ({n}/{len(pending)})")
+
+    return [stored[str(task_id)] for task_id in df_tasks["task_id"] if str(task_id) in stored]
+
+
+if __name__ == "__main__":
+    occ = 'computer_and_mathematical_occupations'
+    print(occ)
+    #file_answers = "../../data/exam_approach/test_results/{}/test_results_business_and_financial_operations_occupations_CORE_automatable.csv".format(model)
+    tasks_file = f'/Users/htr365/Documents/PhD/21_automatisation/gpt_eval/data/exam_approach/material_lists/claude-3-7-sonnet-20250219/task_list_{occ}_CORE.csv'
+    df_tasks = pd.read_csv(tasks_file)
+    df_tasks  = df_tasks.loc[:, ~df_tasks .columns.str.contains('^Unnamed')]
+    print('overall data shape',df_tasks.shape)
+
+    #already_done = pd.read_csv('/Users/htr365/Documents/PhD/21_automatisation/gpt_eval/data/exam_approach/test_results/claude-3-7-sonnet-20250219/scores_61.csv')
+    # remove according to exclusion list
+    exclusion_list = pd.read_csv(f'../../data/exam_approach/exclusion_lists/{occ}_only_data_text_CORE.csv',index_col=0).rename(columns={'0':'task_id'})
+    df_tasks = df_tasks[~df_tasks['task_id'].isin(exclusion_list['task_id'])]
+    print('data after filtering for tools/materials', df_tasks.shape)
+   # df_tasks = df_tasks[~df_tasks['task_id'].isin(already_done['task_id'])]
+   # print('data after filtering for already existing exams', df_tasks.shape)
+    #model = 'claude-3-7-sonnet-20250219'
+    model = 'gemini-2.5-pro-preview-03-25'
+    print(model)
+    #df_tasks = df_tasks[df_tasks['task_id']==12882]
+    df_tasks = df_tasks[['occupation', 'task_description', 'task_id', 'required_tools_standard', 'required_materials_standard']]
+    seed = 42
+
+    # Assume df is your DataFrame
+    df_tasks = df_tasks.sample(n=10, random_state=seed)
+    print(df_tasks.shape)
+    #print(df_tasks)
+    checkpointer = open_checkpointer(f"../../data/exam_approach/test_results/{model}/checkpoints_{occ}.sqlite")
+    graph = build_exam_graph(checkpointer=checkpointer)
   
     # row = {
     #     'occupation': 'Wholesale and Retail Buyers, Except Farm Products',
@@ -835,67 +1134,12 @@ if __name__ == "__main__":
 
 # ##### Now run on a real dataframe
 
-    # Iterate over each row in the DataFrame
-    for _, row in df_tasks.iterrows():  # Use iterrows() to iterate over rows
-        # Initialize the state for the current row
-        
-        init_state: ExamState = {
-            "occupation": row["occupation"],
-            "task_id": str(row["task_id"]),  # Convert task_id to a string
-            "task_description": row["task_description"],
-            "exam_author_model": model,
-
-            # Map your row fields to the typed dict fields
-            "tools": safe_eval(row["required_tools_standard"]),
-            "materials": safe_eval(row["required_materials_standard"]),
-
-            # Provide defaults or placeholders for the rest
-            "exam": {},
-            "system_prompt": "",
-            "overview": "",
-            "instructions": "",
-            "materials_all": "",
-            "materials_candidate": "",
-            "submission": "",
-            "evaluation": "",
-            "grading": "",
-            "answer_key": "",
-
-            "errors": [],
-            "check_real_materials": True,
-            "check_no_internet": True,
-            "failed_candidate_materials": 0,
-            "key_grade_threshold": 99.0,
-            "key_grade": 0.0,
-            "answer_key_count": 0,
-            "check_overall_makes_sense": True,
-            "explanation_overall_makes_sense": "",
-            "metadata": {}
-            
-        }
-        print(init_state['task_id'])
-
-        try:
-            # Invoke the compiled graph with the initial state
-            result_state = graph.invoke(init_state)
-            # Append the result_state to the list
-            result_states.append(result_state)
-        except Exception as e:
-            # Handle any errors during graph invocation
-            print(f"Error processing task_id {row['task_id']}: {e}")
-            # Append an error state to the list for debugging
-            result_states.append({
-                "occupation": row["occupation"],
-                "task_id": row["task_id"],
-                "task_description": row["task_description"],
-                "exam_author_model": model,
-                "errors": [str(e)]
-            })
-
+    store_path = f"../../data/exam_approach/test_results/{model}/exams_{occ}.jsonl"
+    result_states = run_exam_graphs(df_tasks, graph, model, store_path, workers=8)
 
-        df_result_states = pd.DataFrame(result_states)
+    df_result_states = pd.DataFrame(result_states)
 
-        df_result_states.to_csv(f"../../data/exam_approach/test_results/{model}/exams_{occ}.csv", index=False)
+    df_result_states.to_csv(f"../../data/exam_approach/test_results/{model}/exams_{occ}.csv", index=False)
 
     # # # Save the resulting DataFrame to a CSV file (optional)
         #df_result_states.to_csv("../../data/exam_approach/test_results/{model}/exams_management_occupations.csv", index=False)
@@ -5,7 +5,7 @@ import json
 import re
 from typing import Union, List
 from dotenv import load_dotenv, find_dotenv
-from query_agents import query_agent 
+from query_agents import query_agent, query_many
 import sys
 
 # Load environment variables from a .env file if available
@@ -117,26 +117,31 @@ def get_requirements(df: pd.DataFrame, system_prompt_template: str, user_prompt_
     """
     results = []
 
+    # Format system and user prompts for every row first so all queries can be sent concurrently
+    prompts = []
     for i, row in df.iterrows():
+        # Extract relevant values from the row for prompt formatting
+        occupation = row['title']
+        task_description = row['task']
+        task_id = row['task_id']
+
+        system_prompt = system_prompt_template.format(
+            occupation=occupation,
+            task_description=task_description,
+        )
+        user_prompt = user_prompt_template.format(
+            occupation=occupation,
+            task_description=task_description,
+            task_id=task_id
+        )
+        prompts.append((i, system_prompt, user_prompt))
+
+    # Generate the responses via the query agent
+    responses = query_many([(system_prompt, user_prompt, model) for _, system_prompt, user_prompt in prompts])
+
+    for (i, system_prompt, user_prompt), response in zip(prompts, responses):
         try:
-            # Extract relevant values from the row for prompt formatting
-            occupation = row['title']
-            task_description = row['task']
-            task_id = row['task_id']
-
-            # Format system and user prompts using the provided templates
-            system_prompt = system_prompt_template.format(
-                occupation=occupation,
-                task_description=task_description,
-            )
-            user_prompt = user_prompt_template.format(
-                occupation=occupation,
-                task_description=task_description,
-                task_id=task_id
-            )
-
-            # Generate the response via the query agent
-            output = query_agent(system_prompt, user_prompt, model)
+            output = response[0] if response else None
 
             try:
                 # Attempt to parse output as JSON directly
@@ -1,43 +1,48 @@
 import os
 from build_prompt_parts import  build_system_prompt, query_LLM
-from take_test import run_evaluation
+from take_test import run_evaluations, save_evaluation, copy_answer_key, CANDIDATE_MODELS
+from results_index import ResultsIndex
 import pandas as pd
 
 
-def check_for_test_submission(root_dir):
+def find_empty_folders(folder_path):
     """
-    Recursively checks all subfolders of root_dir to see 
-    if at least one file named 'test_submission.json' exists.
-    Returns True if found, otherwise False.
-    """ 
-    for dirpath, _, filenames in os.walk(root_dir):
-        if 'test_results.json' in filenames:
-            return True
-    return False
+    Returns the task folders in which no candidate has a test_results.json yet.
 
-def find_empty_folders(folder_path):
-    subfolders = [f for f in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, f))]
-    failed_task_eval =[]
-    for subfolder in subfolders:
-        checkmark = check_for_test_submission(folder_path+subfolder)
-        if checkmark == False:
-            failed_task_eval.append(subfolder)
-    return failed_task_eval
+    Uses the results index of the folder (see results_index), so only files that changed since
+    the last call are looked at again.
+    """
+    index = ResultsIndex(folder_path)
+    index.refresh()
+    return index.tasks_without_results()
     
 def regenerate_eval(df, folder_path):
+    """
+    Regenerates the grading script of tasks without any results and regrades their submissions.
+
+    Args:
+        df (pd.DataFrame): Exams with `task_id`, `grading` and `answer_key`.
+        folder_path (str): Results folder with one subfolder per task.
+
+    Notes:
+        - Grading is dependency tracked (see grading_runner.grade_changed_jobs): only submissions whose
+          grading script, answer key or submission changed are graded again.
+    """
     #print(df['task_id'].astype(str).str.replace(".", "_"))
     fails= find_empty_folders(folder_path)
     print('found ', len(fails),' empty folders.')
-    df = df[df['task_id'].astype(str).str.replace(".", "_").isin(fails)]
-    df['answer_grading'] = df.apply(query_LLM, axis=1, args=('prompt_grading',))
+    df = df[df['task_id'].astype(str).str.replace(".", "_").isin(fails)].copy()
+    df['grading'] = df.apply(query_LLM, axis=1, args=('prompt_grading',))
+    df['evaluation_python'] = df.apply(save_evaluation, axis=1, args=(folder_path,))
+    df.apply(copy_answer_key, axis=1, args=(folder_path,))
     print('running evaluation')
-    df['errors_chatgpt35'] = df.apply(run_evaluation, axis=1, args=('../../data/exam_approach/test_results/','chatgpt35',))
-    df['errors_chatgpt4o'] = df.apply(run_evaluation, axis=1, args=('../../data/exam_approach/test_results/','chatgpt4o',))
-    df['errors_claude'] = df.apply(run_evaluation, axis=1, args=('../../data/exam_approach/test_results/','claude',))
-    df['errors_deepseek'] = df.apply(run_evaluation, axis=1, args=('../../data/exam_approach/test_results/','deepseek',))
-    df['errors_gemini'] = df.apply(run_evaluation, axis=1, args=('../../data/exam_approach/test_results/','gemini',))
+    errors = run_evaluations(df, folder_path, list(CANDIDATE_MODELS) + ['empty_submission'], only_changed=True)
+    for candidate, candidate_errors in errors.items():
+        column = 'errors_empty' if candidate == 'empty_submission' else 'errors_' + candidate
+        df[column] = candidate_errors
     fails_remaining= find_empty_folders(folder_path)
     print('found ', len(fails_remaining),' empty folders.')
+    return df
 
 
 if __name__ == "__main__":
@@ -0,0 +1,579 @@
+import os
+import io
+import sys
+import json
+import shutil
+import signal
+import hashlib
+import time
+import tempfile
+import threading
+import traceback
+import contextlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from grading_spec import SPEC_NAME, grade_spec_jobs
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+DEFAULT_TIMEOUT = 30
+# seconds a job may overrun its timeout before the parent kills its worker (see run_isolated)
+DEADLINE_GRACE = 30
+DEFAULT_MEMORY_MB = 2048
+SCRIPT_NAME = 'task_evaluation.py'
+RESULTS_NAME = 'test_results.json'
+SCRIPT_NOT_FOUND = "Error: The script or directory was not found. Check the path."
+WORKER_CRASHED = "Error: grading worker crashed"
+TIMEOUT_ERROR = "Error: grading timed out"
+FINGERPRINTS_NAME = 'grading_fingerprints.json'
+
+
+class GradingTimeout(BaseException):
+    # not an Exception, so `except Exception:` blocks in generated scripts do not swallow it
+    pass
+
+
+def make_job(task_dir, candidate, script=None, answer_key=None, submission_name='test_submission.json'):
+    """
+    Describes the grading of one candidate submission.
+
+    Args:
+        task_dir (str): Task folder containing `task_evaluation.py` and `answer_key.json`.
+        candidate (str): Candidate subfolder holding the submission.
+        script (str, optional): Grading script, defaults to the task-level `task_evaluation.py`.
+        answer_key (str, optional): Answer key, defaults to the task-level `answer_key.json`.
+        submission_name (str): File name of the submission inside the candidate folder.
+
+    Returns:
+        dict: The grading job.
+    """
+    return {
+        'task_id': os.path.basename(os.path.normpath(task_dir)),
+        'candidate': candidate,
+        'script': script or os.path.join(task_dir, SCRIPT_NAME),
+        'answer_key': answer_key or os.path.join(task_dir, 'answer_key.json'),
+        'submission': os.path.join(task_dir, candidate, submission_name),
+        'output_dir': os.path.join(task_dir, candidate),
+    }
+
+
+# ---------------------------------------------------------------------------
+# worker side
+
+# compiled grading scripts of this worker, keyed by the hash of their source
+_compiled = {}
+_MAX_COMPILED = 256
+
+
+def _init_worker(memory_mb):
+    if resource is not None and memory_mb:
+        limit = int(memory_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _on_timeout(signum, frame):
+    raise GradingTimeout()
+
+
+def _compile(source, digest):
+    code = _compiled.get(digest)
+    if code is None:
+        if len(_compiled) >= _MAX_COMPILED:
+            _compiled.clear()
+        code = compile(source, SCRIPT_NAME, 'exec')
+        _compiled[digest] = code
+    return code
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.symlink(os.path.abspath(src), dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def run_job(job, source, digest, timeout=DEFAULT_TIMEOUT):
+    """
+    Runs a grading script against one submission inside the current process.
+
+    The script runs as `__main__` with the same command line as
+    `python task_evaluation.py test_submission.json answer_key.json`, in a scratch folder that
+    links to the input files, so whatever it writes never touches the results tree.
+
+    Returns:
+        dict: task_id, candidate, results (parsed test_results.json or None), overall_score and
+              error (None on success, otherwise stderr / traceback of the script).
+    """
+    outcome = {'task_id': job['task_id'], 'candidate': job['candidate'],
+               'results': None, 'overall_score': None, 'error': None}
+    cwd = os.getcwd()
+    argv = sys.argv
+    stderr = io.StringIO()
+    workdir = tempfile.mkdtemp(prefix='grading_')
+    try:
+        code = _compile(source, digest)
+        _link_or_copy(job['submission'], os.path.join(workdir, 'test_submission.json'))
+        _link_or_copy(job['answer_key'], os.path.join(workdir, 'answer_key.json'))
+        os.chdir(workdir)
+        sys.argv = [SCRIPT_NAME, 'test_submission.json', 'answer_key.json']
+        script_globals = {'__name__': '__main__', '__file__': os.path.join(workdir, SCRIPT_NAME),
+                          '__builtins__': __builtins__}
+
+        previous_handler = signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+                try:
+                    exec(code, script_globals)
+                except SystemExit as e:
+                    if e.code not in (None, 0):
+                        raise
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+        with open(os.path.join(workdir, RESULTS_NAME), 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        outcome['results'] = results
+        if isinstance(results, list) and results:
+            results = results[0]
+        if isinstance(results, dict):
+            outcome['overall_score'] = results.get('overall_score')
+    except GradingTimeout:
+        outcome['error'] = f"{TIMEOUT_ERROR} after {timeout}s"
+    except FileNotFoundError as e:
+        outcome['error'] = f"Error: file not found: {e.filename}"
+    except MemoryError:
+        outcome['error'] = "Error: grading exceeded the memory limit"
+    except BaseException:
+        outcome['error'] = stderr.getvalue() + traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+        shutil.rmtree(workdir, ignore_errors=True)
+    return outcome
+
+
+# ---------------------------------------------------------------------------
+# parent side
+
+def read_script(path):
+    """
+    Returns the source of a grading script and its SHA-256, or (None, None) if it does not exist.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+    except FileNotFoundError:
+        return None, None
+    return source, hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def write_results(outcome, output_dir):
+    """
+    Writes a grading outcome as test_results.json into the candidate folder (compatibility with the tree layout).
+    """
+    if outcome['results'] is None:
+        return
+    with open(os.path.join(output_dir, RESULTS_NAME), 'w', encoding='utf-8') as f:
+        json.dump(outcome['results'], f, ensure_ascii=False, indent=4)
+
+
+def task_dir(job):
+    return os.path.dirname(os.path.normpath(job['output_dir']))
+
+
+def has_spec(job):
+    """
+    True if the job's task is graded by a declarative grading spec (see grading_spec) instead of a script.
+    """
+    return os.path.isfile(os.path.join(task_dir(job), SPEC_NAME))
+
+
+def grading_pool(workers=None, memory_mb=DEFAULT_MEMORY_MB, mp_context=None):
+    """
+    Process pool whose workers run grading scripts (see run_job) under the given memory limit.
+
+    Args:
+        mp_context (optional): multiprocessing context of the workers, defaults to the platform's start method.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(memory_mb,),
+                               mp_context=mp_context)
+
+
+def failed_outcome(job, error):
+    """
+    Outcome of a job that could not be graded at all.
+    """
+    return {'task_id': job['task_id'], 'candidate': job['candidate'], 'results': None,
+            'overall_score': None, 'error': error}
+
+
+def _kill_workers(pool):
+    # a running call cannot be cancelled; killing the workers breaks the pool, which is then replaced
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+
+
+def run_isolated(calls, workers=None, memory_mb=DEFAULT_MEMORY_MB, deadline=None):
+    """
+    Runs calls in a grading pool so that a generated script which kills its worker (os._exit, segfault,
+    memory) or hangs only fails its own call.
+
+    Args:
+        calls (iterable): (key, function, args) tuples, consumed lazily as workers become free.
+        workers (int, optional): Number of worker processes, defaults to the number of cores.
+        memory_mb (int): Address-space limit of each worker.
+        deadline (float, optional): Seconds after which a call that has not returned is abandoned.
+
+    Yields:
+        tuple: (key, result, error) as the calls finish; result is None and error is WORKER_CRASHED or a
+               TIMEOUT_ERROR message if the call did not return.
+
+    Notes:
+        - At most one call per worker is in flight, so after the pool broke only the calls in flight can
+          be responsible. They are rerun one at a time in a fresh pool to find the one that crashed; the
+          others and all later calls are not affected.
+        - On a deadline the workers are killed and the pool replaced; the other calls in flight are resubmitted.
+    """
+    workers = workers or os.cpu_count() or 1
+    calls = iter(calls)
+    retry = deque()      # calls in flight when the workers were killed after a deadline
+    suspects = deque()   # calls in flight when the pool broke, rerun one at a time
+    exhausted = False
+    while suspects or retry or not exhausted:
+        solo = bool(suspects)
+        limit = 1 if solo else workers
+        pool = grading_pool(limit, memory_mb)
+        running = {}
+        try:
+            while True:
+                while len(running) < limit:
+                    if solo:
+                        if not suspects:
+                            break
+                        call = suspects.popleft()
+                    elif retry:
+                        call = retry.popleft()
+                    else:
+                        call = next(calls, None)
+                        if call is None:
+                            exhausted = True
+                            break
+                    key, function, args = call
+                    running[pool.submit(function, *args)] = (call, time.monotonic())
+                if not running:
+                    break
+
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0.0, min(started for _, started in running.values()) + deadline - time.monotonic())
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    now = time.monotonic()
+                    for call, started in running.values():
+                        if now - started >= deadline:
+                            yield call[0], None, f"{TIMEOUT_ERROR} after {deadline}s, worker killed"
+                        else:
+                            (suspects if solo else retry).append(call)
+                    _kill_workers(pool)
+                    break
+
+                broken = []
+                for future in done:
+                    call, _ = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken.append(call)
+                    else:
+                        yield call[0], result, None
+                if broken:
+                    broken.extend(call for call, _ in running.values())
+                    if solo:
+                        # the only call in flight
+                        yield broken[0][0], None, WORKER_CRASHED
+                    else:
+                        suspects.extend(broken)
+                    break
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def grade_jobs(jobs, workers=None, timeout=DEFAULT_TIMEOUT, memory_mb=DEFAULT_MEMORY_MB, save_results=True):
+    """
+    Grades many submissions in a pool of reusable worker processes.
+
+    Args:
+        jobs (list): Grading jobs created with make_job.
+        workers (int, optional): Number of worker processes, defaults to the number of cores.
+        timeout (float): Seconds a single grading run may take.
+        memory_mb (int): Address-space limit of each worker.
+        save_results (bool): Also write test_results.json into each candidate folder.
+
+    Returns:
+        list: One outcome dict (see run_job) per job, in job order.
+
+    Notes:
+        - Tasks with a grading_spec.json are scored by the NumPy spec evaluator, all candidates of a task at once.
+        - Every grading script is read once; workers compile it once and reuse the code object for
+          all submissions of the task.
+        - Results are returned in memory, writing test_results.json is only done for compatibility.
+        - A script that crashes its worker or runs past its timeout (even if it catches the timeout)
+          only fails its own submission, see run_isolated.
+    """
+    outcomes = [None] * len(jobs)
+    # tasks with a grading spec are scored in batches here, without running generated code
+    spec_jobs = [i for i, job in enumerate(jobs) if has_spec(job)]
+    for i, outcome in zip(spec_jobs, grade_spec_jobs([jobs[i] for i in spec_jobs])):
+        outcomes[i] = outcome
+        if save_results:
+            write_results(outcome, jobs[i]['output_dir'])
+
+    scripts = {}
+    for i, job in enumerate(jobs):
+        if outcomes[i] is None and job['script'] not in scripts:
+            scripts[job['script']] = read_script(job['script'])
+
+    runnable = []
+    for i, job in enumerate(jobs):
+        if outcomes[i] is not None:
+            continue
+        if scripts[job['script']][0] is None:
+            outcomes[i] = failed_outcome(job, SCRIPT_NOT_FOUND)
+        else:
+            runnable.append(i)
+    # keep the submissions of one task together so workers reuse the compiled script
+    runnable.sort(key=lambda i: jobs[i]['script'])
+
+    calls = ((i, run_job, (jobs[i],) + scripts[jobs[i]['script']] + (timeout,)) for i in runnable)
+    for n, (i, outcome, error) in enumerate(run_isolated(calls, workers, memory_mb, timeout + DEADLINE_GRACE), start=1):
+        outcomes[i] = outcome if error is None else failed_outcome(jobs[i], error)
+        if save_results:
+            write_results(outcomes[i], jobs[i]['output_dir'])
+        if n % 100 == 0:
+            print(f"graded {n}/{len(runnable)} submissions")
+    return outcomes
+
+
+# ---------------------------------------------------------------------------
+# answer key self-check
+
+# outcomes of answer key checks, keyed by (script hash, answer key hash)
+_key_checks = {}
+_key_checks_lock = threading.Lock()
+_shared_pool = None
+KEY_CHECK_WORKERS = 2
+# at most one check per worker in flight, so a submitted check starts right away and its deadline holds
+_key_check_slots = threading.BoundedSemaphore(KEY_CHECK_WORKERS)
+
+
+def _worker_context():
+    # the answer key checks are started from the threads of run_exam_graphs; forking a multithreaded
+    # process can deadlock on locks held by other threads, so the workers are started from a clean process
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _get_shared_pool():
+    global _shared_pool
+    with _key_checks_lock:
+        if _shared_pool is None:
+            _shared_pool = grading_pool(KEY_CHECK_WORKERS, mp_context=_worker_context())
+        return _shared_pool
+
+
+def _reset_shared_pool(pool):
+    # replaces the shared pool unless another thread already did
+    global _shared_pool
+    with _key_checks_lock:
+        if _shared_pool is pool:
+            _shared_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def check_answer_key(task_dir, timeout=DEFAULT_TIMEOUT):
+    """
+    Grades a task's answer key with its own grading script (it should get full marks).
+
+    Args:
+        task_dir (str): Task folder containing `task_evaluation.py` and `answer_key.json`.
+        timeout (float): Seconds the grading run may take.
+
+    Returns:
+        dict: Outcome in the format of run_job, with `cached` set if an identical script / answer key
+              pair was checked before.
+
+    Notes:
+        - Runs in a small pool of long-lived worker processes shared by all callers (also from threads,
+          where the timeout signal could not be used), instead of starting an interpreter per check.
+          The workers are started with forkserver (spawn where it is not available), not forked from the
+          multithreaded caller.
+        - A script that ignores its timeout is stopped by killing the pool's workers after
+          timeout + DEADLINE_GRACE seconds. Checks that were running in a pool broken by another script
+          (a crash or such a kill) are rerun alone in a single-worker pool, so only the culprit fails.
+        - Nothing is written to the task folder.
+    """
+    script = os.path.join(task_dir, SCRIPT_NAME)
+    key = os.path.join(task_dir, 'answer_key.json')
+    job = {'task_id': os.path.basename(os.path.normpath(task_dir)), 'candidate': 'answer_key',
+           'script': script, 'answer_key': key, 'submission': key, 'output_dir': task_dir}
+    source, digest = read_script(script)
+    if source is None:
+        return failed_outcome(job, SCRIPT_NOT_FOUND)
+    memo_key = (digest, _file_digest(key))
+    with _key_checks_lock:
+        if memo_key in _key_checks:
+            return dict(_key_checks[memo_key], cached=True)
+    deadline = timeout + DEADLINE_GRACE
+    with _key_check_slots:
+        pool = _get_shared_pool()
+        try:
+            outcome = pool.submit(run_job, job, source, digest, timeout).result(timeout=deadline)
+        except FutureTimeout:
+            _kill_workers(pool)
+            _reset_shared_pool(pool)
+            return failed_outcome(job, f"{TIMEOUT_ERROR} after {deadline}s, worker killed")
+        except BrokenProcessPool:
+            _reset_shared_pool(pool)
+            outcome = None
+    if outcome is None:
+        # the pool may have been broken by another thread's check: rerun alone to know if this one crashes
+        with grading_pool(1, mp_context=_worker_context()) as pool:
+            try:
+                outcome = pool.submit(run_job, job, source, digest, timeout).result(timeout=deadline)
+            except FutureTimeout:
+                _kill_workers(pool)
+                return failed_outcome(job, f"{TIMEOUT_ERROR} after {deadline}s, worker killed")
+            except BrokenProcessPool:
+                return failed_outcome(job, WORKER_CRASHED)
+    if not (outcome['error'] or '').startswith(TIMEOUT_ERROR):
+        with _key_checks_lock:
+            _key_checks[memo_key] = outcome
+    return dict(outcome, cached=False)
+
+
+# ---------------------------------------------------------------------------
+# selective regrading
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    except FileNotFoundError:
+        return 'missing'
+    return h.hexdigest()
+
+
+def job_fingerprint(job):
+    """
+    Hash over everything a grading result depends on: grading script, answer key and submission
+    (and the grading spec of tasks that have one).
+    """
+    parts = [_file_digest(job[name]) for name in ('script', 'answer_key', 'submission')]
+    if has_spec(job):
+        parts.append(_file_digest(os.path.join(task_dir(job), SPEC_NAME)))
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def job_key(job):
+    return f"{job['task_id']}/{job['candidate']}"
+
+
+def load_fingerprints(folder):
+    """
+    Fingerprints of the last grading run of each submission below a results folder.
+
+    Returns:
+        dict: '<task>/<candidate>' -> {'fingerprint': ..., 'error': ...}
+    """
+    try:
+        with open(os.path.join(folder, FINGERPRINTS_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_fingerprints(folder, fingerprints):
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(folder, FINGERPRINTS_NAME))
+
+
+def is_up_to_date(job, fingerprint, previous):
+    """
+    True if the job was graded before with the same inputs and its results are still there.
+    """
+    return (previous is not None and previous['fingerprint'] == fingerprint
+            and (previous['error'] is not None or os.path.isfile(os.path.join(job['output_dir'], RESULTS_NAME))))
+
+
+def record_fingerprint(fingerprints, job, fingerprint, outcome):
+    """
+    Stores the fingerprint of a graded job; timeouts and crashes are not recorded so they are retried.
+    """
+    if outcome['error'] == WORKER_CRASHED or (outcome['error'] or '').startswith(TIMEOUT_ERROR):
+        fingerprints.pop(job_key(job), None)
+    else:
+        fingerprints[job_key(job)] = {'fingerprint': fingerprint, 'error': outcome['error']}
+
+
+def grade_changed_jobs(jobs, folder, **kwargs):
+    """
+    Grades only the submissions whose grading script, answer key or submission changed since their last grading.
+
+    Args:
+        jobs (list): Grading jobs created with make_job.
+        folder (str): Results folder holding the fingerprint file.
+        **kwargs: Passed on to grade_jobs.
+
+    Returns:
+        list: One outcome dict per job, in job order. Up-to-date jobs are not run; their outcome has
+              `skipped` set and carries the error of the previous run.
+    """
+    fingerprints = load_fingerprints(folder)
+    current = [job_fingerprint(job) for job in jobs]
+    stale = [i for i, job in enumerate(jobs) if not is_up_to_date(job, current[i], fingerprints.get(job_key(job)))]
+    stale_set = set(stale)
+    print(f"{len(stale)} of {len(jobs)} submissions changed since their last grading")
+
+    outcomes = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        if i not in stale_set:
+            outcomes[i] = dict(failed_outcome(job, fingerprints[job_key(job)]['error']), skipped=True)
+    for i, outcome in zip(stale, grade_jobs([jobs[i] for i in stale], **kwargs)):
+        outcomes[i] = outcome
+        record_fingerprint(fingerprints, jobs[i], current[i], outcome)
+    save_fingerprints(folder, fingerprints)
+    return outcomes
+
+
+def grade_results_tree(model_folder_path, candidates, task_ids=None, **kwargs):
+    """
+    Grades every candidate submission below a results folder such as
+    `data/exam_approach/test_results/<author model>/`.
+
+    Args:
+        model_folder_path (str): Folder containing one subfolder per task.
+        candidates (list): Candidate subfolder names to grade.
+        task_ids (list, optional): Restrict grading to these task folders.
+        **kwargs: Passed on to grade_jobs.
+
+    Returns:
+        list: Outcome dicts of all graded submissions.
+    """
+    if task_ids is None:
+        # hidden folders such as the shared blob store (.blobs) are not tasks
+        task_ids = [name for name in sorted(os.listdir(model_folder_path))
+                    if os.path.isdir(os.path.join(model_folder_path, name)) and not name.startswith('.')]
+    jobs = [make_job(os.path.join(model_folder_path, task_id), candidate)
+            for task_id in task_ids for candidate in candidates]
+    return grade_jobs(jobs, **kwargs)
@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import numpy as np
+
+SPEC_NAME = 'grading_spec.json'
+ITEM_TYPES = ('numeric', 'exact', 'set', 'list')
+# default tolerance tiers of numeric items: (max percentage difference, share of the points)
+DEFAULT_TIERS = [[2, 1.0], [5, 0.75], [10, 0.5], [20, 0.25]]
+
+# Declarative alternative to a generated task_evaluation.py. Expected values are read from the answer key,
+# the spec only says where to look and how to score:
+# {
+#     "items": [
+#         {"path": "forecast.end_of_period_headcount.*", "type": "numeric", "points": 2,
+#          "tiers": [[2, 1.0], [5, 0.75], [10, 0.5], [20, 0.25]]},
+#         {"path": "historical_analysis.highest_turnover_departments", "type": "set", "points": 6},
+#         {"path": "resource_planning.highest_growth_departments", "type": "list", "points": 4},
+#         {"path": "gap_analysis.largest_percentage_gap", "type": "exact", "points": 3}
+#     ],
+#     "passing_score": 70
+# }
+# `*` in a path expands to every key (or list position) of the answer key at that level.
+# numeric: points scaled by the first tier whose percentage difference is not exceeded
+#          (or full points within `tolerance_abs` if given)
+# exact:   case-insensitive match of strings, equality otherwise
+# set:     share of the expected elements present in the answer
+# list:    share of positions holding the expected element
+
+
+def extract_spec(text):
+    """
+    Parses a grading spec from an LLM response (```json ... ``` block or bare JSON).
+
+    Returns:
+        dict: The spec, or None if the response holds no JSON object with `items`.
+    """
+    match = re.search(r'```json(.*?)```', text or '', re.DOTALL)
+    try:
+        spec = json.loads(match.group(1) if match else text)
+    except (TypeError, ValueError):
+        return None
+    return spec if isinstance(spec, dict) and isinstance(spec.get('items'), list) else None
+
+
+def load_spec(task_dir):
+    """
+    Reads the grading spec of a task folder, or returns None if the task is graded by a script.
+    """
+    try:
+        with open(os.path.join(task_dir, SPEC_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _lookup(data, parts):
+    for part in parts:
+        if isinstance(data, dict) and part in data:
+            data = data[part]
+        elif isinstance(data, list) and part.isdigit() and int(part) < len(data):
+            data = data[int(part)]
+        else:
+            return None, False
+    return data, True
+
+
+def _expand(data, parts, prefix=()):
+    # paths of the answer key matching a pattern with `*` wildcards
+    if not parts:
+        return [prefix]
+    head, rest = parts[0], parts[1:]
+    if head != '*':
+        value, found = _lookup(data, [head])
+        return _expand(value, rest, prefix + (head,)) if found else [prefix + tuple(parts)]
+    if isinstance(data, dict):
+        keys = list(data)
+    elif isinstance(data, list):
+        keys = [str(i) for i in range(len(data))]
+    else:
+        return []
+    paths = []
+    for key in keys:
+        paths.extend(_expand(_lookup(data, [key])[0], rest, prefix + (key,)))
+    return paths
+
+
+def expand_spec(spec, answer_key):
+    """
+    Resolves the spec against an answer key into one scoring item per answer field.
+
+    Returns:
+        list: Items with `path` (tuple), `type`, `points`, `expected` and the scoring options of the spec item.
+    """
+    items = []
+    for item in spec['items']:
+        for path in _expand(answer_key, item['path'].split('.')):
+            expected, found = _lookup(answer_key, path)
+            items.append(dict(item, path=path, expected=expected, found=found))
+    return items
+
+
+def validate_spec(spec, answer_key):
+    """
+    Checks that a spec is well formed and that every item points at a value of the answer key.
+
+    Returns:
+        list: Problems found, empty if the spec can be used.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('items'), list) or not spec['items']:
+        return ["The spec must be a JSON object with a non-empty list `items`."]
+    problems = []
+    for n, item in enumerate(spec['items']):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            problems.append(f"Item {n} has no `path`.")
+            continue
+        if item.get('type') not in ITEM_TYPES:
+            problems.append(f"Item {item['path']} has type {item.get('type')!r}, expected one of {ITEM_TYPES}.")
+        if not isinstance(item.get('points'), (int, float)) or item['points'] <= 0:
+            problems.append(f"Item {item['path']} needs positive `points`.")
+    if problems:
+        return problems
+    items = expand_spec(spec, answer_key)
+    if not items:
+        problems.append("The spec does not match any field of the answer key.")
+    for item in items:
+        path = '.'.join(item['path'])
+        if not item['found']:
+            problems.append(f"Path {path} does not exist in the answer key.")
+        elif item['type'] == 'numeric' and _to_number(item['expected']) is None:
+            problems.append(f"Path {path} is scored as numeric but the answer key holds {item['expected']!r}.")
+        elif item['type'] in ('set', 'list') and not isinstance(item['expected'], list):
+            problems.append(f"Path {path} is scored as a {item['type']} but the answer key does not hold a list.")
+    return problems
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().rstrip('%').replace(',', '').replace('$', ''))
+        except ValueError:
+            return None
+    return None
+
+
+def _normalize(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def _hashable(value):
+    value = _normalize(value)
+    return json.dumps(value, sort_keys=True) if isinstance(value, (dict, list)) else value
+
+
+def _score_other(item, answer):
+    # share of the points earned by one answer for exact / set / list items
+    expected = item['expected']
+    if item['type'] == 'exact':
+        return float(_normalize(answer) == _normalize(expected))
+    if not isinstance(answer, list) or not expected:
+        return 0.0
+    if item['type'] == 'set':
+        answer_set = {_hashable(a) for a in answer}
+        return sum(_hashable(e) in answer_set for e in expected) / len(expected)
+    return sum(_normalize(a) == _normalize(e) for a, e in zip(answer, expected)) / len(expected)
+
+
+def evaluate_spec(spec, answer_key, submissions):
+    """
+    Scores several submissions of one task against the answer key in one batch.
+
+    Args:
+        spec (dict): The grading spec.
+        answer_key (dict): The answer key.
+        submissions (list): Parsed submissions (anything that is not a dict scores 0).
+
+    Returns:
+        list: One result per submission with `overall_score` (percentage of points), `points`,
+              `max_points`, `details` per answer field and `passed` if the spec has a passing score.
+    """
+    items = expand_spec(spec, answer_key)
+    submissions = [s if isinstance(s, dict) else {} for s in submissions]
+    n = len(submissions)
+    points = np.array([float(item['points']) for item in items])
+    shares = np.zeros((n, len(items)))
+
+    numeric = [j for j, item in enumerate(items) if item['type'] == 'numeric']
+    if numeric:
+        expected = np.array([_to_number(items[j]['expected']) for j in numeric], dtype=float)
+        answers = np.array([[_to_number(_lookup(s, items[j]['path'])[0]) for j in numeric] for s in submissions],
+                           dtype=float).reshape(n, len(numeric))
+        diff = np.abs(answers - expected)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = np.where(expected != 0, diff / np.abs(expected) * 100, np.where(diff == 0, 0.0, np.inf))
+        for k, j in enumerate(numeric):
+            item = items[j]
+            if 'tolerance_abs' in item:
+                share = (diff[:, k] <= float(item['tolerance_abs'])).astype(float)
+            else:
+                share = np.zeros(n)
+                for threshold, fraction in sorted(item.get('tiers') or DEFAULT_TIERS, reverse=True):
+                    share = np.where(pct[:, k] <= threshold, fraction, share)
+            # missing or non-numeric answers are NaN and earn nothing
+            shares[:, j] = np.where(np.isnan(answers[:, k]), 0.0, share)
+
+    for j, item in enumerate(items):
+        if item['type'] != 'numeric':
+            for i, submission in enumerate(submissions):
+                answer, found = _lookup(submission, item['path'])
+                shares[i, j] = _score_other(item, answer) if found else 0.0
+
+    earned = shares * points
+    total = points.sum()
+    results = []
+    for i in range(n):
+        score = round(float(earned[i].sum() / total * 100), 2) if total else 0.0
+        result = {
+            'overall_score': score,
+            'points': round(float(earned[i].sum()), 4),
+            'max_points': float(total),
+            'details': {'.'.join(item['path']): {'points': round(float(earned[i, j]), 4),
+                                                 'max_points': float(points[j])}
+                        for j, item in enumerate(items)},
+        }
+        if 'passing_score' in spec:
+            result['passed'] = score >= spec['passing_score']
+        results.append(result)
+    return results
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def grade_spec_jobs(jobs):
+    """
+    Grades jobs (see grading_runner.make_job) of tasks that have a grading spec, one batch per task.
+
+    Returns:
+        list: One outcome per job, in job order, in the format of grading_runner.run_job.
+    """
+    outcomes = [None] * len(jobs)
+    by_task = {}
+    for i, job in enumerate(jobs):
+        by_task.setdefault(os.path.dirname(os.path.normpath(job['output_dir'])), []).append(i)
+    for task_dir, positions in by_task.items():
+        base = [{'task_id': jobs[i]['task_id'], 'candidate': jobs[i]['candidate'],
+                 'results': None, 'overall_score': None, 'error': None} for i in positions]
+        try:
+            spec = load_spec(task_dir)
+            answer_key = _read_json(jobs[positions[0]]['answer_key'])
+            submissions = []
+            for outcome, i in zip(base, positions):
+                try:
+                    submissions.append(_read_json(jobs[i]['submission']))
+                except (FileNotFoundError, ValueError) as e:
+                    outcome['error'] = f"Error: could not read submission: {e}"
+                    submissions.append(None)
+            results = evaluate_spec(spec, answer_key, submissions)
+        except Exception as e:
+            for outcome in base:
+                outcome['error'] = f"Error: grading spec failed: {e}"
+            results = [None] * len(positions)
+        for outcome, result, i in zip(base, results, positions):
+            if result is not None and outcome['error'] is None:
+                outcome['results'] = result
+                outcome['overall_score'] = result['overall_score']
+            outcomes[i] = outcome
+    return outcomes
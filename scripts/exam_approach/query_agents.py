@@ -4,7 +4,16 @@ import anthropic
 import google.generativeai as genai
 import os
 import requests
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from google import genai as ggenai
+from response_cache import get_cache, make_cache_key, usage_to_dict
+from rate_limiter import call_with_retries, estimate_tokens, RetriesExhausted
 
 
 dotenv_path = find_dotenv()
@@ -15,6 +24,153 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+# Maximum number of requests in flight per provider when using aquery_many / query_many
+PROVIDER_CONCURRENCY = {
+    'openai': 16,
+    'anthropic': 8,
+    'google': 8,
+    'deepseek': 8,
+}
+
+# Long-lived provider clients, created once per process and shared across threads and async tasks
+_clients = {}
+_gemini_models = {}
+_clients_lock = threading.Lock()
+
+# Per-provider counters used to check that HTTP connections are actually being reused
+_client_stats = {}
+_stats_lock = threading.Lock()
+# providers whose requests go through a traced httpx client (the genai module uses its own transport)
+_traced_providers = set()
+
+
+def _stats(provider):
+    return _client_stats.setdefault(provider, {
+        'clients_created': 0,
+        'requests': 0,
+        'new_connections': 0,
+        'tls_handshakes': 0,
+        'total_latency': 0.0,
+    })
+
+
+def _connection_tracer(provider):
+    """
+    Returns an httpcore trace callback that counts newly opened connections and TLS handshakes.
+    """
+    def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            with _stats_lock:
+                _stats(provider)['new_connections'] += 1
+        elif event_name == 'connection.start_tls.complete':
+            with _stats_lock:
+                _stats(provider)['tls_handshakes'] += 1
+    return trace
+
+
+def _make_http_client(provider):
+    """
+    Builds a keep-alive httpx client whose pool is sized to the provider's concurrency limit.
+    """
+    tracer = _connection_tracer(provider)
+    _traced_providers.add(provider)
+
+    def attach_tracer(request):
+        request.extensions['trace'] = tracer
+
+    limit = PROVIDER_CONCURRENCY.get(provider, 8)
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=2 * limit, max_keepalive_connections=limit, keepalive_expiry=60),
+        timeout=httpx.Timeout(600, connect=10),
+        event_hooks={'request': [attach_tracer]},
+    )
+
+
+def get_client(provider):
+    """
+    Returns the shared client for a provider, creating it on first use.
+
+    Retries are disabled in the SDKs because call_with_retries handles them under the shared rate limits.
+    OPENAI_BASE_URL, ANTHROPIC_BASE_URL and DEEPSEEK_BASE_URL point the clients at another server (e.g. a local fake).
+
+    Args:
+        provider (str): One of 'openai', 'deepseek', 'anthropic' or 'google'.
+
+    Returns:
+        The provider client (the configured `genai` module for 'google').
+    """
+    with _clients_lock:
+        if provider not in _clients:
+            if provider == 'openai':
+                client = OpenAI(api_key=OPENAI_API_KEY, http_client=_make_http_client(provider), max_retries=0)
+            elif provider == 'deepseek':
+                client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL,
+                                http_client=_make_http_client(provider), max_retries=0)
+            elif provider == 'anthropic':
+                client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, http_client=_make_http_client(provider), max_retries=0)
+            elif provider == 'google':
+                genai.configure(api_key=GOOGLE_API_KEY)
+                client = genai
+            else:
+                raise ValueError(f"Unknown provider: {provider}")
+            _clients[provider] = client
+            with _stats_lock:
+                _stats(provider)['clients_created'] += 1
+        return _clients[provider]
+
+
+def get_gemini_model(model):
+    """
+    Returns a cached GenerativeModel for the given Gemini model name.
+    """
+    client = get_client('google')
+    with _clients_lock:
+        if model not in _gemini_models:
+            _gemini_models[model] = client.GenerativeModel(model)
+        return _gemini_models[model]
+
+
+@contextmanager
+def track_request(provider):
+    """
+    Context manager recording one request and its wall-clock latency in the client stats.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _stats_lock:
+            stats = _stats(provider)
+            stats['requests'] += 1
+            stats['total_latency'] += time.perf_counter() - start
+
+
+def client_stats():
+    """
+    Summarises client and connection reuse per provider.
+
+    Returns:
+        dict: For each provider the raw counters plus `mean_latency` (seconds per request) and
+              `connection_reuse` (share of requests that did not need a new TCP connection). Connection
+              counters and reuse are None for providers whose transport is not traced (google).
+    """
+    with _stats_lock:
+        summary = {}
+        for provider, stats in _client_stats.items():
+            stats = dict(stats)
+            requests_made = stats['requests']
+            stats['mean_latency'] = stats['total_latency'] / requests_made if requests_made else None
+            if provider not in _traced_providers:
+                stats['new_connections'] = stats['tls_handshakes'] = None
+                stats['connection_reuse'] = None
+            elif requests_made:
+                stats['connection_reuse'] = 1 - stats['new_connections'] / requests_made
+            else:
+                stats['connection_reuse'] = None
+            summary[provider] = stats
+        return summary
 
 def take_test(row, system_prompt_template, exam, model):
 
@@ -33,47 +189,271 @@ def take_test(row, system_prompt_template, exam, model):
             return ''
 
 
+def take_tests(df, system_prompt_template, model, exam_column='exam', concurrency=None):
+    """
+    Concurrent version of take_test for a whole DataFrame of exams.
+
+    Args:
+        df (pd.DataFrame): Exams with an `occupation` column and the exam text in `exam_column`.
+        system_prompt_template (str): Template for the system prompt, formatted with the occupation.
+        model (str): The candidate model taking the exams.
+        exam_column (str): Column holding the exam text.
+        concurrency (dict, optional): Per-provider limits overriding PROVIDER_CONCURRENCY.
+
+    Returns:
+        list: The answer text for every row (in row order), '' where the query failed and None where the
+              provider kept failing transiently (RetriesExhausted), so those exams can be asked again later.
+    """
+    queries = [
+        (system_prompt_template.format(occupation=row['occupation']), row[exam_column], model)
+        for _, row in df.iterrows()
+    ]
+    responses = query_many(queries, concurrency=concurrency, return_exceptions=True)
+    answers = []
+    for response in responses:
+        if isinstance(response, RetriesExhausted):
+            answers.append(None)
+        elif isinstance(response, BaseException):
+            raise response
+        else:
+            answers.append(response[0] if response else '')
+    return answers
+
+
+def get_provider(model):
+    """
+    Maps a model name to the provider that serves it, using the same substring rules as query_agent.
+    """
+    if 'gemini' in model:
+        return 'google'
+    if 'o3' in model or 'gpt' in model:
+        return 'openai'
+    if 'deepseek' in model:
+        return 'deepseek'
+    if 'claude' in model:
+        return 'anthropic'
+    return None
+
+
+def prompt_part(text, cache=False):
+    """
+    One part of a structured prompt.
+
+    Args:
+        text (str): Text of the part.
+        cache (bool): Marks the end of a stable prefix that the provider should cache.
+
+    Returns:
+        dict: The prompt part.
+    """
+    return {'text': text, 'cache': cache}
+
+
+def prompt_text(prompt):
+    """
+    Flattens a prompt given as a string or a list of prompt parts into a single string.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    return ''.join(part['text'] for part in prompt)
 
-def query_agent(system_prompt, user_prompt, model):
 
+def anthropic_blocks(prompt):
+    """
+    Converts a prompt into Anthropic content blocks, adding cache_control to the parts marked as cacheable.
+    """
+    if isinstance(prompt, str):
+        return prompt
+    blocks = []
+    for part in prompt:
+        block = {'type': 'text', 'text': part['text']}
+        if part.get('cache'):
+            block['cache_control'] = {'type': 'ephemeral'}
+        blocks.append(block)
+    return blocks
+
+
+def cache_hit_tokens(usage):
+    """
+    Number of prompt tokens served from the provider's prompt cache, given a usage dict of any provider.
+    """
+    if usage.get('cache_read_input_tokens') is not None:
+        # anthropic
+        return usage['cache_read_input_tokens']
+    if usage.get('prompt_cache_hit_tokens') is not None:
+        # deepseek
+        return usage['prompt_cache_hit_tokens']
+    if (usage.get('prompt_tokens_details') or {}).get('cached_tokens') is not None:
+        # openai
+        return usage['prompt_tokens_details']['cached_tokens']
+    if usage.get('cached_content_token_count') is not None:
+        # gemini
+        return usage['cached_content_token_count']
+    return 0
+
+
+def default_temperature(model):
+    """
+    Temperature used by the query_* function serving `model` when none is given.
+    """
+    return 1 if 'o3' in model else 0
+
+
+def query_agent(system_prompt, user_prompt, model, temperature=None, use_cache=True):
+        """
+        Queries the provider serving `model`, going through the response cache first (if enabled, see
+        response_cache.get_cache). Only deterministic calls (temperature 0) are cached: a sampled response
+        is not a reproducible answer to its prompt, and retries of the same prompt must get a new one.
+
+        Prompts can be plain strings or lists of prompt_part dicts. Parts marked with cache=True end a
+        stable prefix: Claude gets a cache_control breakpoint there, the other providers receive the
+        flattened text and cache identical prefixes automatically.
+
+        Args:
+            system_prompt (str or list): The system prompt.
+            user_prompt (str or list): The user prompt.
+            model (str): The model to query.
+            temperature (float, optional): Sampling temperature, defaults to the provider function's default.
+            use_cache (bool): Set to False to bypass the response cache for this call, e.g. when retrying
+                a prompt whose earlier response was rejected.
+
+        Returns:
+            list: [text, usage] where usage is a plain dict including `cache_hit_tokens`, or None if the query failed.
+
+        Raises:
+            RetriesExhausted: If the provider kept rate limiting or failing transiently through all retries.
+        """
+        structured_system, structured_user = system_prompt, user_prompt
+        system_prompt, user_prompt = prompt_text(system_prompt), prompt_text(user_prompt)
+        if temperature is None:
+            temperature = default_temperature(model)
+        provider = get_provider(model)
+
+        cache = get_cache() if use_cache and temperature == 0 else None
+        if cache is not None:
+            key = make_cache_key(provider, model, system_prompt, user_prompt, temperature)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            if cache.mode == 'replay':
+                print("Cache miss in replay mode, not querying: ", model)
+                return None
+
+        response = None
         if 'gemini' in model:
             #client = ggenai.Client()
             #if model in client.models.list():
-            response = query_gemini(system_prompt, user_prompt, model)
+            response = query_gemini(system_prompt, user_prompt, model, temperature=temperature)
             #else:
              #   response =query_gemini(system_prompt, user_prompt)
         if 'o3' in model:
-            response = query_o3(system_prompt, user_prompt, model)
+            response = query_o3(system_prompt, user_prompt, model, temperature=temperature)
         if 'gpt' in model:
             # Retrieve the list of available models
             #client = OpenAI()
             # Extract model IDs
             #model_ids =client.models.list()
             #if model in model_ids:
-            response = query_chatgpt(system_prompt, user_prompt, model)
+            response = query_chatgpt(system_prompt, user_prompt, model, temperature=temperature)
             #else:
              #   response =query_chatgpt(system_prompt, user_prompt)
         if 'deepseek' in model:
             #client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
             #model_ids = client.models.list()
             #if model in model_ids:
-            response = query_deepseek(system_prompt, user_prompt, model)
+            response = query_deepseek(system_prompt, user_prompt, model, temperature=temperature)
             #else:
              #   response =query_deepseek(system_prompt, user_prompt)
         if 'claude' in model:
             #client = anthropic.Anthropic()
             #model_ids = client.models.list(limit=20)
             #if model in model_ids:
-            response = query_claude(system_prompt, user_prompt, model)
+            response = query_claude(structured_system, structured_user, model, temperature=temperature)
             #else:
              #   response =query_claude(system_prompt, user_prompt)
-        try:
-            return response
-        except Exception as e:
+        if provider is None:
             print("Model not currently available")
             return None
+        if response is None:
+            return None
+        usage = usage_to_dict(response[1])
+        usage['cache_hit_tokens'] = cache_hit_tokens(usage)
+        response = [response[0], usage]
+        if cache is not None:
+            cache.put(key, response[0], response[1], provider=provider, model=model)
+        return response
+
+
+async def aquery_agent(system_prompt, user_prompt, model, temperature=None, use_cache=True, semaphore=None,
+                       executor=None):
+    """
+    Async version of query_agent.
+
+    The provider SDK calls are blocking, so the query runs in a worker thread while the event loop
+    keeps dispatching other requests.
+
+    Args:
+        system_prompt (str): The system prompt.
+        user_prompt (str): The user prompt.
+        model (str): The model to query.
+        temperature (float, optional): Sampling temperature, see query_agent.
+        use_cache (bool): Set to False to bypass the response cache for this call, see query_agent.
+        semaphore (asyncio.Semaphore, optional): Limits the number of concurrent calls to the provider.
+        executor (concurrent.futures.Executor, optional): Thread pool to run the call in. Defaults to the loop's default executor.
+
+    Returns:
+        list: [text, usage] as returned by query_agent, or None if the query failed.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(query_agent, system_prompt, user_prompt, model, temperature, use_cache)
+    if semaphore is None:
+        return await loop.run_in_executor(executor, call)
+    async with semaphore:
+        return await loop.run_in_executor(executor, call)
+
+
+async def aquery_many(queries, concurrency=None, return_exceptions=False):
+    """
+    Sends many (system_prompt, user_prompt, model) requests concurrently.
+
+    Args:
+        queries (list): List of (system_prompt, user_prompt, model) tuples, optionally followed by the
+                        temperature and use_cache of the request (see query_agent).
+        concurrency (dict, optional): Maximum in-flight requests per provider, overriding PROVIDER_CONCURRENCY.
+        return_exceptions (bool): Return the exception of a request that raised (e.g. RetriesExhausted) in
+                                  its place instead of raising it once all requests are done.
+
+    Returns:
+        list: One query_agent response per request, in the same order as `queries`.
+    """
+    limits = dict(PROVIDER_CONCURRENCY)
+    limits.update(concurrency or {})
+    semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in limits.items()}
+    # the default executor caps the number of threads well below what the providers allow
+    with ThreadPoolExecutor(max_workers=max(1, sum(limits.values()))) as executor:
+        tasks = [
+            aquery_agent(system_prompt, user_prompt, model, *options,
+                         semaphore=semaphores.get(get_provider(model)), executor=executor)
+            for system_prompt, user_prompt, model, *options in queries
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+
+
+def query_many(queries, concurrency=None, return_exceptions=False):
+    """
+    Blocking wrapper around aquery_many for use in scripts and DataFrame loops.
+
+    Returns:
+        list: One query_agent response per request, in input order.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(aquery_many(queries, concurrency, return_exceptions))
+    # already inside an event loop (e.g. a notebook), so run on a separate thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, aquery_many(queries, concurrency, return_exceptions)).result()
 
-        
 
 
 def query_gemini(system_prompt, user_prompt, model='gemini-2.0-flash-thinking-exp', temperature=0):
@@ -93,16 +473,20 @@ def query_gemini(system_prompt, user_prompt, model='gemini-2.0-flash-thinking-ex
     print("Quering Gemini: ", model)
 
     try:
-        genai.configure(api_key=GOOGLE_API_KEY) # Ensure GOOGLE_API_KEY is defined
-        model_gen = genai.GenerativeModel(model)
-        
-        response = model_gen.generate_content(
-            contents=[system_prompt, user_prompt],
-            generation_config=genai.GenerationConfig(temperature=temperature)
-        )
+        model_gen = get_gemini_model(model)
+
+        def create():
+            with track_request('google'):
+                return model_gen.generate_content(
+                    contents=[system_prompt, user_prompt],
+                    generation_config=genai.GenerationConfig(temperature=temperature)
+                )
+        response = call_with_retries('google', create, estimate_tokens(system_prompt, user_prompt))
 
         return [response.text, response.usage_metadata]
 
+    except RetriesExhausted:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
@@ -110,20 +494,23 @@ def query_gemini(system_prompt, user_prompt, model='gemini-2.0-flash-thinking-ex
 def query_deepseek(system_prompt, user_prompt, model="deepseek-chat", temperature=0):
     print("Quering DeepSeek: ", model)
     try:
-        client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-
-
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=temperature
-        )
+        client = get_client('deepseek')
+
+        def create():
+            with track_request('deepseek'):
+                return client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    temperature=temperature
+                )
+        response = call_with_retries('deepseek', create, estimate_tokens(system_prompt, user_prompt))
 
         return [response.choices[0].message.content, response.usage]
+    except RetriesExhausted:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
@@ -135,23 +522,26 @@ def query_chatgpt(system_prompt, user_prompt, model="gpt-4o", temperature=0):
 
     try:
 
-        client = OpenAI(
-            api_key=OPENAI_API_KEY
-        )
-
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "developer", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": user_prompt
-                }
-            ],
-            model=model,
-            temperature=temperature
-
-        )
+        client = get_client('openai')
+
+        def create():
+            with track_request('openai'):
+                return client.chat.completions.create(
+                    messages=[
+                        {"role": "developer", "content": system_prompt},
+                        {
+                            "role": "user",
+                            "content": user_prompt
+                        }
+                    ],
+                    model=model,
+                    temperature=temperature
+
+                )
+        response = call_with_retries('openai', create, estimate_tokens(system_prompt, user_prompt))
         return [response.choices[0].message.content, response.usage]
+    except RetriesExhausted:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
@@ -161,51 +551,61 @@ def query_o3(system_prompt, user_prompt, model="o3-2025-04-16", temperature=1):
 
     try:
 
-        client = OpenAI(
-            api_key=OPENAI_API_KEY
-        )
-
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "developer", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": user_prompt
-                }
-            ],
-            model=model,
-            temperature=temperature
-
-        )
+        client = get_client('openai')
+
+        def create():
+            with track_request('openai'):
+                return client.chat.completions.create(
+                    messages=[
+                        {"role": "developer", "content": system_prompt},
+                        {
+                            "role": "user",
+                            "content": user_prompt
+                        }
+                    ],
+                    model=model,
+                    temperature=temperature
+
+                )
+        response = call_with_retries('openai', create, estimate_tokens(system_prompt, user_prompt))
         return [response.choices[0].message.content, response.usage]
+    except RetriesExhausted:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
 
+def claude_max_tokens(model):
+    """
+    Maximum completion length requested from a Claude model.
+    """
+    if model== 'claude-3-sonnet-20240229':
+        return 4096
+    return 8192
+
 def query_claude(system_prompt, user_prompt, model="claude-3-7-sonnet-20250219", temperature=0):
     print("Querying Claude: ", model)
-    if model== 'claude-3-sonnet-20240229':
-        max_tokens = 4096
-    else:
-        max_tokens = 8192
+    max_tokens = claude_max_tokens(model)
     try:
-        client = anthropic.Anthropic(
-        # defaults to os.environ.get("ANTHROPIC_API_KEY")
-        api_key=ANTHROPIC_API_KEY
-        )
-
-        response = client.messages.create(
-            model=model,
-            system = system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
+        client = get_client('anthropic')
+
+        def create():
+            with track_request('anthropic'):
+                return client.messages.create(
+                    model=model,
+                    system = anthropic_blocks(system_prompt),
+                    messages=[
+                        {"role": "user", "content": anthropic_blocks(user_prompt)}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+        response = call_with_retries('anthropic', create, estimate_tokens(prompt_text(system_prompt), prompt_text(user_prompt)))
         print(response.content[0].text)
         return [response.content[0].text, response.usage]
 
+    except RetriesExhausted:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
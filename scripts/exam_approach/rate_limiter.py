@@ -0,0 +1,252 @@
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+# Default quotas per provider (requests per minute, tokens per minute).
+# Override with e.g. ANTHROPIC_RPM=1000 / ANTHROPIC_TPM=80000 in the environment or .env file.
+PROVIDER_LIMITS = {
+    'openai': {'rpm': 500, 'tpm': 200000},
+    'anthropic': {'rpm': 50, 'tpm': 40000},
+    'google': {'rpm': 150, 'tpm': 1000000},
+    'deepseek': {'rpm': 300, 'tpm': 500000},
+}
+
+# Tokens assumed for the completion when reserving tokens/min capacity before a request
+EXPECTED_OUTPUT_TOKENS = 1000
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class RetriesExhausted(Exception):
+    """
+    A rate limit or transient error that persisted through all retries.
+
+    Raised instead of the provider error so callers can tell "try again later" from a failed request;
+    the query_* functions pass it on instead of returning None, so no answer is silently dropped.
+    """
+
+    def __init__(self, provider, attempts, error):
+        super().__init__(f"{provider} request failed after {attempts} attempts: {error}")
+        self.provider = provider
+        self.attempts = attempts
+        self.error = error
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate` tokens per second up to `capacity`.
+
+    The level may go negative when actual usage exceeds what was reserved, which delays later callers.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """
+        Blocks until `amount` tokens are available and takes them from the bucket.
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """
+        Adds (positive) or removes (negative) tokens, e.g. to settle the difference between reserved and actual usage.
+        """
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """
+    Requests/min and tokens/min buckets for one provider with adaptive (AIMD) request rate.
+
+    A rate-limit error cuts the request rate and pauses all callers until the backoff has passed;
+    every successful request restores a small part of the configured rate.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(capacity=max(1, rpm / 60), rate=rpm / 60)
+        self.tokens = TokenBucket(capacity=tpm, rate=tpm / 60)
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+    def on_rate_limited(self, delay):
+        with self._lock:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.requests.rate = max(self.rpm / 60 * 0.1, self.requests.rate * 0.7)
+
+    def on_success(self, reserved_tokens, used_tokens):
+        with self._lock:
+            self.requests.rate = min(self.rpm / 60, self.requests.rate + self.rpm / 60 * 0.01)
+        if used_tokens:
+            self.tokens.adjust(reserved_tokens - used_tokens)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider):
+    """
+    Returns the shared limiter for a provider, configured from PROVIDER_LIMITS and the environment.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            limits = PROVIDER_LIMITS.get(provider, {'rpm': 60, 'tpm': 100000})
+            rpm = float(os.getenv(f'{provider.upper()}_RPM', limits['rpm']))
+            tpm = float(os.getenv(f'{provider.upper()}_TPM', limits['tpm']))
+            _limiters[provider] = ProviderLimiter(rpm, tpm)
+        return _limiters[provider]
+
+
+def estimate_tokens(*texts):
+    """
+    Rough token estimate (4 characters per token) of the prompts plus the expected completion.
+    """
+    return sum(len(text) for text in texts if text) // 4 + EXPECTED_OUTPUT_TOKENS
+
+
+def usage_total_tokens(usage):
+    """
+    Total tokens of a provider usage object or dict, or None if it cannot be determined.
+    """
+    if usage is None:
+        return None
+    get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+    for name in ('total_tokens', 'total_token_count'):
+        if get(name):
+            return get(name)
+    if get('input_tokens') is not None:
+        return (get('input_tokens') or 0) + (get('output_tokens') or 0)
+    return None
+
+
+def error_status(exc):
+    """
+    HTTP status code carried by an SDK exception, if any.
+    """
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is None and isinstance(getattr(exc, 'code', None), int):
+        # google.api_core exceptions
+        status = exc.code
+    return status
+
+
+def is_retryable(exc):
+    """
+    True for rate limits, transient server errors and connection problems.
+    """
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    name = type(exc).__name__
+    return 'Connection' in name or 'Timeout' in name or name in ('ResourceExhausted', 'ServiceUnavailable')
+
+
+def retry_after(exc):
+    """
+    Seconds to wait according to the Retry-After (or retry-after-ms) header of the error response.
+    """
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP date format
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def call_with_retries(provider, fn, estimated_tokens=EXPECTED_OUTPUT_TOKENS, max_retries=None, base_delay=None, max_delay=90.0):
+    """
+    Calls `fn` under the provider's rate limits, retrying transient failures.
+
+    Args:
+        provider (str): Provider whose limiter is used.
+        fn (callable): Function without arguments performing the request.
+        estimated_tokens (int): Tokens reserved in the tokens/min bucket before the request.
+        max_retries (int, optional): Retries after the first attempt before giving up, default 8.
+        base_delay (float, optional): Initial backoff in seconds, doubled with every retry, default 1.
+        max_delay (float): Upper bound of a single backoff.
+
+    Returns:
+        The return value of `fn`.
+
+    Raises:
+        RetriesExhausted: If a retryable error persists after `max_retries` retries.
+
+    Notes:
+        - 429/5xx/connection errors are retried with full-jitter exponential backoff,
+          or after the Retry-After period if the provider sends one.
+        - All other errors are raised immediately.
+        - The defaults can be changed per provider in the environment, e.g. OPENAI_RETRIES=2 and
+          OPENAI_RETRY_DELAY=0.1.
+    """
+    limiter = get_limiter(provider)
+    if max_retries is None:
+        max_retries = int(os.getenv(f'{provider.upper()}_RETRIES', 8))
+    if base_delay is None:
+        base_delay = float(os.getenv(f'{provider.upper()}_RETRY_DELAY', 1.0))
+    for attempt in range(max_retries + 1):
+        limiter.acquire(estimated_tokens)
+        try:
+            response = fn()
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            if attempt == max_retries:
+                raise RetriesExhausted(provider, attempt + 1, exc) from exc
+            delay = retry_after(exc)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            if error_status(exc) == 429 or type(exc).__name__ == 'ResourceExhausted':
+                limiter.on_rate_limited(delay)
+            limiter.retries += 1
+            print(f"Retrying {provider} request in {delay:.1f}s after error: {exc}")
+            time.sleep(delay)
+            continue
+        usage = getattr(response, 'usage', None) or getattr(response, 'usage_metadata', None)
+        limiter.on_success(estimated_tokens, usage_total_tokens(usage))
+        return response
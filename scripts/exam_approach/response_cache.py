@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Cache settings, overridable through environment variables (or a .env file)
+#   LLM_CACHE_PATH    location of the SQLite file
+#   LLM_CACHE_MODE    "off" (default), "readwrite" or "replay" (read only, misses are not sent to the API)
+# Only deterministic calls (temperature 0) are cached, see query_agents.query_agent
+#   LLM_CACHE_MAX_MB  size limit, least recently used entries are evicted beyond it
+DEFAULT_CACHE_PATH = '../../data/exam_approach/llm_cache.sqlite'
+DEFAULT_CACHE_MAX_MB = 2048
+CACHE_MODES = ('readwrite', 'replay', 'off')
+
+
+def make_cache_key(provider, model, system_prompt, user_prompt, temperature):
+    """
+    Builds the content address of an LLM call.
+
+    Args:
+        provider (str): Provider serving the model (e.g. 'anthropic').
+        model (str): Model name.
+        system_prompt (str): The system prompt.
+        user_prompt (str): The user prompt.
+        temperature (float): Sampling temperature of the call.
+
+    Returns:
+        str: SHA-256 hex digest identifying the call.
+    """
+    payload = json.dumps(
+        [provider, model, system_prompt, user_prompt, float(temperature)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def usage_to_dict(usage):
+    """
+    Converts the usage object of any provider SDK into a plain, JSON-serialisable dict.
+    """
+    if usage is None:
+        return {}
+    if isinstance(usage, dict):
+        return usage
+    if hasattr(usage, 'model_dump'):
+        # openai / anthropic pydantic models
+        return usage.model_dump()
+    try:
+        # google proto-plus messages
+        return type(usage).to_dict(usage)
+    except Exception:
+        return {'raw': str(usage)}
+
+
+class ResponseCache:
+    """
+    Content-addressed store of LLM responses in a local SQLite file.
+
+    Each entry holds the response text and usage metadata of one call. When the file grows
+    beyond `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, mode='readwrite'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            '''CREATE TABLE IF NOT EXISTS responses (
+                   key TEXT PRIMARY KEY,
+                   provider TEXT,
+                   model TEXT,
+                   text TEXT,
+                   usage TEXT,
+                   size INTEGER,
+                   created REAL,
+                   last_access REAL
+               )'''
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """
+        Looks up a cached response.
+
+        Returns:
+            list: [text, usage] as returned by query_agent, or None on a cache miss.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT text, usage FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.mode == 'readwrite':
+                self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+                self._conn.commit()
+        return [row[0], json.loads(row[1])]
+
+    def put(self, key, text, usage, provider=None, model=None):
+        """
+        Stores a response. Does nothing unless the cache is in readwrite mode.
+        """
+        if self.mode != 'readwrite' or text is None:
+            return
+        usage_json = json.dumps(usage_to_dict(usage), default=str)
+        size = len(text.encode('utf-8')) + len(usage_json)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, provider, model, text, usage_json, size, now, now),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # drop least recently used entries until the cache fits into max_bytes again
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 100'
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            for key, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current size of the cache.
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {
+            'mode': self.mode,
+            'entries': entries,
+            'bytes': self._total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the process-wide response cache configured from the environment, or None if caching is off
+    (the default, set LLM_CACHE_MODE to opt in).
+    """
+    global _cache
+    mode = os.getenv('LLM_CACHE_MODE', 'off')
+    if mode == 'off':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                path=os.getenv('LLM_CACHE_PATH', DEFAULT_CACHE_PATH),
+                max_bytes=int(float(os.getenv('LLM_CACHE_MAX_MB', DEFAULT_CACHE_MAX_MB)) * 1024 * 1024),
+                mode=mode,
+            )
+        return _cache
@@ -0,0 +1,176 @@
+import os
+import json
+import tempfile
+import pandas as pd
+
+INDEX_NAME = 'results_index.json'
+RESULTS_NAME = 'test_results.json'
+
+
+def task_key(task_id):
+    """
+    Folder name of a task inside a results folder (e.g. 15.2 -> '15_2').
+    """
+    return str(task_id).replace(".", "_")
+
+
+def read_overall_score(path):
+    """
+    Reads the 'overall_score' of a test_results.json file (a dict or a list of dicts).
+
+    Returns:
+        tuple: (overall_score or None, error message or None)
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, ValueError) as e:
+        return None, f"Error reading {path}: {e}"
+    if isinstance(data, list) and data:
+        data = data[0]
+    if not isinstance(data, dict):
+        return None, f"Unexpected format in {path}"
+    if 'overall_score' not in data:
+        return None, f"'overall_score' column missing in {path}"
+    return data['overall_score'], None
+
+
+class ResultsIndex:
+    """
+    Index of the test_results.json files below a results folder, keyed by (task folder, candidate).
+
+    Every entry stores the file's mtime, size and the extracted overall_score, so a refresh only
+    re-reads files that changed since the last one. The index is kept in `<folder>/results_index.json`.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, INDEX_NAME)
+        # task -> candidate -> {'mtime', 'size', 'overall_score', 'error'}; candidates without results map to None
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        fd, tmp = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def _update(self, task, candidate, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            changed = self.entries.get(task, {}).get(candidate) is not None
+            self.entries.setdefault(task, {})[candidate] = None
+            return changed
+        entry = self.entries.get(task, {}).get(candidate)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return False
+        score, error = read_overall_score(path)
+        if error:
+            print(error)
+        self.entries.setdefault(task, {})[candidate] = {
+            'mtime': st.st_mtime_ns, 'size': st.st_size, 'overall_score': score, 'error': error}
+        return True
+
+    def refresh(self, tasks=None, save=True):
+        """
+        Brings the index up to date with the results tree.
+
+        Args:
+            tasks (list, optional): Task folders (or task ids) to refresh, defaults to all task folders.
+            save (bool): Write the index file afterwards if anything changed.
+
+        Returns:
+            int: Number of entries that changed.
+        """
+        if tasks is None:
+            tasks = [e.name for e in os.scandir(self.folder) if e.is_dir() and not e.name.startswith('.')]
+            for task in set(self.entries) - set(tasks):
+                del self.entries[task]
+        else:
+            tasks = [task_key(t) for t in tasks]
+        changed = 0
+        for task in tasks:
+            task_dir = os.path.join(self.folder, task)
+            try:
+                candidates = [e.name for e in os.scandir(task_dir) if e.is_dir()]
+            except FileNotFoundError:
+                changed += self.entries.pop(task, None) is not None
+                continue
+            for candidate in set(self.entries.get(task, {})) - set(candidates):
+                del self.entries[task][candidate]
+                changed += 1
+            self.entries.setdefault(task, {})
+            for candidate in candidates:
+                changed += self._update(task, candidate, os.path.join(task_dir, candidate, RESULTS_NAME))
+        if changed and save:
+            self.save()
+        return changed
+
+    def record(self, task_id, candidate, save=False):
+        """
+        Updates a single entry, e.g. right after a submission has been graded.
+        """
+        task = task_key(task_id)
+        changed = self._update(task, candidate, os.path.join(self.folder, task, candidate, RESULTS_NAME))
+        if changed and save:
+            self.save()
+        return changed
+
+    def scores(self, task_id):
+        """
+        Candidate -> overall_score of one task, like the old per-row collect_overall_scores.
+        """
+        return {candidate: entry['overall_score']
+                for candidate, entry in self.entries.get(task_key(task_id), {}).items()
+                if entry is not None and entry['error'] is None}
+
+    def missing(self, tasks=None, candidates=None):
+        """
+        Lists the submissions that have no (readable) test_results.json.
+
+        Args:
+            tasks (list, optional): Restrict to these task folders or task ids.
+            candidates (list, optional): Candidates expected per task, defaults to the candidate folders present.
+
+        Returns:
+            list: (task folder, candidate) tuples.
+        """
+        tasks = sorted(self.entries) if tasks is None else [task_key(t) for t in tasks]
+        missing = []
+        for task in tasks:
+            entries = self.entries.get(task, {})
+            for candidate in (candidates or sorted(entries)):
+                entry = entries.get(candidate)
+                if entry is None or entry['error'] is not None:
+                    missing.append((task, candidate))
+        return missing
+
+    def tasks_without_results(self):
+        """
+        Task folders in which no candidate has a test_results.json (what follow_up.find_empty_folders looked for).
+        """
+        return [task for task, entries in sorted(self.entries.items())
+                if not any(entry is not None for entry in entries.values())]
+
+    def score_matrix(self, task_ids=None, candidates=None):
+        """
+        All overall scores as a task x candidate DataFrame.
+
+        Args:
+            task_ids (list, optional): Row order of the result (e.g. df['task_id']), defaults to all indexed tasks.
+            candidates (list, optional): Columns of the result, defaults to every indexed candidate.
+
+        Returns:
+            pd.DataFrame: One row per task (positional index when task_ids is given), NaN for missing scores.
+        """
+        tasks = sorted(self.entries) if task_ids is None else [task_key(t) for t in task_ids]
+        matrix = pd.DataFrame([self.scores(task) for task in tasks])
+        if candidates is not None:
+            matrix = matrix.reindex(columns=candidates)
+        if task_ids is None:
+            matrix.index = tasks
+        return matrix
@@ -0,0 +1,236 @@
+import os
+import sys
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Long/tidy results store: one row per (task, candidate, stage), partitioned by author model and occupation group.
+# Score-only queries project away the `text` column, so they never read prompts, exams or answers.
+DEFAULT_WAREHOUSE_PATH = '../../data/exam_approach/results_warehouse'
+PARTITION_COLS = ['author_model', 'occupation_group']
+
+SCHEMA = pa.schema([
+    ('task_id', pa.string()),
+    ('occupation', pa.string()),
+    ('task_description', pa.string()),
+    ('candidate_model', pa.string()),
+    ('stage', pa.string()),
+    ('text', pa.string()),
+    ('score', pa.float64()),
+    ('usage', pa.string()),
+    ('author_model', pa.string()),
+    ('occupation_group', pa.string()),
+])
+
+# text fields produced by the exam builder (one value per task)
+EXAM_TEXT_STAGES = ['exam', 'system_prompt', 'overview', 'instructions', 'materials_all', 'materials_candidate',
+                    'submission', 'evaluation', 'grading', 'answer_key', 'errors', 'explanation_overall_makes_sense']
+# numeric / boolean fields produced by the exam builder
+EXAM_SCORE_STAGES = ['key_grade', 'answer_key_count', 'failed_candidate_materials', 'check_real_materials',
+                     'check_no_internet', 'check_overall_makes_sense']
+# per candidate columns: column prefix -> (stage, holds text)
+CANDIDATE_COLUMNS = {
+    'test_answers_': ('answer', True),
+    'answer_valid_': ('answer_valid', False),
+    'errors_': ('grading_error', True),
+    'score_': ('score', False),
+}
+
+# CSV files of an occupation group, later files take precedence for duplicated values
+RESULT_FILES = ['exams_{occ}.csv', 'test_answers_{occ}.csv', 'scores_only_{occ}.csv', 'test_results_{occ}.csv']
+
+
+def _is_valid_exam(row):
+    # same rules as the analysis scripts use to drop invalid exams
+    exam = row.get('exam')
+    if not isinstance(exam, str) or exam in ('', 'Exam not valid'):
+        return False
+    if pd.notna(row.get('key_grade')) and row['key_grade'] > 100:
+        return False
+    if row.get('check_overall_makes_sense') is False or row.get('check_overall_makes_sense') == 'False':
+        return False
+    return True
+
+
+def _to_score(value):
+    if isinstance(value, str):
+        value = {'True': 1.0, 'False': 0.0}.get(value, value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def tidy_results(df):
+    """
+    Converts one wide results CSV (exams, test_answers, scores_only or test_results) into the long schema.
+
+    Args:
+        df (pd.DataFrame): Wide table with one row per task.
+
+    Returns:
+        pd.DataFrame: Rows of (task_id, occupation, task_description, candidate_model, stage, text, score, usage).
+                      Exam level stages have an empty candidate_model.
+    """
+    rows = []
+    candidate_columns = [(col, prefix) for col in df.columns for prefix in CANDIDATE_COLUMNS
+                         if col.startswith(prefix) and ' ' not in col]
+    for _, row in df.iterrows():
+        base = {
+            'task_id': str(row['task_id']),
+            'occupation': row.get('occupation'),
+            'task_description': row.get('task_description'),
+        }
+        metadata = row.get('metadata')
+        for stage in EXAM_TEXT_STAGES:
+            if stage in df.columns and pd.notna(row[stage]):
+                rows.append({**base, 'candidate_model': '', 'stage': stage, 'text': str(row[stage]), 'score': None,
+                             'usage': str(metadata) if stage == 'exam' and pd.notna(metadata) else None})
+        for stage in EXAM_SCORE_STAGES:
+            if stage in df.columns and pd.notna(row[stage]):
+                rows.append({**base, 'candidate_model': '', 'stage': stage, 'text': None,
+                             'score': _to_score(row[stage]), 'usage': None})
+        if 'exam' in df.columns:
+            rows.append({**base, 'candidate_model': '', 'stage': 'exam_valid', 'text': None,
+                         'score': float(_is_valid_exam(row)), 'usage': None})
+        for col, prefix in candidate_columns:
+            if pd.isna(row[col]):
+                continue
+            stage, is_text = CANDIDATE_COLUMNS[prefix]
+            rows.append({**base, 'candidate_model': col[len(prefix):], 'stage': stage,
+                         'text': str(row[col]) if is_text else None,
+                         'score': None if is_text else _to_score(row[col]), 'usage': None})
+    return pd.DataFrame(rows, columns=['task_id', 'occupation', 'task_description', 'candidate_model',
+                                       'stage', 'text', 'score', 'usage'])
+
+
+def ingest_occupation_group(model_folder_path, author_model, occupation_group, warehouse_path=DEFAULT_WAREHOUSE_PATH):
+    """
+    Loads all result CSVs of one author model and occupation group into the warehouse, replacing that partition.
+
+    Args:
+        model_folder_path (str): Folder holding the CSVs (e.g. data/exam_approach/test_results/<author model>/).
+        author_model (str): The exam author model.
+        occupation_group (str): Occupation group as used in the file names (e.g. management_occupations).
+        warehouse_path (str): Root of the Parquet dataset.
+
+    Returns:
+        int: Number of rows written.
+    """
+    parts = []
+    for template in RESULT_FILES:
+        path = os.path.join(model_folder_path, template.format(occ=occupation_group))
+        if os.path.isfile(path):
+            df = pd.read_csv(path)
+            df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+            parts.append(tidy_results(df))
+    if not parts:
+        print(f"No result files found for {occupation_group} in {model_folder_path}")
+        return 0
+
+    tidy = pd.concat(parts, ignore_index=True)
+    tidy = tidy.drop_duplicates(subset=['task_id', 'candidate_model', 'stage'], keep='last')
+    # task metadata missing from some files (e.g. scores_only has no exam text)
+    for col in ['occupation', 'task_description']:
+        lookup = tidy.dropna(subset=[col]).drop_duplicates('task_id').set_index('task_id')[col]
+        tidy[col] = tidy['task_id'].map(lookup)
+    tidy['author_model'] = author_model
+    tidy['occupation_group'] = occupation_group
+
+    table = pa.Table.from_pandas(tidy, schema=SCHEMA, preserve_index=False)
+    ds.write_dataset(
+        table, warehouse_path, format='parquet',
+        partitioning=ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLS]), flavor='hive'),
+        existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet',
+    )
+    print(f"Wrote {len(tidy)} rows for {author_model}/{occupation_group}")
+    return len(tidy)
+
+
+def ingest_model_folder(model_folder_path, author_model=None, warehouse_path=DEFAULT_WAREHOUSE_PATH):
+    """
+    Ingests every occupation group found in a results folder.
+    """
+    author_model = author_model or os.path.basename(os.path.normpath(model_folder_path))
+    groups = set()
+    for name in os.listdir(model_folder_path):
+        for template in RESULT_FILES:
+            prefix = template.split('{occ}')[0]
+            if name.startswith(prefix) and name.endswith('_occupations.csv'):
+                groups.add(name[len(prefix):-len('.csv')])
+    for group in sorted(groups):
+        ingest_occupation_group(model_folder_path, author_model, group, warehouse_path)
+    return sorted(groups)
+
+
+def load_results(warehouse_path=DEFAULT_WAREHOUSE_PATH, columns=None, stages=None, author_model=None,
+                 occupation_groups=None, candidate_models=None):
+    """
+    Reads rows of the warehouse, only touching the requested partitions and columns.
+
+    Args:
+        warehouse_path (str): Root of the Parquet dataset.
+        columns (list, optional): Columns to read; leave out `text` for score-only analyses.
+        stages (list, optional): Stages to keep (e.g. ['score']).
+        author_model (str, optional): Restrict to one author model partition.
+        occupation_groups (list, optional): Restrict to these occupation group partitions.
+        candidate_models (list, optional): Restrict to these candidates.
+
+    Returns:
+        pd.DataFrame: The matching rows.
+    """
+    dataset = ds.dataset(warehouse_path, format='parquet', partitioning='hive')
+    conditions = []
+    if author_model is not None:
+        conditions.append(ds.field('author_model') == author_model)
+    if occupation_groups is not None:
+        conditions.append(ds.field('occupation_group').isin(occupation_groups))
+    if stages is not None:
+        conditions.append(ds.field('stage').isin(stages))
+    if candidate_models is not None:
+        conditions.append(ds.field('candidate_model').isin(candidate_models))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def load_score_table(warehouse_path=DEFAULT_WAREHOUSE_PATH, author_model='claude-3-7-sonnet-20250219',
+                     occupation_groups=None, valid_only=True):
+    """
+    Wide score table in the layout of the scores_only CSVs, read without touching any text column.
+
+    Returns:
+        pd.DataFrame: One row per task with task_id, occupation, task_description, occupation_category and
+                      one `score_<candidate>` column per candidate.
+    """
+    columns = ['task_id', 'occupation', 'task_description', 'occupation_group', 'candidate_model', 'stage', 'score']
+    rows = load_results(warehouse_path, columns=columns, stages=['score', 'exam_valid'],
+                        author_model=author_model, occupation_groups=occupation_groups)
+    # partition columns come back as categoricals, which would make the pivot a cartesian product
+    rows['occupation_group'] = rows['occupation_group'].astype(str)
+    index = ['occupation_group', 'task_id']
+    score_rows = rows[rows['stage'] == 'score']
+    scores = score_rows.set_index(index + ['candidate_model'])['score'].unstack('candidate_model')
+    scores.columns = ['score_' + c for c in scores.columns]
+    tasks = rows.drop_duplicates(index).set_index(index)[['occupation', 'task_description']]
+    scores = tasks.join(scores, how='inner').reset_index()
+    if valid_only:
+        valid = rows[(rows['stage'] == 'exam_valid') & (rows['score'] == 1)].set_index(index).index
+        scores = scores[scores.set_index(index).index.isin(valid)]
+    numeric_ids = pd.to_numeric(scores['task_id'], errors='coerce')
+    if numeric_ids.notna().all():
+        scores['task_id'] = numeric_ids
+    scores = scores.rename(columns={'occupation_group': 'occupation_category'})
+    return scores[['task_id', 'occupation', 'task_description', 'occupation_category']
+                  + [c for c in scores.columns if c.startswith('score_')]].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        model_folder_path = sys.argv[1]
+    else:
+        model_folder_path = '../../data/exam_approach/test_results/claude-3-7-sonnet-20250219/'
+    print('Ingesting', model_folder_path)
+    print(ingest_model_folder(model_folder_path))
@@ -0,0 +1,121 @@
+import ast
+
+# modules a grading script has no business importing (network access, process control, LLM clients)
+FORBIDDEN_MODULES = {
+    'socket', 'ssl', 'requests', 'urllib', 'urllib3', 'http', 'httpx', 'aiohttp', 'ftplib', 'smtplib',
+    'telnetlib', 'paramiko', 'webbrowser', 'subprocess', 'multiprocessing', 'ctypes', 'openai', 'anthropic',
+}
+# calls that delete files, start processes, run generated code or block on user input
+FORBIDDEN_CALLS = {
+    'os.system', 'os.popen', 'os.remove', 'os.unlink', 'os.rmdir', 'os.removedirs', 'os.kill',
+    'shutil.rmtree', 'shutil.move', 'eval', 'exec', '__import__', 'input', 'breakpoint',
+}
+RESULTS_NAME = 'test_results.json'
+
+
+def _call_name(node):
+    # dotted name of the called function, e.g. 'os.system'
+    func = node.func
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if isinstance(func, ast.Name):
+        parts.append(func.id)
+        return '.'.join(reversed(parts))
+    return None
+
+
+def _string_constants(tree):
+    return {node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)}
+
+
+def _argv_problems(tree):
+    uses_argv = False
+    indexes = set()
+    positional = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and node.attr == 'argv' and isinstance(node.value, ast.Name) \
+                and node.value.id == 'sys':
+            uses_argv = True
+        elif isinstance(node, ast.ImportFrom) and node.module == 'sys' and any(a.name == 'argv' for a in node.names):
+            uses_argv = True
+        elif isinstance(node, ast.Subscript):
+            value = node.value
+            is_argv = (isinstance(value, ast.Attribute) and value.attr == 'argv') or \
+                      (isinstance(value, ast.Name) and value.id == 'argv')
+            if is_argv:
+                uses_argv = True
+                if isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, int):
+                    indexes.add(node.slice.value)
+                else:
+                    # slicing or computed indexes, cannot tell statically
+                    indexes.add(None)
+        elif isinstance(node, ast.Call) and _call_name(node) and _call_name(node).endswith('add_argument'):
+            if node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str) \
+                    and not node.args[0].value.startswith('-'):
+                positional += 1
+
+    if positional:
+        if positional < 2:
+            return ["The script must accept two command line arguments: the submission file and the answer key file."]
+        return []
+    if not uses_argv:
+        return ["The script does not read the submission and answer key file names from the command line "
+                "(sys.argv[1] and sys.argv[2])."]
+    if None not in indexes and indexes and not {1, 2} <= indexes:
+        return [f"The script reads sys.argv{sorted(indexes)} but must take the submission from sys.argv[1] "
+                f"and the answer key from sys.argv[2]."]
+    return []
+
+
+def preflight_script(source):
+    """
+    Static checks of a generated grading script before it is ever run.
+
+    Args:
+        source (str): Source of task_evaluation.py.
+
+    Returns:
+        list: Problems found, each as a sentence that can be fed back to the author model; empty if
+              the script may work.
+
+    Checks:
+        - The script parses.
+        - It takes the submission and answer key file names from the command line.
+        - It writes `test_results.json` and sets an `overall_score`.
+        - It does not import network / process modules, delete files, run eval/exec, wait for input
+          or open files by absolute path.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        return [f"The script is not valid Python: {e.msg} (line {e.lineno})."]
+
+    problems = _argv_problems(tree)
+    constants = _string_constants(tree)
+    if not any(RESULTS_NAME in c for c in constants):
+        problems.append(f"The script never writes its results to `{RESULTS_NAME}`.")
+    if 'overall_score' not in constants:
+        problems.append("The results do not contain an `overall_score` key.")
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules = [node.module]
+        else:
+            modules = []
+        for module in modules:
+            if module.split('.')[0] in FORBIDDEN_MODULES:
+                problems.append(f"Line {node.lineno}: importing `{module}` is not allowed, the script must work offline "
+                                f"on the two JSON files only.")
+        if isinstance(node, ast.Call):
+            name = _call_name(node)
+            if name in FORBIDDEN_CALLS:
+                problems.append(f"Line {node.lineno}: calling `{name}` is not allowed in a grading script.")
+            elif name == 'open' and node.args and isinstance(node.args[0], ast.Constant) \
+                    and isinstance(node.args[0].value, str) and node.args[0].value.startswith(('/', '~', '..')):
+                problems.append(f"Line {node.lineno}: the script opens `{node.args[0].value}`; it may only use the "
+                                f"files passed on the command line and `{RESULTS_NAME}`.")
+    return problems
@@ -10,18 +10,52 @@ import json
 import subprocess
 import shutil
 import ast
+import time
 # import google.generativeai as genai
 from query_agents import query_agent, take_test
+from grading_runner import (grade_jobs, grade_changed_jobs, make_job, run_isolated, run_job, read_script,
+                            write_results, failed_outcome, job_fingerprint, job_key, is_up_to_date,
+                            load_fingerprints, save_fingerprints, record_fingerprint,
+                            SCRIPT_NOT_FOUND, DEADLINE_GRACE)
+from artifact_store import share_files
+from results_index import ResultsIndex
+from answer_extraction import extract_answer
+from grading_spec import SPEC_NAME, grade_spec_jobs
 dotenv_path = find_dotenv()
 load_dotenv(dotenv_path)
 
 
 system_prompt_template = """You are an expert worker within the domain of {occupation}. Complete the following exam."""
 
+# Candidate models taking the exams: answer column suffix (test_answers_<name>) -> model
+CANDIDATE_MODELS = {
+    'gemini_flash_15': 'gemini-1.5-flash',
+    'gemini_flash': 'gemini-2.0-flash',
+    'gemini_25': 'gemini-2.5-pro-preview-03-25',
+    'claude_sonnet': 'claude-3-7-sonnet-20250219',
+    'claude_sonnet_35': 'claude-3-5-sonnet-20241022',
+    'claude_haiku': 'claude-3-5-haiku-20241022',
+    'sonnet30': 'claude-3-sonnet-20240229',
+    'chatgpt4o': 'gpt-4o',
+    'chatgpt35': 'gpt-3.5-turbo-0125',
+    'chatgpt_o3': 'o3-2025-04-16',
+    'deepseek': 'deepseek-chat',
+}
+
 
 def split_materials_candidate(row):
     row['materials']
 
+def write_submission(path, task_id, model, answer_file):
+    """
+    Writes a parsed answer as `<path>/<task_id>/<model>/test_submission.json`.
+    """
+    folder = os.path.join(path, str(task_id).replace(".", "_"), model)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "test_submission.json"), "w") as json_file:
+        json.dump(answer_file, json_file, ensure_ascii=False, indent=4)
+
+
 def save_answer_json(row, path, model):
     """
     Saves a test answer from a DataFrame row as a JSON file in a structured directory.
@@ -35,54 +69,17 @@ def save_answer_json(row, path, model):
         bool: True if the JSON file was successfully saved, False otherwise.
 
     Process:
-        1. Creates a folder structure based on the `task_id` from the row.
-        2. Extracts the test answer JSON from the column `test_answers_<model>`.
-           - If the answer is formatted within triple backticks (```json ... ```), it extracts the JSON content using regex.
-           - If the direct value is a valid JSON string, it loads it directly.
-           - If both attempts fail, it defaults to an empty JSON object (`{}`) and returns False.
-        3. Saves the parsed JSON file in a subdirectory named after the model.
+        1. Extracts the test answer JSON from the column `test_answers_<model>` with `extract_answer`, which
+           prefers fenced ```json blocks, then bare JSON objects, and repairs comments, trailing commas,
+           single quotes and thousands separators (see answer_extraction).
+        2. If nothing can be parsed, it defaults to an empty JSON object (`{}`) and returns False.
+        3. Saves the JSON file in a subdirectory of the task folder named after the model.
     """
-    folder = os.path.join(path, str(row['task_id']).replace(".", "_"))
-    try:
-        text = re.search(r'```json(.*?)```', row['test_answers_'+model], re.DOTALL).group(1).strip()
-        answer_file = json.loads(text)
-    
-    except:
-        try:
-            text = re.search(r'```json(.*?)```', row['test_answers_'+model], re.DOTALL).group(1).strip()
-
-            # Step 1: Remove comment lines manually or using regex
-            cleaned = "\n".join(line for line in text.splitlines() if not line.strip().startswith("//"))
-
-            # Step 2: Remove outer quotes if present
-            if cleaned.startswith("'") and cleaned.endswith("'"):
-                cleaned = cleaned[1:-1]
-            cleaned = re.sub(r'(?<=: )(-?\d{1,3}(?:,\d{3})+)', lambda m: m.group().replace(',', ''), cleaned)
-            cleaned = ast.literal_eval(f'''"""{cleaned}"""''')  # Converts escaped \n etc. to real chars
-
-            # Step 4: Parse to JSON
-            answer_file = json.loads(cleaned)
-        except:
-            try:
-                cleaned = "\n".join(line for line in row['test_answers_'+model].splitlines() if not line.strip().startswith("//"))
-                if cleaned.startswith("'") and cleaned.endswith("'"):
-                    cleaned = cleaned[1:-1]
-                cleaned = re.sub(r'(?<=: )(-?\d{1,3}(?:,\d{3})+)', lambda m: m.group().replace(',', ''), cleaned)
-                answer_file =  json.loads(cleaned)
-            except:
-                answer_file = '''{}'''
-                json_path = os.path.join(path, str(row['task_id']),'/')
-                os.makedirs(folder+'/'+model, exist_ok=True)
-
-                with open(folder+'/'+model+"/test_submission.json", "w") as json_file:
-                    json.dump(answer_file, json_file, ensure_ascii=False, indent=4)
-                return False
-    json_path = os.path.join(path, str(row['task_id']),'/')
-    os.makedirs(folder+'/'+model, exist_ok=True)
-
-    with open(folder+'/'+model+"/test_submission.json", "w") as json_file:
-        json.dump(answer_file, json_file, ensure_ascii=False, indent=4)
-
+    answer_file, repair = extract_answer(row.get('test_answers_'+model))
+    if answer_file is None:
+        write_submission(path, row['task_id'], model, '{}')
+        return False
+    write_submission(path, row['task_id'], model, answer_file)
     return True
 
 def save_evaluation(row, path):
@@ -249,12 +246,44 @@ def run_evaluation(row,path, model):
         return errors
 
 
-  
+def run_evaluations(df, path, candidates, workers=None, timeout=30, only_changed=False):
+    """
+    Grades the submissions of all candidates for every task in df with the in-process grading runner.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing `task_id`.
+        path (str): The base directory holding one folder per task.
+        candidates (list): Candidate subfolder names.
+        workers (int, optional): Number of grading processes, defaults to the number of cores.
+        timeout (float): Seconds a single grading run may take.
+        only_changed (bool): Only regrade submissions whose grading script, answer key or submission changed
+                             since they were last graded (see grading_runner.grade_changed_jobs).
+
+    Returns:
+        dict: candidate -> list with one entry per row in the format of run_evaluation ([None] or [error message]).
+
+    Notes:
+        - Equivalent to calling run_evaluation for every row and candidate, but each grading script is
+          compiled once and runs for all candidates in a pool of reusable worker processes.
+        - test_results.json is still written into each candidate folder.
+    """
+    folders = [os.path.join(path, str(task_id).replace('.', '_')) for task_id in df['task_id']]
+    jobs = [make_job(folder, candidate, script=os.path.join(folder, candidate, 'task_evaluation.py'),
+                     answer_key=os.path.join(folder, candidate, 'answer_key.json'))
+            for candidate in candidates for folder in folders]
+    if only_changed:
+        outcomes = grade_changed_jobs(jobs, path, workers=workers, timeout=timeout)
+    else:
+        outcomes = grade_jobs(jobs, workers=workers, timeout=timeout)
+    errors = {}
+    for n, candidate in enumerate(candidates):
+        errors[candidate] = [[outcome['error']] for outcome in outcomes[n * len(folders):(n + 1) * len(folders)]]
+    return errors
 
 
 def copy_answer_key(row,folder):
     """
-    Copies the answer key JSON file to all subdirectories within the task-specific folder.
+    Makes the answer key and grading script of a task available in all its candidate subdirectories.
 
     Args:
         row (pd.Series): A row from a DataFrame containing `task_id`, which is used to determine the folder structure.
@@ -262,27 +291,26 @@ def copy_answer_key(row,folder):
 
     Process:
         1. Constructs the path to the task-specific folder using `task_id`, replacing problematic characters.
-        2. Identifies the source file (`answer_key.json`) within this folder.
-        3. Iterates over all subdirectories within the task folder.
-        4. Copies `answer_key.json` into each subdirectory.
+        2. Stores `answer_key.json` and `task_evaluation.py` of this folder once in the content-addressed
+           store under `<folder>/.blobs/` (see artifact_store).
+        3. Hardlinks the stored files into every subdirectory and records them in the subdirectory's manifest.json.
 
     Returns:
         None
 
     Notes:
         - Uses `os.walk()` to retrieve subdirectory names at the first level.
-        - Assumes `answer_key.json` exists in the task-specific folder.
-        - Prints confirmation for each copied file.
+        - Identical files are stored only once across all tasks, and subdirectories that already link to the
+          current version are not touched, so rerunning only writes what changed.
+        - Falls back to symlinks or copies where hardlinks are not supported.
 
     Example:
         If `folder = "/data/tasks"` and `task_id = 123.4`, the function will:
-        - Look for `/data/tasks/123_4/answer_key.json`
-        - Copy it into all subdirectories inside `/data/tasks/123_4/`
+        - Look for `/data/tasks/123_4/answer_key.json` and `/data/tasks/123_4/task_evaluation.py`
+        - Link them into all subdirectories inside `/data/tasks/123_4/`
     """
 
     parent_directory = folder+'/'+str(row['task_id']).replace(".", "_")
-    source_file1 = parent_directory+'/answer_key.json'
-    source_file2 = parent_directory+'/task_evaluation.py'
 
     if not os.path.isdir(parent_directory):
         print(f"Directory does not exist: {parent_directory}")
@@ -294,24 +322,179 @@ def copy_answer_key(row,folder):
         print(f"No subdirectories found in: {parent_directory}")
         return
 
-    # Iterate over all subdirectories
-    for subdir in next(os.walk(parent_directory))[1]:  # Get only subfolder names
-        subdir_path = os.path.join(parent_directory, subdir)  # Full path to subfolder
-        destination1 = os.path.join(subdir_path, os.path.basename(source_file1))  # Destination path
-        destination2 = os.path.join(subdir_path, os.path.basename(source_file2))  # Destination path
+    subdir_paths = [os.path.join(parent_directory, subdir) for subdir in subdirs]
+    try:
+        # tasks graded by a grading spec have no task_evaluation.py
+        names = [name for name in ['answer_key.json', 'task_evaluation.py']
+                 if name == 'answer_key.json' or os.path.isfile(os.path.join(parent_directory, name))]
+        share_files(folder, parent_directory, names, subdir_paths)
+        print(f"Linked answer key and grading script into {len(subdir_paths)} folders of {parent_directory}")
+    except FileNotFoundError as e:
+        print(f"Source file not found: {e.filename}")
 
-        try:
-            shutil.copy(source_file1, destination1)
-            shutil.copy(source_file2, destination2)
 
-            print(f"Copied {source_file1} to {destination1}")
-            print(f"Copied {source_file2} to {destination2}")
+def write_candidate_submission(job, text):
+    """
+    Extracts the JSON of a candidate's answer and writes it as the job's submission.
+
+    Returns:
+        tuple: (answer_valid, repair applied by extract_answer)
+    """
+    answer_file, repair = extract_answer(text)
+    os.makedirs(job['output_dir'], exist_ok=True)
+    with open(job['submission'], "w") as json_file:
+        json.dump('{}' if answer_file is None else answer_file, json_file, ensure_ascii=False, indent=4)
+    return answer_file is not None, repair
+
 
-        except FileNotFoundError:
-            print(f"Source file not found: {source_file1}")
-            print(f"Source file not found: {source_file2}")
+def save_grading_spec(row, path):
+    """
+    Saves the declarative grading spec of a row (column `grading_spec`, see grading_spec) as grading_spec.json.
 
-            break
+    Returns:
+        bool: True if the task has a grading spec.
+    """
+    folder = os.path.join(path, str(row['task_id']).replace(".", "_"))
+    spec = row.get('grading_spec')
+    if isinstance(spec, str) and spec.strip():
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, SPEC_NAME), "w", encoding="utf-8") as f:
+            f.write(spec)
+    return os.path.isfile(os.path.join(folder, SPEC_NAME))
+
+
+def score_submission(job, text, source, digest, timeout, previous=None):
+    """
+    Worker side of the scoring pipeline: extracts, writes and grades one candidate's answer.
+
+    Args:
+        job (dict): Grading job created with make_job.
+        text (str): The candidate's answer (None for the empty submission).
+        source (str): Source of the task's grading script, None if it is missing.
+        digest (str): Hash of the grading script source.
+        timeout (float): Seconds the grading run may take.
+        previous (dict, optional): Fingerprint record of the last grading; the grading is skipped if the
+                                   inputs did not change since.
+
+    Returns:
+        dict: Grading outcome (see grading_runner.run_job) plus `answer_valid`, `repair`, `fingerprint`
+              and `skipped`.
+    """
+    answer_valid, repair = write_candidate_submission(job, text)
+    fingerprint = job_fingerprint(job)
+    skipped = is_up_to_date(job, fingerprint, previous)
+    if skipped:
+        outcome = failed_outcome(job, previous['error'])
+    elif source is None:
+        outcome = failed_outcome(job, SCRIPT_NOT_FOUND)
+    else:
+        outcome = run_job(job, source, digest, timeout)
+        write_results(outcome, job['output_dir'])
+    outcome['answer_valid'] = answer_valid
+    outcome['repair'] = repair
+    outcome['fingerprint'] = fingerprint
+    outcome['skipped'] = skipped
+    return outcome
+
+
+def run_scoring_pipeline(df, path, candidates=None, workers=None, timeout=30, progress_every=100, only_changed=False):
+    """
+    Extracts, writes, grades and collects the answers of all candidates for every task in df.
+
+    Args:
+        df (pd.DataFrame): Answers with `task_id`, `grading`, `answer_key` and `test_answers_<candidate>` columns.
+        path (str): The base directory holding one folder per task.
+        candidates (list, optional): Candidate names, defaults to CANDIDATE_MODELS. The empty submission is
+                                     always graded as well.
+        workers (int, optional): Number of worker processes, defaults to the number of cores.
+        timeout (float): Seconds a single grading run may take.
+        progress_every (int): Print progress after this many graded submissions.
+        only_changed (bool): Skip submissions whose grading script, answer key and submission are unchanged
+                             since they were last graded. Off by default, so every submission is regraded
+                             like before.
+
+    Returns:
+        dict: Column name -> list with one value per row of df: `evaluation_python`, `answer_key_json`,
+              `answer_valid_<candidate>` / `answer_empty` and `errors_<candidate>` / `errors_empty`
+              (in the format of run_evaluation).
+
+    Process:
+        1. Every (task, candidate) pair is one work item. The parent writes the task's grading script
+           and answer key and links them into the candidate folders, then hands the task's items to the pool.
+        2. Workers extract the answer JSON, write the submission and grade it, so grading of one task
+           overlaps with preparing the next. Tasks with a grading spec are scored right away in the parent,
+           all candidates in one batch, without running generated code.
+        3. Finished items update the results index of `path` as they come in. A grading script that crashes
+           or hangs its worker only fails its own item (see grading_runner.run_isolated).
+        4. With `only_changed`, the fingerprint of each item's inputs is compared with the one stored at its
+           last grading, so after fixing one grading script only that task's submissions are graded again.
+    """
+    candidates = list(candidates or CANDIDATE_MODELS) + ['empty_submission']
+    index = ResultsIndex(path)
+    fingerprints = load_fingerprints(path) if only_changed else {}
+    outcomes = {}
+    jobs_by_item = {}
+    columns = {'evaluation_python': [], 'answer_key_json': []}
+
+    def work_items():
+        # prepares the tasks one by one as the pool asks for more work
+        for pos, (_, row) in enumerate(df.iterrows()):
+            folder = os.path.join(path, str(row['task_id']).replace(".", "_"))
+            spec = save_grading_spec(row, path)
+            columns['evaluation_python'].append(spec or save_evaluation(row, path))
+            columns['answer_key_json'].append(save_answer_key(row, path))
+            for candidate in candidates:
+                os.makedirs(os.path.join(folder, candidate), exist_ok=True)
+            copy_answer_key(row, path)
+            jobs = [make_job(folder, candidate, script=os.path.join(folder, candidate, 'task_evaluation.py'),
+                             answer_key=os.path.join(folder, candidate, 'answer_key.json'))
+                    for candidate in candidates]
+            if spec:
+                valid = [write_candidate_submission(job, row.get('test_answers_' + job['candidate'])) for job in jobs]
+                for job, (answer_valid, repair), outcome in zip(jobs, valid, grade_spec_jobs(jobs)):
+                    write_results(outcome, job['output_dir'])
+                    outcomes[pos, job['candidate']] = dict(outcome, answer_valid=answer_valid, repair=repair)
+                    index.record(job['task_id'], job['candidate'])
+                    record_fingerprint(fingerprints, job, job_fingerprint(job), outcome)
+                continue
+            for job in jobs:
+                source, digest = read_script(job['script'])
+                jobs_by_item[pos, job['candidate']] = job
+                yield ((pos, job['candidate']), score_submission,
+                       (job, row.get('test_answers_' + job['candidate']), source, digest, timeout,
+                        fingerprints.get(job_key(job))))
+
+    start = time.time()
+    skipped = 0
+    n = 0
+    for n, (item, outcome, error) in enumerate(run_isolated(work_items(), workers, deadline=timeout + DEADLINE_GRACE),
+                                               start=1):
+        job = jobs_by_item.pop(item)
+        if error is not None:
+            outcome = dict(failed_outcome(job, error), answer_valid=False)
+        outcomes[item] = outcome
+        if outcome.get('skipped'):
+            skipped += 1
+        else:
+            index.record(job['task_id'], job['candidate'])
+            if 'fingerprint' in outcome:
+                record_fingerprint(fingerprints, job, outcome['fingerprint'], outcome)
+        if n % progress_every == 0:
+            elapsed = time.time() - start
+            print(f"scored {n} submissions in {elapsed:.0f}s ({n / elapsed:.1f}/s), {skipped} unchanged")
+    elapsed = time.time() - start
+    print(f"scored {n} submissions with grading scripts and {len(outcomes) - n} with grading specs "
+          f"in {elapsed:.0f}s, {skipped} unchanged")
+    index.save()
+    if only_changed:
+        save_fingerprints(path, fingerprints)
+
+    for candidate in candidates:
+        name = 'empty' if candidate == 'empty_submission' else candidate
+        valid_column = 'answer_empty' if candidate == 'empty_submission' else 'answer_valid_' + candidate
+        columns[valid_column] = [outcomes[pos, candidate]['answer_valid'] for pos in range(len(df))]
+        columns['errors_' + name] = [[outcomes[pos, candidate]['error']] for pos in range(len(df))]
+    return columns
 
 
 def collect_overall_scores(row,parent_directory):
@@ -434,49 +617,20 @@ if __name__ == "__main__":
     # # save answers as json files
     df = pd.read_csv(f'../../data/exam_approach/test_results/{model}/test_answers_{occ}.csv')
     print(df.columns)
-    df['answer_empty'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'empty_submission'))
-    print('saving answer files')
-    df['answer_valid_chatgpt4o'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'chatgpt4o'))
-    df['answer_valid_chatgpt35'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'chatgpt35'))
-    df['answer_valid_deepseek'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'deepseek'))
-    df['answer_valid_claude_sonnet'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'claude_sonnet'))
-    df['answer_valid_claude_haiku'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'claude_haiku'))
-    df['answer_valid_gemini_flash_15'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'gemini_flash_15'))
-    df['answer_valid_gemini_flash'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'gemini_flash'))
-    df['answer_valid_claude_sonnet_35'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'claude_sonnet_35'))
-    df['answer_valid_chatgpt_o3'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'chatgpt_o3'))
-    df['answer_valid_gemini_25'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'gemini_25'))
-    df['answer_valid_sonnet30'] = df.apply(save_answer_json, axis=1, args=(model_folder_path, 'sonnet30'))
-
-    print('saving evaluation files and answer keys')
-    # save evaluation script and answer key in appropriate folders
-    df['evaluation_python'] = df.apply(save_evaluation, axis=1, args=(model_folder_path,))
-    df['answer_key_json']=  df.apply(save_answer_key, axis=1, args=(model_folder_path,))
-    df.apply(copy_answer_key, axis=1, args=(model_folder_path,))
-
-
-# #     # # run evaluation and document potential errors
-    print('running evaluation')
-    df['errors_chatgpt35'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'chatgpt35',))
-    df['errors_chatgpt4o'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'chatgpt4o',))
-    df['errors_claude_sonnet'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'claude_sonnet',))
-    df['errors_claude_haiku'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'claude_haiku',))
-    df['errors_deepseek'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'deepseek',))
-    df['errors_gemini_flash_15'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'gemini_flash_15',))
-    df['errors_gemini_flash'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'gemini_flash',))
-    df['errors_gemini_25'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'gemini_25',))
-    df['errors_chatgpt_o3'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'chatgpt_o3',))
-    df['errors_claude_sonnet_35'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'claude_sonnet_35',))
-    df['errors_sonnet30'] = df.apply(run_evaluation, axis=1, args=(model_folder_path,'sonnet30',))
-
-    df['errors_empty'] =df.apply(run_evaluation, axis=1, args=(model_folder_path,'empty_submission',))
+    print('extracting, writing and grading answers')
+    # every (task, candidate) pair is graded as soon as its task folder is prepared
+    columns = run_scoring_pipeline(df, model_folder_path, CANDIDATE_MODELS)
+    for column, values in columns.items():
+        df[column] = values
 
     print('collecting scores')
-    df['scores'] =  df.apply(collect_overall_scores,axis=1, args= (model_folder_path,))
-    scores_df = pd.json_normalize(df['scores'])
+    # only test_results.json files that changed since the last run are read again
+    index = ResultsIndex(model_folder_path)
+    index.refresh(tasks=df['task_id'])
+    scores_df = index.score_matrix(task_ids=df['task_id'])
     scores_df.columns = 'score_'+scores_df.columns
     # Combine the original DataFrame with the new columns
-    df_expanded = pd.concat([df.drop('scores', axis=1), scores_df], axis=1)
+    df_expanded = pd.concat([df, scores_df], axis=1)
     
     df_expanded.to_csv(f'../../data/exam_approach/test_results/{model}/test_results_{occ}.csv', index=False)
 
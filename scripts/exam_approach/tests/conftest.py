@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import query_agents
+import rate_limiter
+from fake_provider import FakeProvider
+
+
+@pytest.fixture
+def fake_provider(monkeypatch):
+    """
+    A running FakeProvider with the OpenAI and Anthropic clients of query_agents pointed at it.
+    """
+    with FakeProvider() as fake:
+        monkeypatch.setenv('OPENAI_BASE_URL', fake.url + '/v1')
+        monkeypatch.setenv('ANTHROPIC_BASE_URL', fake.url)
+        monkeypatch.setattr(query_agents, 'OPENAI_API_KEY', 'test-key')
+        monkeypatch.setattr(query_agents, 'ANTHROPIC_API_KEY', 'test-key')
+        monkeypatch.delenv('LLM_CACHE_MODE', raising=False)
+        # fresh clients and limiters, so the base URLs and limits of this test apply
+        monkeypatch.setattr(query_agents, '_clients', {})
+        monkeypatch.setattr(rate_limiter, '_limiters', {})
+        yield fake
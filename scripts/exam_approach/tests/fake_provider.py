@@ -0,0 +1,261 @@
+import json
+import time
+import email
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeProvider:
+    """
+    Local HTTP server speaking enough of the OpenAI and Anthropic APIs to test the clients in query_agents.
+
+    Point the SDKs at it with OPENAI_BASE_URL=<url>/v1 and ANTHROPIC_BASE_URL=<url>.
+
+    Batch jobs (OpenAI files + batches, Anthropic message batches) finish after `batch_polls` status checks
+    and answer every request like the regular endpoints.
+
+    Attributes:
+        errors (deque): (status, headers) answered to the next chat / message requests, one per request,
+                        before the server answers normally again.
+        fail_prompts (set): Requests whose prompt contains one of these strings always get a 503, also
+                            inside batches.
+        requests (list): (monotonic time, method, path) of every request received.
+        batch_polls (int): Status checks a batch reports as in progress before it ends.
+        batch_status (str): Final status of OpenAI batches ('completed', 'failed', 'expired', 'cancelled').
+                            Failed batches have no output; expired and cancelled ones only the first
+                            `batch_processed` answers.
+        batch_processed (int): Requests answered by an expired or cancelled batch.
+        submitted (list): custom_ids of every batch submitted, in submission order.
+    """
+
+    def __init__(self):
+        self.errors = deque()
+        self.fail_prompts = set()
+        self.requests = []
+        self.batch_polls = 1
+        self.batch_status = 'completed'
+        self.batch_processed = 0
+        self.submitted = []
+        self._files = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so the clients' connection reuse can be observed
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self, 'GET')
+
+            def do_POST(self):
+                fake._handle(self, 'POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def calls(self, path):
+        """
+        Times of the requests received for `path`.
+        """
+        return [t for t, _, p in self.requests if p == path]
+
+    # -----------------------------------------------------------------------
+    # request handling
+
+    def _handle(self, handler, method):
+        length = int(handler.headers.get('content-length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        with self._lock:
+            self.requests.append((time.monotonic(), method, handler.path))
+        path = handler.path.split('?')[0]
+        parts = path.strip('/').split('/')
+        routes = {
+            ('POST', '/v1/chat/completions'): self._chat_completion,
+            ('POST', '/v1/messages'): self._message,
+            ('POST', '/v1/files'): self._upload_file,
+            ('POST', '/v1/batches'): self._create_openai_batch,
+            ('POST', '/v1/messages/batches'): self._create_anthropic_batch,
+        }
+        route = routes.get((method, path))
+        if route is None and method == 'GET':
+            if parts[:2] == ['v1', 'batches'] and len(parts) == 3:
+                route = lambda handler, body: self._openai_batch(parts[2])
+            elif parts[:2] == ['v1', 'files'] and parts[3:] == ['content']:
+                return self._send(handler, 200, self._files[parts[2]], content_type='application/octet-stream')
+            elif parts[:3] == ['v1', 'messages', 'batches'] and len(parts) == 4:
+                route = lambda handler, body: self._anthropic_batch(parts[3])
+            elif parts[:3] == ['v1', 'messages', 'batches'] and parts[4:] == ['results']:
+                return self._send(handler, 200, self._anthropic_results(parts[3]), content_type='application/binary')
+        if route is None:
+            return self._send(handler, 404, {'error': {'message': f'no route {method} {handler.path}'}})
+        status, payload, headers = route(handler, body)
+        self._send(handler, status, payload, headers)
+
+    def _send(self, handler, status, payload, headers=None, content_type='application/json'):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('content-type', content_type)
+        handler.send_header('content-length', str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _scripted_error(self, prompt):
+        if any(marker in prompt for marker in self.fail_prompts):
+            return 503, {'error': {'type': 'overloaded_error', 'message': 'overloaded'}}, {}
+        with self._lock:
+            if not self.errors:
+                return None
+            status, headers = self.errors.popleft()
+        return status, {'type': 'error', 'error': {'type': 'rate_limit_error' if status == 429 else 'api_error',
+                                                    'message': f'scripted {status}'}}, headers
+
+    def _chat_completion(self, handler, body):
+        request = json.loads(body)
+        prompt = request['messages'][-1]['content']
+        error = self._scripted_error(prompt)
+        if error:
+            return error
+        return 200, chat_completion(request['model'], prompt), {}
+
+    def _message(self, handler, body):
+        request = json.loads(body)
+        prompt = prompt_of_message(request)
+        error = self._scripted_error(prompt)
+        if error:
+            return error
+        return 200, message(request['model'], prompt), {}
+
+    # -----------------------------------------------------------------------
+    # batches
+
+    def _upload_file(self, handler, body):
+        # multipart/form-data with the JSONL in the part that has a file name
+        form = email.message_from_bytes(b'content-type: ' + handler.headers['content-type'].encode() + b'\r\n\r\n' + body)
+        content = next(part.get_payload(decode=True) for part in form.get_payload() if part.get_filename())
+        with self._lock:
+            file_id = f'file-{len(self._files)}'
+            self._files[file_id] = content
+        return 200, {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                     'filename': 'batch.jsonl', 'purpose': 'batch', 'status': 'processed'}, {}
+
+    def _new_batch(self, provider, requests):
+        with self._lock:
+            batch_id = f'batch_{len(self._batches)}'
+            self._batches[batch_id] = {'provider': provider, 'requests': requests, 'polls': 0}
+            self.submitted.append([request['custom_id'] for request in requests])
+        return batch_id
+
+    def _poll(self, batch_id):
+        batch = self._batches[batch_id]
+        batch['polls'] += 1
+        return batch, batch['polls'] > self.batch_polls
+
+    def _create_openai_batch(self, handler, body):
+        request = json.loads(body)
+        lines = self._files[request['input_file_id']].decode('utf-8').splitlines()
+        batch_id = self._new_batch('openai', [json.loads(line) for line in lines if line.strip()])
+        return 200, self._openai_batch_object(batch_id, 'validating'), {}
+
+    def _openai_batch(self, batch_id):
+        batch, ended = self._poll(batch_id)
+        if not ended:
+            return 200, self._openai_batch_object(batch_id, 'in_progress'), {}
+        output_file_id = None
+        if self.batch_status != 'failed':
+            requests = batch['requests']
+            if self.batch_status != 'completed':
+                requests = requests[:self.batch_processed]
+            lines = []
+            for request in requests:
+                prompt = request['body']['messages'][-1]['content']
+                if any(marker in prompt for marker in self.fail_prompts):
+                    response = {'status_code': 500, 'body': {'error': {'message': 'failed'}}}
+                else:
+                    response = {'status_code': 200, 'body': chat_completion(request['body']['model'], prompt)}
+                lines.append(json.dumps({'id': 'req', 'custom_id': request['custom_id'], 'response': response,
+                                         'error': None}))
+            output_file_id = f'{batch_id}-output'
+            self._files[output_file_id] = '\n'.join(lines).encode('utf-8')
+        return 200, self._openai_batch_object(batch_id, self.batch_status, output_file_id), {}
+
+    def _openai_batch_object(self, batch_id, status, output_file_id=None):
+        return {'id': batch_id, 'object': 'batch', 'endpoint': '/v1/chat/completions', 'input_file_id': 'file',
+                'completion_window': '24h', 'status': status, 'created_at': int(time.time()),
+                'output_file_id': output_file_id, 'error_file_id': None}
+
+    def _create_anthropic_batch(self, handler, body):
+        batch_id = self._new_batch('anthropic', json.loads(body)['requests'])
+        return 200, self._anthropic_batch_object(batch_id, 'in_progress'), {}
+
+    def _anthropic_batch(self, batch_id):
+        _, ended = self._poll(batch_id)
+        return 200, self._anthropic_batch_object(batch_id, 'ended' if ended else 'in_progress'), {}
+
+    def _anthropic_batch_object(self, batch_id, status):
+        ended = status == 'ended'
+        return {'id': batch_id, 'type': 'message_batch', 'processing_status': status,
+                'request_counts': {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0},
+                'created_at': '2025-01-01T00:00:00Z', 'expires_at': '2025-01-02T00:00:00Z',
+                'ended_at': '2025-01-01T01:00:00Z' if ended else None, 'archived_at': None,
+                'cancel_initiated_at': None,
+                'results_url': f'{self.url}/v1/messages/batches/{batch_id}/results' if ended else None}
+
+    def _anthropic_results(self, batch_id):
+        lines = []
+        for request in self._batches[batch_id]['requests']:
+            prompt = prompt_of_message(request['params'])
+            if any(marker in prompt for marker in self.fail_prompts):
+                result = {'type': 'errored', 'error': {'type': 'error',
+                                                       'error': {'type': 'api_error', 'message': 'failed'}}}
+            else:
+                result = {'type': 'succeeded', 'message': message(request['params']['model'], prompt)}
+            lines.append(json.dumps({'custom_id': request['custom_id'], 'result': result}))
+        return '\n'.join(lines).encode('utf-8')
+
+
+def answer_text(prompt):
+    """
+    The fake model's answer to a prompt.
+    """
+    return f'answer to {prompt}'
+
+
+def prompt_of_message(request):
+    content = request['messages'][-1]['content']
+    if isinstance(content, list):
+        content = ''.join(block['text'] for block in content)
+    return content
+
+
+def chat_completion(model, prompt):
+    return {
+        'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': answer_text(prompt)}}],
+        'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20},
+    }
+
+
+def message(model, prompt):
+    return {
+        'id': 'msg_fake', 'type': 'message', 'role': 'assistant', 'model': model,
+        'content': [{'type': 'text', 'text': answer_text(prompt)}],
+        'stop_reason': 'end_turn', 'stop_sequence': None,
+        'usage': {'input_tokens': 10, 'output_tokens': 10},
+    }
@@ -0,0 +1,35 @@
+from answer_extraction import extract_answer
+
+
+def test_fenced_json_is_preferred_over_prose_objects():
+    text = 'My notes {"draft": true}\n```json\n{"answer": 42, "units": "kg"}\n```\nDone.'
+
+    assert extract_answer(text) == ({'answer': 42, 'units': 'kg'}, 'none')
+
+
+def test_bare_object_in_prose():
+    text = 'Here is my submission: {"task_1": "B", "task_2": {"total": 3}} Thanks!'
+
+    assert extract_answer(text) == ({'task_1': 'B', 'task_2': {'total': 3}}, 'none')
+
+
+def test_almost_json_is_repaired():
+    text = "```json\n{'revenue': 1,250,000, // estimate\n 'items': [1, 2,],}\n```"
+
+    answer, repair = extract_answer(text)
+
+    assert answer == {'revenue': 1250000, 'items': [1, 2]}
+    assert repair == 'comments+trailing_commas+single_quotes+thousands_separators'
+
+
+def test_truncated_json_gives_no_answer():
+    text = '```json\n{"answer": 42, "explanation": "the total is'
+
+    assert extract_answer(text) == (None, None)
+    assert extract_answer(None) == (None, None)
+
+
+def test_truncated_object_falls_back_to_a_complete_one():
+    text = 'Final: {"answer": 42}\n\nRevised: {"answer": 43, "note": "cut'
+
+    assert extract_answer(text) == ({'answer': 42}, 'none')
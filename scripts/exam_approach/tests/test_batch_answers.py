@@ -0,0 +1,68 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from batch_answers import answer_exams_batch
+from fake_provider import answer_text
+
+
+@pytest.fixture
+def answers_file(tmp_path):
+    path = tmp_path / 'test_answers_nurses.csv'
+    pd.DataFrame({
+        'occupation': ['nurse'] * 3,
+        'exam': ['exam one', 'Exam not valid', 'exam three'],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def records(answers_file):
+    with open(os.path.join(os.path.dirname(answers_file), 'batches', 'batches.json')) as f:
+        return json.load(f)
+
+
+def test_openai_batch_answers_are_written(fake_provider, answers_file):
+    fake_provider.batch_polls = 2
+
+    df = answer_exams_batch(answers_file, {'gpt': 'gpt-4o'}, poll_interval=0)
+
+    assert df['test_answers_gpt'].tolist()[0::2] == [answer_text('exam one'), answer_text('exam three')]
+    assert fake_provider.submitted == [['row-0', 'row-2']]
+    assert records(answers_file) == {}
+    assert pd.read_csv(answers_file)['test_answers_gpt'][0] == answer_text('exam one')
+
+
+def test_errored_requests_are_resubmitted(fake_provider, answers_file):
+    candidates = {'claude': 'claude-3-7-sonnet-20250219'}
+    fake_provider.fail_prompts.add('three')
+
+    df = answer_exams_batch(answers_file, candidates, poll_interval=0)
+    assert df['test_answers_claude'][0] == answer_text('exam one')
+    assert df['test_answers_claude'][2] == ''
+
+    fake_provider.fail_prompts.clear()
+    df = answer_exams_batch(answers_file, candidates, poll_interval=0)
+
+    assert fake_provider.submitted == [['row-0', 'row-2'], ['row-2']]
+    assert df['test_answers_claude'][2] == answer_text('exam three')
+
+    answer_exams_batch(answers_file, candidates, poll_interval=0)
+    assert len(fake_provider.submitted) == 2
+
+
+@pytest.mark.parametrize('status', ['failed', 'expired'])
+def test_unfinished_batch_is_resubmitted(fake_provider, answers_file, status):
+    fake_provider.batch_status = status
+    fake_provider.batch_processed = 1
+
+    df = answer_exams_batch(answers_file, {'gpt': 'gpt-4o'}, poll_interval=0)
+    assert records(answers_file) == {}
+
+    fake_provider.batch_status = 'completed'
+    df = answer_exams_batch(answers_file, {'gpt': 'gpt-4o'}, poll_interval=0)
+
+    resubmitted = ['row-0', 'row-2'] if status == 'failed' else ['row-2']
+    assert fake_provider.submitted == [['row-0', 'row-2'], resubmitted]
+    assert df['test_answers_gpt'].tolist()[0::2] == [answer_text('exam one'), answer_text('exam three')]
@@ -0,0 +1,50 @@
+import json
+
+import grading_runner
+from grading_runner import grade_changed_jobs, make_job
+
+SCRIPT = '''
+import sys
+import json
+
+with open(sys.argv[1]) as f:
+    submission = json.load(f)
+with open(sys.argv[2]) as f:
+    answer_key = json.load(f)
+with open('test_results.json', 'w') as f:
+    json.dump({'overall_score': 100.0 if submission == answer_key else 0.0}, f)
+'''
+
+
+def write_json(path, value):
+    path.write_text(json.dumps(value), encoding='utf-8')
+
+
+def test_unchanged_submissions_are_not_regraded(tmp_path, monkeypatch):
+    task = tmp_path / 'task_1'
+    for candidate in ('a', 'b'):
+        (task / candidate).mkdir(parents=True)
+        write_json(task / candidate / 'test_submission.json', {'answer': 42})
+    (task / 'task_evaluation.py').write_text(SCRIPT, encoding='utf-8')
+    write_json(task / 'answer_key.json', {'answer': 42})
+    jobs = [make_job(str(task), 'a'), make_job(str(task), 'b')]
+
+    graded = []
+    grade_jobs = grading_runner.grade_jobs
+
+    def spy(jobs, **kwargs):
+        graded.append([job['candidate'] for job in jobs])
+        return grade_jobs(jobs, **kwargs)
+
+    monkeypatch.setattr(grading_runner, 'grade_jobs', spy)
+
+    first = grade_changed_jobs(jobs, str(tmp_path), workers=1)
+    second = grade_changed_jobs(jobs, str(tmp_path), workers=1)
+    write_json(task / 'b' / 'test_submission.json', {'answer': 41})
+    third = grade_changed_jobs(jobs, str(tmp_path), workers=1)
+
+    assert graded == [['a', 'b'], [], ['b']]
+    assert [o['overall_score'] for o in first] == [100.0, 100.0]
+    assert all(o['skipped'] for o in second)
+    assert third[0]['skipped'] and not third[1].get('skipped')
+    assert third[1]['overall_score'] == 0.0
@@ -0,0 +1,76 @@
+import pytest
+
+from grading_spec import evaluate_spec, validate_spec
+
+ANSWER_KEY = {
+    'forecast': {'q1': 100, 'q2': '2,000'},
+    'top_departments': ['Sales', 'IT', 'HR'],
+    'ranking': ['a', 'b'],
+    'largest_gap': 'Finance',
+}
+SPEC = {
+    'items': [
+        {'path': 'forecast.*', 'type': 'numeric', 'points': 2},
+        {'path': 'top_departments', 'type': 'set', 'points': 3},
+        {'path': 'ranking', 'type': 'list', 'points': 2},
+        {'path': 'largest_gap', 'type': 'exact', 'points': 1},
+    ],
+    'passing_score': 70,
+}
+
+
+def test_valid_spec_has_no_problems():
+    assert validate_spec(SPEC, ANSWER_KEY) == []
+
+
+def test_validate_spec_reports_bad_items_and_paths():
+    assert validate_spec({'items': []}, ANSWER_KEY) == [
+        "The spec must be a JSON object with a non-empty list `items`."]
+    assert validate_spec({'items': [{'path': 'forecast.q1', 'type': 'fuzzy', 'points': 0}]}, ANSWER_KEY) == [
+        "Item forecast.q1 has type 'fuzzy', expected one of ('numeric', 'exact', 'set', 'list').",
+        "Item forecast.q1 needs positive `points`.",
+    ]
+    problems = validate_spec({'items': [{'path': 'forecast.q3', 'type': 'numeric', 'points': 1},
+                                        {'path': 'largest_gap', 'type': 'numeric', 'points': 1},
+                                        {'path': 'largest_gap', 'type': 'set', 'points': 1}]}, ANSWER_KEY)
+    assert problems == [
+        "Path forecast.q3 does not exist in the answer key.",
+        "Path largest_gap is scored as numeric but the answer key holds 'Finance'.",
+        "Path largest_gap is scored as a set but the answer key does not hold a list.",
+    ]
+
+
+@pytest.mark.parametrize('answer, share', [
+    (100, 1.0), (101.9, 1.0), (104, 0.75), (109, 0.5), (119, 0.25), (121, 0.0), ('95%', 0.75), ('n/a', 0.0),
+])
+def test_numeric_tiers(answer, share):
+    spec = {'items': [{'path': 'forecast.q1', 'type': 'numeric', 'points': 4}]}
+
+    result, = evaluate_spec(spec, ANSWER_KEY, [{'forecast': {'q1': answer}}])
+
+    assert result['points'] == 4 * share
+
+
+def test_custom_tiers_and_absolute_tolerance():
+    spec = {'items': [{'path': 'forecast.q1', 'type': 'numeric', 'points': 1, 'tiers': [[1, 1.0], [50, 0.1]]},
+                      {'path': 'forecast.q2', 'type': 'numeric', 'points': 1, 'tolerance_abs': 5}]}
+
+    result, = evaluate_spec(spec, ANSWER_KEY, [{'forecast': {'q1': 140, 'q2': 2004}}])
+
+    assert result['details'] == {'forecast.q1': {'points': 0.1, 'max_points': 1.0},
+                                 'forecast.q2': {'points': 1.0, 'max_points': 1.0}}
+
+
+def test_batch_scores_every_item_type():
+    perfect = {'forecast': {'q1': 100, 'q2': 2000}, 'top_departments': ['hr', 'it', 'sales'],
+               'ranking': ['a', 'b'], 'largest_gap': 'finance'}
+    partial = {'forecast': {'q1': 104}, 'top_departments': ['Sales'], 'ranking': ['b', 'b'],
+               'largest_gap': 'Legal'}
+
+    results = evaluate_spec(SPEC, ANSWER_KEY, [perfect, partial, 'not a submission'])
+
+    assert [r['overall_score'] for r in results] == [100.0, 35.0, 0.0]
+    assert [r['passed'] for r in results] == [True, False, False]
+    # q1 within 5%, q2 missing, 1 of 3 departments, 1 of 2 positions, wrong gap
+    assert results[1]['points'] == 1.5 + 0 + 1 + 1 + 0
+    assert results[1]['max_points'] == 10.0
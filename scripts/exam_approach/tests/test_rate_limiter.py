@@ -0,0 +1,106 @@
+import pandas as pd
+import pytest
+
+import query_agents
+import rate_limiter
+import response_cache
+from query_agents import client_stats, query_agent, query_many, take_tests
+from rate_limiter import ProviderLimiter, RetriesExhausted, get_limiter
+from fake_provider import answer_text
+
+
+def test_retry_after_is_honoured(fake_provider):
+    fake_provider.errors.append((429, {'retry-after': '0.5'}))
+
+    response = query_agent('system', 'exam', 'gpt-4o')
+
+    assert response[0] == answer_text('exam')
+    first, second = fake_provider.calls('/v1/chat/completions')
+    assert second - first >= 0.5
+    limiter = get_limiter('openai')
+    assert limiter.rate_limited == 1
+    assert limiter.requests.rate < limiter.rpm / 60
+
+
+def test_retry_after_ms_and_overload(fake_provider):
+    fake_provider.errors.extend([(429, {'retry-after-ms': '300'}), (529, {'retry-after': '0'})])
+
+    response = query_agent('system', 'exam', 'claude-3-7-sonnet-20250219')
+
+    assert response[0] == answer_text('exam')
+    calls = fake_provider.calls('/v1/messages')
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.3
+
+
+def test_exhausted_retries_raise(fake_provider, monkeypatch):
+    monkeypatch.setenv('OPENAI_RETRIES', '2')
+    fake_provider.errors.extend([(503, {'retry-after': '0'})] * 5)
+
+    with pytest.raises(RetriesExhausted) as info:
+        query_agent('system', 'exam', 'gpt-4o')
+
+    assert info.value.attempts == 3
+    assert len(fake_provider.calls('/v1/chat/completions')) == 3
+
+
+def test_client_error_is_not_retried(fake_provider):
+    fake_provider.errors.append((400, {}))
+
+    assert query_agent('system', 'exam', 'gpt-4o') is None
+    assert len(fake_provider.calls('/v1/chat/completions')) == 1
+
+
+def test_take_tests_keeps_exhausted_rows_apart(fake_provider, monkeypatch):
+    monkeypatch.setenv('OPENAI_RETRIES', '1')
+    monkeypatch.setenv('OPENAI_RETRY_DELAY', '0.01')
+    fake_provider.fail_prompts.add('broken')
+    df = pd.DataFrame({'occupation': ['nurse', 'nurse'], 'exam': ['exam one', 'broken exam']})
+
+    answers = take_tests(df, 'You are a {occupation}.', 'gpt-4o')
+
+    assert answers == [answer_text('exam one'), None]
+
+
+def test_aimd_rate_recovers_after_rate_limit(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda seconds: None)
+    limiter = ProviderLimiter(rpm=600, tpm=10**6)
+
+    limiter.on_rate_limited(0)
+    limiter.on_rate_limited(0)
+    assert limiter.requests.rate == pytest.approx(10 * 0.7 * 0.7)
+
+    for _ in range(100):
+        limiter.on_success(0, None)
+    assert limiter.requests.rate == pytest.approx(10)
+
+
+def test_query_many_passes_temperature_and_use_cache(fake_provider, monkeypatch, tmp_path):
+    monkeypatch.setenv('LLM_CACHE_MODE', 'readwrite')
+    monkeypatch.setenv('LLM_CACHE_PATH', str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(response_cache, '_cache', None)
+
+    query_many([('system', 'exam', 'gpt-4o', 0)])
+    responses = query_many([
+        ('system', 'exam', 'gpt-4o', 0),          # cached
+        ('system', 'exam', 'gpt-4o', 0, False),   # cache bypassed
+        ('system', 'exam', 'gpt-4o', 0.7),        # sampled calls are never cached
+    ])
+
+    assert [response[0] for response in responses] == [answer_text('exam')] * 3
+    assert len(fake_provider.calls('/v1/chat/completions')) == 3
+
+
+def test_client_stats_leave_untraced_transports_unmeasured(fake_provider, monkeypatch):
+    monkeypatch.setattr(query_agents, '_client_stats', {})
+    query_agent('system', 'exam', 'gpt-4o')
+    query_agent('system', 'exam two', 'gpt-4o')
+    with query_agents.track_request('google'):
+        pass
+
+    stats = client_stats()
+
+    assert stats['openai']['new_connections'] == 1
+    assert stats['openai']['connection_reuse'] == 0.5
+    assert stats['google']['requests'] == 1
+    assert stats['google']['connection_reuse'] is None
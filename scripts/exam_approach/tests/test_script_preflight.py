@@ -0,0 +1,97 @@
+import textwrap
+
+from script_preflight import preflight_script
+
+GOOD_SCRIPT = '''
+import sys
+import json
+
+def main():
+    with open(sys.argv[1]) as f:
+        submission = json.load(f)
+    with open(sys.argv[2]) as f:
+        answer_key = json.load(f)
+    score = 100.0 if submission == answer_key else 0.0
+    with open('test_results.json', 'w') as f:
+        json.dump({'overall_score': score}, f)
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+def script(body):
+    return textwrap.dedent(body)
+
+
+def test_good_script_passes():
+    assert preflight_script(GOOD_SCRIPT) == []
+
+
+def test_argparse_with_two_positionals_passes():
+    source = GOOD_SCRIPT.replace('def main():', '''def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('submission')
+    parser.add_argument('answer_key')
+    parser.add_argument('--verbose')
+    parser.parse_args()''')
+
+    assert preflight_script(source) == []
+
+
+def test_syntax_error():
+    assert preflight_script('def main(:\n    pass\n') == ["The script is not valid Python: invalid syntax (line 1)."]
+
+
+def test_forbidden_imports_and_calls():
+    source = GOOD_SCRIPT + script('''
+        import subprocess
+        from urllib.request import urlopen
+        os.system('rm -rf results')
+        eval('1 + 1')
+        open('/etc/passwd')
+        ''')
+
+    assert preflight_script(source) == [
+        "Line 17: importing `subprocess` is not allowed, the script must work offline on the two JSON files only.",
+        "Line 18: importing `urllib.request` is not allowed, the script must work offline on the two JSON files only.",
+        "Line 19: calling `os.system` is not allowed in a grading script.",
+        "Line 20: calling `eval` is not allowed in a grading script.",
+        "Line 21: the script opens `/etc/passwd`; it may only use the files passed on the command line and "
+        "`test_results.json`.",
+    ]
+
+
+def test_missing_argv_results_and_score():
+    source = script('''
+        import json
+        with open('submission.json') as f:
+            submission = json.load(f)
+        print(submission)
+        ''')
+
+    assert preflight_script(source) == [
+        "The script does not read the submission and answer key file names from the command line "
+        "(sys.argv[1] and sys.argv[2]).",
+        "The script never writes its results to `test_results.json`.",
+        "The results do not contain an `overall_score` key.",
+    ]
+
+
+def test_wrong_argv_indexes():
+    source = GOOD_SCRIPT.replace('sys.argv[2]', 'sys.argv[3]')
+
+    assert preflight_script(source) == [
+        "The script reads sys.argv[1, 3] but must take the submission from sys.argv[1] and the answer key "
+        "from sys.argv[2]."]
+
+
+def test_single_positional_argument():
+    source = GOOD_SCRIPT.replace('def main():', '''def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('submission')''')
+
+    assert preflight_script(source) == [
+        "The script must accept two command line arguments: the submission file and the answer key file."]